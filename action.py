@@ -1,7 +1,13 @@
-from typing import Dict, Any, Union
+from typing import Callable, Dict, Any, List, Optional, Tuple, Union
 from pydantic import BaseModel
 from mcp import ClientSession
 import ast
+import asyncio
+import json
+import os
+import time
+from perception import PerceptionResult
+from tracing import traced, annotate
 
 # Optional: import log from agent if shared, else define locally
 try:
@@ -9,7 +15,7 @@ try:
 except ImportError:
     import datetime
     def log(stage: str, msg: str):
-        now = datetime.datetime.now().strftime("%H:%M:%S")
+        now = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
         print(f"[{now}] [{stage}] {msg}")
 
 
@@ -18,6 +24,7 @@ class ToolCallResult(BaseModel):
     arguments: Dict[str, Any]
     result: Union[str, list, dict]
     raw_response: Any
+    cached: bool = False
 
 
 def parse_function_call(response: str) -> tuple[str, Dict[str, Any]]:
@@ -56,11 +63,19 @@ def parse_function_call(response: str) -> tuple[str, Dict[str, Any]]:
         raise
 
 
+def parse_plan(plan: str) -> List[str]:
+    """Splits a plan into its FUNCTION_CALL lines; a plan may batch several independent calls."""
+    return [line.strip() for line in plan.splitlines() if line.strip().startswith("FUNCTION_CALL:")]
+
+
+@traced("execute_tool")
 async def execute_tool(session: ClientSession, tools: list[Any], response: str) -> ToolCallResult:
     """Executes a FUNCTION_CALL via MCP tool session."""
     try:
         tool_name, arguments = parse_function_call(response)
 
+        annotate(tool=tool_name)
+
         tool = next((t for t in tools if t.name == tool_name), None)
         if not tool:
             raise ValueError(f"Tool '{tool_name}' not found in registered tools")
@@ -87,3 +102,249 @@ async def execute_tool(session: ClientSession, tools: list[Any], response: str)
     except Exception as e:
         log("tool", f"⚠️ Execution failed for '{response}': {e}")
         raise
+
+
+# Start the call a perception's tool hint suggests while the plan is being generated
+TOOL_PREFETCH = os.getenv("TOOL_PREFETCH", "1") != "0"
+
+# Read-only tools that are safe to call speculatively, and the arguments a perception suggests for each
+PREFETCH_GUESSES: Dict[str, Callable[[PerceptionResult], Optional[Dict[str, Any]]]] = {
+    "search_documents": lambda p: {"query": " ".join(p.entities)} if p.entities else None,
+    "search_2050_products": lambda p: {"input": {"product_name": p.entities[0]}} if p.entities else None,
+}
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.strip().strip("\"'").lower().split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+class ToolPrefetcher:
+    """Speculatively runs the tool call a perception hints at while the planner is still thinking.
+
+    start() launches the guessed call and plan_ready() marks when the plan
+    arrived; take() hands the result to a planned call with the same tool and
+    arguments (compared case- and whitespace-insensitively), otherwise it is
+    discarded. Every speculative call records whether it hit and how much
+    tool time overlapped planning. Calls the cache already holds are not started.
+    """
+
+    def __init__(self, session: ClientSession, tools: list[Any], cache: Optional["ToolResultCache"] = None):
+        self.session = session
+        self.tools = tools
+        self.cache = cache
+        self.steps: List[Dict[str, Any]] = []
+        self._names = {t.name for t in tools}
+        self._pending: Optional[Dict[str, Any]] = None
+        self._plan_ready: Optional[float] = None
+        self._discarded: List[asyncio.Task] = []
+
+    def start(self, step: int, perception: PerceptionResult) -> None:
+        self.discard()
+        self._plan_ready = None
+        guess = PREFETCH_GUESSES.get(perception.tool_hint or "")
+        arguments = guess(perception) if guess and perception.tool_hint in self._names else None
+        if arguments is None:
+            return
+        call = f"FUNCTION_CALL: {perception.tool_hint}|" + "|".join(
+            f"{key}={value!r}" for key, value in _flatten(arguments).items()
+        )
+        if self.cache is not None and call in self.cache:
+            return
+        pending = {"step": step, "tool": perception.tool_hint, "arguments": arguments, "started": time.perf_counter(),
+                   "finished": None}
+        task = asyncio.create_task(execute_tool(self.session, self.tools, call))
+        task.add_done_callback(lambda t: pending.update(finished=time.perf_counter()))
+        pending["task"] = task
+        self._pending = pending
+        log("prefetch", f"Started {perception.tool_hint} with {arguments}")
+
+    def plan_ready(self) -> None:
+        self._plan_ready = time.perf_counter()
+
+    async def take(self, call: str) -> Optional[ToolCallResult]:
+        """The prefetched result if it answers this planned call"""
+        pending = self._pending
+        if pending is None:
+            return None
+        try:
+            tool_name, arguments = parse_function_call(call)
+        except Exception:
+            return None
+        if tool_name != pending["tool"] or _normalize(arguments) != _normalize(pending["arguments"]):
+            return None
+        self._pending = None
+        try:
+            result = await pending["task"]
+        except Exception as e:
+            log("prefetch", f"Prefetched {tool_name} failed, calling it again: {e}")
+            self._record(pending, hit=False)
+            return None
+        # Tool time that overlapped planning, and so is no longer on the step's critical path
+        finished = pending["finished"] or time.perf_counter()
+        saved_ms = (min(finished, self._plan_ready or finished) - pending["started"]) * 1000
+        self._record(pending, hit=True, saved_ms=saved_ms)
+        log("prefetch", f"Hit: {tool_name} result reused, {saved_ms:.0f} ms saved")
+        return result
+
+    def discard(self) -> None:
+        """Drops an unused speculative call; it finishes in the background and its result is ignored"""
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        pending["task"].add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._discarded = [t for t in self._discarded if not t.done()] + [pending["task"]]
+        self._record(pending, hit=False)
+
+    async def close(self) -> None:
+        """Discards any pending call and waits for discarded ones, so none outlives the MCP session"""
+        self.discard()
+        await asyncio.gather(*self._discarded, return_exceptions=True)
+        self._discarded = []
+
+    def _record(self, pending: Dict[str, Any], hit: bool, saved_ms: float = 0.0) -> None:
+        self.steps.append({"step": pending["step"], "tool": pending["tool"], "hit": hit,
+                           "saved_ms": round(saved_ms, 3)})
+
+    @property
+    def hit_rate(self) -> float:
+        return sum(s["hit"] for s in self.steps) / len(self.steps) if self.steps else 0.0
+
+
+def _flatten(arguments: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """Dot-notation keys, as parse_function_call expects them"""
+    flat: Dict[str, Any] = {}
+    for key, value in arguments.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+# Serve repeated tool calls within a session from their first result
+TOOL_CACHE = os.getenv("TOOL_CACHE", "1") != "0"
+# Steps made up only of repeated calls before the planner is made to give its final answer
+LOOP_REPEATS = int(os.getenv("LOOP_REPEATS", "2"))
+
+# Whether a tool's result depends only on its arguments; unlisted tools are never cached
+TOOL_CACHEABLE: Dict[str, bool] = {
+    "search_documents": True,
+    "search_documents_batch": True,
+    "search_2050_products": True,
+    "ai_form_schemer": True,
+    "add": True,
+    "subtract": True,
+    "multiply": True,
+    "divide": True,
+    "upload_document": False,
+}
+# Tools that change what cached searches would return
+CACHE_INVALIDATING_TOOLS = {"upload_document"}
+
+
+class ToolResultCache:
+    """Per-session results of cacheable tool calls, keyed on tool name and canonical arguments.
+
+    Arguments are compared the way the prefetcher compares them, so a call
+    that differs only in case, quoting or whitespace is a repeat. step_done()
+    counts steps whose calls were all repeats; after LOOP_REPEATS of them
+    loop_detected is set and the caller should ask for a final answer.
+    stats is updated in place and can be reported while the session runs.
+    """
+
+    def __init__(self, max_repeats: int = LOOP_REPEATS):
+        self.max_repeats = max_repeats
+        self.stats: Dict[str, Any] = {"calls": 0, "hits": 0, "repeated_steps": 0, "loop_detected": False,
+                                      "steps_saved": 0}
+        self._results: Dict[Tuple[str, str], ToolCallResult] = {}
+
+    @staticmethod
+    def key(tool_name: str, arguments: Dict[str, Any]) -> Tuple[str, str]:
+        return tool_name, json.dumps(_normalize(arguments), sort_keys=True, default=str)
+
+    def get(self, call: str) -> Optional[ToolCallResult]:
+        try:
+            tool_name, arguments = parse_function_call(call)
+        except Exception:
+            return None
+        cached = self._results.get(self.key(tool_name, arguments))
+        if cached is None:
+            return None
+        self.stats["hits"] += 1
+        log("cache", f"Repeated {tool_name} with {arguments}, served from cache")
+        return cached.model_copy(update={"cached": True})
+
+    def put(self, result: ToolCallResult) -> None:
+        self.stats["calls"] += 1
+        if result.tool_name in CACHE_INVALIDATING_TOOLS:
+            self._results.clear()
+        elif TOOL_CACHEABLE.get(result.tool_name, False):
+            self._results[self.key(result.tool_name, result.arguments)] = result
+
+    def __contains__(self, call: str) -> bool:
+        try:
+            return self.key(*parse_function_call(call)) in self._results
+        except Exception:
+            return False
+
+    def step_done(self, results: List[ToolCallResult]) -> bool:
+        """Records a step's results; True if every call in it was a repeat"""
+        repeated = bool(results) and all(r.cached for r in results)
+        if repeated:
+            self.stats["repeated_steps"] += 1
+            if self.stats["repeated_steps"] >= self.max_repeats and not self.stats["loop_detected"]:
+                self.stats["loop_detected"] = True
+                log("cache", f"Loop detected after {self.stats['repeated_steps']} repeated steps")
+        return repeated
+
+    @property
+    def loop_detected(self) -> bool:
+        return self.stats["loop_detected"]
+
+
+@traced("execute_tools")
+async def execute_tools(session: ClientSession, tools: list[Any], plan: str,
+                        prefetcher: Optional[ToolPrefetcher] = None,
+                        cache: Optional[ToolResultCache] = None) -> List[ToolCallResult]:
+    """Executes every FUNCTION_CALL in a plan concurrently over the MCP session.
+
+    Results come back in plan order so callers can merge them into memory
+    deterministically. If any call fails the first error is raised once all
+    calls have settled. A call the prefetcher already started reuses its result,
+    and a repeated call is answered from the cache without a round trip.
+    """
+    calls = parse_plan(plan) or [plan]
+    annotate(calls=len(calls))
+
+    async def run(call: str) -> ToolCallResult:
+        cached = cache.get(call) if cache is not None else None
+        if cached is not None:
+            return cached
+        prefetched = await prefetcher.take(call) if prefetcher is not None else None
+        result = prefetched or await execute_tool(session, tools, call)
+        if cache is not None:
+            cache.put(result)
+        return result
+
+    try:
+        if len(calls) == 1:
+            return [await run(calls[0])]
+
+        log("tool", f"Dispatching {len(calls)} calls concurrently")
+        outcomes = await asyncio.gather(
+            *(run(call) for call in calls),
+            return_exceptions=True
+        )
+    finally:
+        if prefetcher is not None:
+            prefetcher.discard()
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+    return list(outcomes)
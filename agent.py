@@ -4,9 +4,11 @@ import os
 import datetime
 import socket
 from perception import extract_perception
-from memory import MemoryManager, MemoryItem
+from memory import MemoryManager, MemoryItem, DEFAULT_STORE_DIR
 from decision import generate_plan
-from action import execute_tool
+from context_budget import ContextBudget, compact
+from action import TOOL_CACHE, TOOL_PREFETCH, ToolPrefetcher, ToolResultCache, execute_tools
+from tracing import set_session, span
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 # Try to import tcp_client, but don't fail if it's not available
@@ -23,7 +25,7 @@ from dotenv import load_dotenv
 import subprocess
 
 def log(stage: str, msg: str):
-    now = datetime.datetime.now().strftime("%H:%M:%S")
+    now = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
     print(f"[{now}] [{stage}] {msg}")
 
 max_steps = 30
@@ -40,6 +42,8 @@ async def main(user_input: str):
     try:
         print("[agent] Starting agent...")
         print(f"[agent] Current working directory: {os.getcwd()}")
+        session_id = f"session-{int(time.time())}"
+        set_session(session_id)
         
         # Check if an MCP server is already running on the standard port (8080)
         # and if we have the TCP client available
@@ -56,7 +60,8 @@ async def main(user_input: str):
                         print("[agent] MCP session initialized")
                         
                         # Process the agent session
-                        await process_agent_session(session, user_input)
+                        with span("agent.session"):
+                            await process_agent_session(session, user_input, session_id)
                         return  # Exit after processing
             except Exception as e:
                 print(f"[agent] Failed to connect to existing MCP server: {str(e)}")
@@ -72,7 +77,8 @@ async def main(user_input: str):
             command="python",
             args=["mcp-server.py"],
             cwd="./.",
-            env=os.environ  # Pass the environment variables to the subprocess
+            # Pass the environment variables to the subprocess, tagged with our session for tracing
+            env={**os.environ, "AGENT_SESSION_ID": session_id}
         )
 
         try:
@@ -87,7 +93,8 @@ async def main(user_input: str):
                             print("[agent] MCP session initialized")
                             
                             # Process the agent session
-                            await process_agent_session(session, user_input)
+                            with span("agent.session"):
+                                await process_agent_session(session, user_input, session_id)
                             
                         except Exception as e:
                             print(f"[agent] Session initialization error: {str(e)}")
@@ -151,7 +158,7 @@ async def main(user_input: str):
         finally:
             log("agent", "Agent session complete.")
 
-async def process_agent_session(session, user_input):
+async def process_agent_session(session, user_input, session_id=None):
     """Process an agent session with the given MCP session and user input"""
     # Your reasoning, planning, perception etc. would go here
     tools = await session.list_tools()
@@ -168,103 +175,159 @@ async def process_agent_session(session, user_input):
 
     log("agent", f"{len(tools)} tools loaded")
 
-    memory = MemoryManager()
-    session_id = f"session-{int(time.time())}"
+    # Durable memory partitioned by user, so later sessions can reuse earlier tool outputs
+    # Writes are queued and embedded in the background while the next step's LLM calls run
+    memory = MemoryManager(
+        store_dir=DEFAULT_STORE_DIR,
+        user_id=os.getenv("AGENT_USER_ID", "default"),
+        write_behind=True
+    )
+    session_id = session_id or f"session-{int(time.time())}"
     query = user_input  # Store original intent
     step = 0
     results_so_far = {}  # New: store important results
+    # Keeps memories and previous results in the prompts within a token budget
+    budget = ContextBudget()
+    # Answers repeated tool calls without a round trip and detects planning loops
+    cache = ToolResultCache() if TOOL_CACHE else None
+    # Runs the tool a perception hints at while the plan is generated
+    prefetcher = ToolPrefetcher(session, tools, cache) if TOOL_PREFETCH else None
 
-    while step < max_steps:
-        log("loop", f"Step {step + 1} started")
+    try:
+        while step < max_steps:
+            log("loop", f"Step {step + 1} started")
+            budget.start_step(step + 1)
 
-        # Add accumulated results to the user input for better context
-        context_input = user_input
-        if results_so_far:
-            context_input += "\n\nPrevious results: " + ", ".join([f"{k}: {v}" for k, v in results_so_far.items()])
+            # Add accumulated results to the user input for better context
+            context_input = user_input
+            if results_so_far:
+                context_input += "\n\nPrevious results: " + budget.results_text(results_so_far)
         
-        perception = extract_perception(context_input)
-        log("perception", f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}")
+            perception = extract_perception(context_input)
+            log("perception", f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}")
+            if prefetcher:
+                prefetcher.start(step + 1, perception)
 
-        # Improve memory retrieval by including all previous tool outputs
-        retrieved = memory.retrieve(query=context_input, top_k=5, session_filter=session_id)
-        log("memory", f"Retrieved {len(retrieved)} relevant memories")
+            # Improve memory retrieval by including all previous tool outputs
+            # Off the event loop, so the prefetched call started above runs meanwhile
+            retrieved = await asyncio.to_thread(memory.retrieve, query=context_input, top_k=5, session_filter=session_id)
+            # Tool outputs from earlier sessions let repeated questions reuse prior work
+            retrieved += await asyncio.to_thread(memory.retrieve, query=context_input, top_k=3,
+                                                 type_filter="tool_output", exclude_session=session_id)
+            log("memory", f"Retrieved {len(retrieved)} relevant memories")
 
-        plan = generate_plan(perception, retrieved, tool_descriptions=tool_descriptions)
-        log("plan", f"Plan generated: {plan}")
+            # Planned off the event loop so a prefetched tool call can run meanwhile
+            # After a loop of repeated calls the planner must answer with what it has
+            force_final = bool(cache and cache.loop_detected)
+            plan = await asyncio.to_thread(generate_plan, perception, retrieved,
+                                           tool_descriptions=tool_descriptions, budget=budget, force_final=force_final)
+            if prefetcher:
+                prefetcher.plan_ready()
+            log("plan", f"Plan generated: {plan}")
 
-        if plan.startswith("FINAL_ANSWER:"):
-            log("agent", f"✅ FINAL RESULT: {plan}")
-            break
+            if plan.startswith("FINAL_ANSWER:"):
+                if force_final:
+                    # Steps the loop would otherwise have run until max_steps
+                    cache.stats["steps_saved"] = max_steps - step - 1
+                log("agent", f"✅ FINAL RESULT: {plan}")
+                break
 
-        try:
-            result = await execute_tool(session, tools, plan)
-            log("tool", f"{result.tool_name} returned: {result.result}")
+            try:
+                step_results = await execute_tools(session, tools, plan, prefetcher, cache)
+                repeated = cache.step_done(step_results) if cache else False
+                call_keys = [str(step)] if len(step_results) == 1 else [f"{step}_{i}" for i in range(len(step_results))]
 
-            # Store important results based on tool type
-            if result.tool_name in ['add', 'subtract', 'multiply', 'divide']:
-                results_so_far[f"math_{step}"] = result.result
-            elif result.tool_name == 'search_documents':
-                # Extract key information from search results
-                if isinstance(result.result, list) and result.result:
-                    # Store search results with their query to avoid repetition
-                    query_key = str(result.arguments).replace(" ", "_")[:30]  # Create a short key based on the query
-                    results_so_far[f"search_{query_key}"] = f"Retrieved information about: {result.arguments}"
+                # Merge results into memory in plan order
+                new_memories = []
+                for result, call_key in zip(step_results, call_keys):
+                    log("tool", f"{result.tool_name} returned: {result.result}")
+
+                    # Store important results based on tool type
+                    if result.tool_name in ['add', 'subtract', 'multiply', 'divide']:
+                        results_so_far[f"math_{call_key}"] = result.result
+                    elif result.tool_name == 'search_documents':
+                        # Extract key information from search results
+                        if isinstance(result.result, list) and result.result:
+                            # Store search results with their query to avoid repetition
+                            query_key = str(result.arguments).replace(" ", "_")[:30]  # Create a short key based on the query
+                            results_so_far[f"search_{query_key}"] = f"Retrieved information about: {result.arguments}"
+                        
+                            # Explicitly add a summary of what was found to help the agent remember
+                            search_summary = f"Found information about {result.arguments}"
+                            new_memories.append(MemoryItem(
+                                text=f"SEARCH SUMMARY: {search_summary}",
+                                type="fact",
+                                tool_name="search_summary",
+                                user_query=user_input,
+                                tags=["search_summary"],
+                                session_id=session_id
+                            ))
+                    elif result.tool_name == 'ai_form_schemer':
+                        # Handle the ai_form_schemer tool result
+                        form_key = str(result.arguments).replace(" ", "_")[:30]
+                        results_so_far[f"form_schema_{form_key}"] = f"Created form schema for: {result.arguments}"
                     
-                    # Explicitly add a summary of what was found to help the agent remember
-                    search_summary = f"Found information about {result.arguments}"
-                    memory.add(MemoryItem(
-                        text=f"SEARCH SUMMARY: {search_summary}",
-                        type="fact",
-                        tool_name="search_summary",
+                        # Add explicit memory about this form schema creation
+                        new_memories.append(MemoryItem(
+                            text=f"FORM SCHEMA: Created schema for {result.arguments} with result: {result.result}",
+                            type="form_schema",
+                            tool_name="ai_form_schemer",
+                            user_query=user_input,
+                            tags=["form_schema", "ai_form_schemer"],
+                            session_id=session_id
+                        ))
+                    elif result.tool_name.startswith('search_') or result.tool_name.startswith('get_'):
+                        # For all other search/retrieval tools, track what was retrieved
+                        param_key = str(result.arguments).replace(" ", "_")[:30]
+                        results_so_far[f"{result.tool_name}_{param_key}"] = f"Retrieved data about {result.arguments}"
+                    
+                        # Add explicit memory about this retrieval
+                        new_memories.append(MemoryItem(
+                            text=f"RETRIEVAL SUMMARY: Used {result.tool_name} to get information about {result.arguments}",
+                            type="fact",
+                            tool_name=result.tool_name,
+                            user_query=user_input,
+                            tags=["retrieval_summary"],
+                            session_id=session_id
+                        ))
+                
+                    # Stored compacted; whole search chunks would crowd later prompts
+                    new_memories.append(MemoryItem(
+                        text=f"Tool call: {result.tool_name} with {result.arguments}, got: {compact(result.result)}",
+                        type="tool_output",
+                        tool_name=result.tool_name,
                         user_query=user_input,
-                        tags=["search_summary"],
+                        tags=[result.tool_name],
                         session_id=session_id
                     ))
-            elif result.tool_name == 'ai_form_schemer':
-                # Handle the ai_form_schemer tool result
-                form_key = str(result.arguments).replace(" ", "_")[:30]
-                results_so_far[f"form_schema_{form_key}"] = f"Created form schema for: {result.arguments}"
-                
-                # Add explicit memory about this form schema creation
-                memory.add(MemoryItem(
-                    text=f"FORM SCHEMA: Created schema for {result.arguments} with result: {result.result}",
-                    type="form_schema",
-                    tool_name="ai_form_schemer",
-                    user_query=user_input,
-                    tags=["form_schema", "ai_form_schemer"],
-                    session_id=session_id
-                ))
-            elif result.tool_name.startswith('search_') or result.tool_name.startswith('get_'):
-                # For all other search/retrieval tools, track what was retrieved
-                param_key = str(result.arguments).replace(" ", "_")[:30]
-                results_so_far[f"{result.tool_name}_{param_key}"] = f"Retrieved data about {result.arguments}"
-                
-                # Add explicit memory about this retrieval
-                memory.add(MemoryItem(
-                    text=f"RETRIEVAL SUMMARY: Used {result.tool_name} to get information about {result.arguments}",
-                    type="fact",
-                    tool_name=result.tool_name,
-                    user_query=user_input,
-                    tags=["retrieval_summary"],
-                    session_id=session_id
-                ))
-            
-            memory.add(MemoryItem(
-                text=f"Tool call: {result.tool_name} with {result.arguments}, got: {result.result}",
-                type="tool_output",
-                tool_name=result.tool_name,
-                user_query=user_input,
-                tags=[result.tool_name],
-                session_id=session_id
-            ))
 
-            user_input = f"Original task: {query}\nPrevious steps: {results_so_far}\nWhat should I do next?"
+                # Queued as one batch; embedding overlaps the next step's perception call
+                memory.bulk_add(new_memories)
 
-        except Exception as e:
-            log("error", f"Tool execution failed: {e}")
-            break
+                # Previous results are appended once per step, within the budget
+                user_input = f"Original task: {query}\nWhat should I do next?"
+                if repeated:
+                    user_input += ("\nNote: the last step repeated calls already made "
+                                   f"({', '.join(r.tool_name for r in step_results)}); use their results instead.")
 
-        step += 1
+            except Exception as e:
+                log("error", f"Tool execution failed: {e}")
+                break
+
+            step += 1
+
+        if prefetcher:
+            saved = sum(s["saved_ms"] for s in prefetcher.steps)
+            log("prefetch", f"{len(prefetcher.steps)} speculative calls, hit rate {prefetcher.hit_rate:.0%}, "
+                            f"{saved:.0f} ms saved")
+        if cache:
+            log("cache", f"{cache.stats['hits']} repeated calls served from cache, "
+                         f"{cache.stats['repeated_steps']} repeated steps, {cache.stats['steps_saved']} steps saved")
+    finally:
+        # Runs when the loop fails too, so no prefetch outlives the session and queued memories are written
+        if prefetcher:
+            await prefetcher.close()
+        memory.close()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,111 @@
+# agent_queue.py
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+# Agent runs in progress at once; each holds an MCP subprocess and makes LLM calls
+AGENT_CONCURRENCY = int(os.getenv("AGENT_CONCURRENCY", "4"))
+# Runs that may wait for a slot before /query is refused
+AGENT_QUEUE_SIZE = int(os.getenv("AGENT_QUEUE_SIZE", "32"))
+# Assumed length of a run until one has finished
+DEFAULT_RUN_SECONDS = 30.0
+# Weight of the latest run in the average run time
+RUN_TIME_SMOOTHING = 0.2
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Agent queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AgentQueue:
+    """Bounded FIFO of agent runs served by a fixed number of workers.
+
+    submit() refuses a job with QueueFull once max_queued jobs are waiting;
+    its retry_after is when the oldest running job should finish, going by
+    the average run time. position() is a waiting job's 1-based place in
+    line, 0 once it is running and None when the queue does not know it.
+    """
+
+    def __init__(self, run: Callable[..., Awaitable[Any]], concurrency: int = AGENT_CONCURRENCY,
+                 max_queued: int = AGENT_QUEUE_SIZE):
+        self.run = run
+        self.concurrency = max(concurrency, 1)
+        self.max_queued = max_queued
+        self.stats: Dict[str, Any] = {"submitted": 0, "rejected": 0, "completed": 0,
+                                      "mean_run_s": DEFAULT_RUN_SECONDS}
+        self._waiting: Deque[Tuple[str, Tuple]] = deque()
+        self._running: Dict[str, float] = {}
+        self._ready: Optional[asyncio.Condition] = None
+        self._workers: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Starts the workers; call from the running event loop"""
+        if self._workers:
+            return
+        self._ready = asyncio.Condition()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def retry_after(self) -> int:
+        """Seconds until a running job should finish, letting a waiting one start and freeing a place"""
+        mean = self.stats["mean_run_s"]
+        now = time.perf_counter()
+        soonest = min((started + mean - now for started in self._running.values()), default=mean)
+        return max(1, math.ceil(soonest))
+
+    async def submit(self, job_id: str, *args: Any) -> int:
+        """Queues a run of run(job_id, *args); returns its position"""
+        if len(self._waiting) >= self.max_queued:
+            self.stats["rejected"] += 1
+            raise QueueFull(self.retry_after())
+        self._waiting.append((job_id, args))
+        self.stats["submitted"] += 1
+        async with self._ready:
+            self._ready.notify()
+        return len(self._waiting)
+
+    def position(self, job_id: str) -> Optional[int]:
+        if job_id in self._running:
+            return 0
+        for place, (waiting_id, _) in enumerate(self._waiting, start=1):
+            if waiting_id == job_id:
+                return place
+        return None
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._ready:
+                await self._ready.wait_for(lambda: self._waiting)
+                job_id, args = self._waiting.popleft()
+            started = time.perf_counter()
+            self._running[job_id] = started
+            try:
+                await self.run(job_id, *args)
+            except Exception:
+                # The run reports its own errors in the session
+                pass
+            finally:
+                del self._running[job_id]
+                elapsed = time.perf_counter() - started
+                self.stats["completed"] += 1
+                self.stats["mean_run_s"] = round(
+                    (1 - RUN_TIME_SMOOTHING) * self.stats["mean_run_s"] + RUN_TIME_SMOOTHING * elapsed, 3)
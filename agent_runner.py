@@ -0,0 +1,595 @@
+# agent_runner.py
+
+import asyncio
+import datetime
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+# Import directly from agent's dependencies instead of importing agent module
+from perception import extract_perception
+from memory import MemoryManager, MemoryItem, DEFAULT_STORE_DIR
+from decision import generate_plan
+from context_budget import ContextBudget, compact
+from action import TOOL_CACHE, TOOL_PREFETCH, ToolPrefetcher, ToolResultCache, execute_tools, parse_plan
+from answer_cache import ANSWER_CACHE, AnswerCache
+from doc_index import INDEX_DIR, get_embedding, read_manifest
+from tracing import set_session, span
+
+from scheme_service import SchemeService
+
+# Live state of the sessions run in this process: the API serves it directly, a worker saves it to the job store
+sessions: Dict[str, Dict[str, Any]] = {}
+
+# MCP server process management
+mcp_server_process = None
+
+# Scheme API URL
+SCHEME_API_URL = "http://localhost:8002"
+
+# Final answers of earlier sessions, returned by /query without running the agent
+answer_cache = AnswerCache(embed=get_embedding)
+
+def log(stage: str, msg: str):
+    """Logging function similar to agent.py"""
+    now = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    print(f"[{now}] [{stage}] {msg}")
+
+def corpus_version() -> int:
+    """Version of the document index the MCP server searches"""
+    return read_manifest(INDEX_DIR)["version"]
+
+@contextmanager
+def stage_timer(session_id: str, stage: str):
+    """Record how long a pipeline stage took in the session's timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if session_id in sessions:
+            sessions[session_id].setdefault("timings", []).append(
+                {"stage": stage, "ms": round(elapsed_ms, 3)}
+            )
+
+def start_mcp_server():
+    """Start the MCP server as a subprocess"""
+    global mcp_server_process
+    if mcp_server_process is None or mcp_server_process.poll() is not None:
+        print("Starting MCP server...")
+        try:
+            # Use absolute path to the Python executable and script
+            python_exe = sys.executable
+            script_path = os.path.join(os.getcwd(), "mcp-server.py")
+            
+            # Ensure the script exists
+            if not os.path.exists(script_path):
+                print(f"ERROR: MCP server script not found at {script_path}")
+                return False
+                
+            # Start the process with stdout and stderr redirected to files for debugging
+            log_dir = os.path.join(os.getcwd(), "logs")
+            os.makedirs(log_dir, exist_ok=True)
+            
+            stdout_file = open(os.path.join(log_dir, "mcp_stdout.log"), "w")
+            stderr_file = open(os.path.join(log_dir, "mcp_stderr.log"), "w")
+            
+            mcp_server_process = subprocess.Popen(
+                [python_exe, script_path],
+                cwd=os.getcwd(),
+                stdout=stdout_file,
+                stderr=stderr_file,
+                # Pass environment variables
+                env=os.environ.copy()
+            )
+            
+            # Wait a moment to ensure the server starts
+            time.sleep(2)
+            
+            # Check if the process is still running
+            if mcp_server_process.poll() is not None:
+                print(f"ERROR: MCP server failed to start. Exit code: {mcp_server_process.returncode}")
+                print("Check logs in the logs directory for details.")
+                return False
+                
+            print(f"MCP server started with PID {mcp_server_process.pid}")
+            return True
+        except Exception as e:
+            print(f"ERROR starting MCP server: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+    return True
+
+def stop_mcp_server():
+    """Stop the MCP server subprocess"""
+    global mcp_server_process
+    if mcp_server_process is not None:
+        print("Stopping MCP server...")
+        try:
+            mcp_server_process.terminate()
+            mcp_server_process.wait(timeout=5)
+            print("MCP server stopped")
+        except Exception as e:
+            print(f"Error stopping MCP server: {e}")
+            if mcp_server_process.poll() is None:
+                mcp_server_process.kill()
+        mcp_server_process = None
+
+async def process_agent_directly(session_id: str, query: str, user_id: str = "default"):
+    """Process an agent query directly without using agent.py module"""
+    try:
+        # Make sure we have a session record
+        if session_id not in sessions:
+            sessions[session_id] = {
+                "status": "initializing",
+                "results": {},
+                "final_answer": None,
+                "schemes": [],
+                "timings": []
+            }
+        
+        # Define constants
+        max_steps = 30
+        
+        # Ensure MCP server is running before we try to connect to it
+        start_mcp_server()
+        
+        # Connect to MCP server
+        print("[API] Starting agent processing...")
+        print(f"[API] Current working directory: {os.getcwd()}")
+        
+        # Create new server parameters for this session
+        server_params = StdioServerParameters(
+            command="python",
+            args=["mcp-server.py"],
+            cwd="./.",
+            # Tag the server's tool spans with this session
+            env={**os.environ, "AGENT_SESSION_ID": session_id}
+        )
+        
+        # Connect to MCP server
+        try:
+            async with stdio_client(server_params) as (read, write):
+                print("[API] Connection established, creating session...")
+                
+                async with ClientSession(read, write) as session:
+                    print("[API] Session created, initializing...")
+                    
+                    # Initialize the session
+                    await session.initialize()
+                    print("[API] MCP session initialized")
+                    
+                    # Get available tools
+                    tools_result = await session.list_tools()
+                    tools = tools_result.tools
+                    tool_descriptions = "\n".join(
+                        f"- {tool.name}: {getattr(tool, 'description', 'No description')}" 
+                        for tool in tools
+                    )
+                    
+                    log("agent", f"{len(tools)} tools loaded")
+                    # The answer is cached against the corpus and tools it was built with
+                    answer_cache.set_tools(t.name for t in tools)
+                    answer_version = corpus_version()
+                    
+                    # Initialize memory and tracking variables
+                    # Durable memory partitioned by user, so later sessions can reuse earlier tool outputs
+                    # Writes are queued and embedded in the background while the next step's LLM calls run
+                    memory = MemoryManager(store_dir=DEFAULT_STORE_DIR, user_id=user_id, write_behind=True)
+                    # Schemes are numbered within the session; a long-lived worker keeps none between runs
+                    schemes = SchemeService()
+                    prefetcher = None
+                    try:
+                        memory_session_id = f"session-{session_id}"
+                        user_input = query  # Store original intent
+                        original_query = query
+                        step = 0
+                        results_so_far = {}  # Store important results
+                        # Keeps memories and previous results in the prompts within a token budget;
+                        # its per-step prompt sizes are reported with the session
+                        budget = ContextBudget()
+                        sessions[session_id]["context"] = budget.steps
+                        # Answers repeated tool calls without a round trip and detects planning loops;
+                        # its hits and the steps it saved are reported with the session
+                        cache = ToolResultCache() if TOOL_CACHE else None
+                        sessions[session_id]["tool_cache"] = cache.stats if cache else {}
+                        # Runs the tool a perception hints at while the plan is generated; each
+                        # speculative call's hit and saved time are reported with the session
+                        prefetcher = ToolPrefetcher(session, tools, cache) if TOOL_PREFETCH else None
+                        sessions[session_id]["prefetch"] = prefetcher.steps if prefetcher else []
+                    
+                        # Update session status to running
+                        sessions[session_id]["status"] = "running"
+                    
+                        # Start the agent loop
+                        while step < max_steps:
+                            log("loop", f"Step {step + 1} started")
+                            budget.start_step(step + 1)
+                        
+                            # Add accumulated results to the user input for better context
+                            context_input = user_input
+                            if results_so_far:
+                                context_input += "\n\nPrevious results: " + budget.results_text(results_so_far)
+                        
+                            # Get perception
+                            with stage_timer(session_id, "perception"):
+                                perception = await asyncio.to_thread(extract_perception, context_input)
+                            log("perception", f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}")
+                            if prefetcher:
+                                prefetcher.start(step + 1, perception)
+                        
+                            # Get memory
+                            # Off the event loop: retrieve waits for queued writes, embeds the query and on
+                            # first use compacts the store, which would stall the other sessions
+                            with stage_timer(session_id, "memory_retrieve"):
+                                retrieved = await asyncio.to_thread(
+                                    memory.retrieve,
+                                    query=context_input, 
+                                    top_k=5, 
+                                    session_filter=memory_session_id
+                                )
+                                # Tool outputs from earlier sessions let repeated questions reuse prior work
+                                retrieved += await asyncio.to_thread(
+                                    memory.retrieve,
+                                    query=context_input,
+                                    top_k=3,
+                                    type_filter="tool_output",
+                                    exclude_session=memory_session_id
+                                )
+                            log("memory", f"Retrieved {len(retrieved)} relevant memories")
+                        
+                            # Generate plan
+                            # Planned off the event loop so a prefetched tool call can run meanwhile;
+                            # after a loop of repeated calls the planner must answer with what it has
+                            force_final = bool(cache and cache.loop_detected)
+                            with stage_timer(session_id, "plan"):
+                                plan = await asyncio.to_thread(
+                                    generate_plan,
+                                    perception, 
+                                    retrieved, 
+                                    tool_descriptions=tool_descriptions,
+                                    budget=budget,
+                                    force_final=force_final
+                                )
+                            if prefetcher:
+                                prefetcher.plan_ready()
+                            log("plan", f"Plan generated: {plan}")
+                        
+                            # Check for final answer
+                            if plan.startswith("FINAL_ANSWER:"):
+                                if force_final:
+                                    # Steps the loop would otherwise have run until max_steps
+                                    cache.stats["steps_saved"] = max_steps - step - 1
+                                final_answer = plan.replace("FINAL_ANSWER:", "").strip()
+                                log("agent", f"✅ FINAL RESULT: {final_answer}")
+                                sessions[session_id]["status"] = "completed"
+                                sessions[session_id]["final_answer"] = final_answer
+                                if ANSWER_CACHE:
+                                    answer_cache.set_version(corpus_version())
+                                    answer_cache.store(original_query, user_id, answer_version, final_answer,
+                                                       sessions[session_id]["schemes"])
+                                    # A worker's cache is its own; the API caches the answer from this when it serves the session
+                                    sessions[session_id]["cacheable"] = {"query": original_query, "user_id": user_id,
+                                                                         "version": answer_version, "tools": list(answer_cache.tools)}
+                            
+                                break
+                        
+                            # Execute tool
+                            try:
+                                # Independent calls in one plan run concurrently
+                                calls = parse_plan(plan) or [plan]
+                                call_keys = [str(step)] if len(calls) == 1 else [f"{step}_{i}" for i in range(len(calls))]
+                            
+                                # First, create a placeholder for each tool with "Running" status
+                                for call, call_key in zip(calls, call_keys):
+                                    tool_name = call.strip().split('(')[0] if '(' in call else call.strip()
+                                    sessions[session_id]["results"][f"tool_{call_key}"] = {
+                                        "tool": tool_name,
+                                        "result": "Executing...",
+                                        "status": "Running"
+                                    }
+                            
+                                # Small delay to allow frontend to pick up the "Running" status
+                                await asyncio.sleep(0.5)
+                            
+                                # Actually execute the tools
+                                with stage_timer(session_id, "tool_call"):
+                                    step_results = await execute_tools(session, tools, plan, prefetcher, cache)
+                                repeated = cache.step_done(step_results) if cache else False
+                            
+                                # Merge results in plan order
+                                new_memories = []
+                                for result, call_key in zip(step_results, call_keys):
+                                    log("tool", f"{result.tool_name} returned: {result.result}")
+                                
+                                    # Check if this is an AiForm tool call; a repeated one already created its scheme
+                                    if "ai_form_schemer" in result.tool_name.lower() and not result.cached:
+                                        try:
+                                            # Extract input parameters from the arguments
+                                            if isinstance(result.arguments, dict) and 'input' in result.arguments:
+                                                # Get the input parameters
+                                                input_params = result.arguments['input']
+                                            
+                                                # Create a scheme with these parameters
+                                                scheme_data = {
+                                                    "extents_x": input_params.get('extents_x'),
+                                                    "extents_y": input_params.get('extents_y'),
+                                                    "grid_spacing_x": input_params.get('grid_spacing_x'),
+                                                    "grid_spacing_y": input_params.get('grid_spacing_y'),
+                                                    "no_of_floors": input_params.get('no_of_floors')
+                                                }
+                                            
+                                                # Extract evaluation metrics from the result
+                                                if isinstance(result.result, str):
+                                                    try:
+                                                        # Parse JSON from result
+                                                        json_match = re.search(r'\{.*\}', result.result)
+                                                        if json_match:
+                                                            json_data = json.loads(json_match.group(0))
+                                                            # Add evaluation metrics to scheme_data
+                                                            for key in ["steel_tonnage", "column_size", "structural_depth", "concrete_tonnage", "trustworthy"]:
+                                                                if key in json_data:
+                                                                    scheme_data[key] = json_data[key]
+                                                    except Exception as e:
+                                                        log("error", f"Failed to parse evaluation metrics from result: {e}")
+                                            
+                                            # Create the scheme
+                                            with stage_timer(session_id, "scheme_creation"):
+                                                new_scheme = schemes.add_scheme(schemes.create_scheme_from_agent_data(scheme_data))
+                                        
+                                            # Add to session schemes
+                                            if "schemes" not in sessions[session_id]:
+                                                sessions[session_id]["schemes"] = []
+                                        
+                                            scheme_dict = new_scheme.dict()
+                                            sessions[session_id]["schemes"].append(scheme_dict)
+                                            log("schemes", f"Created new scheme from AiForm tool: {new_scheme.id}")
+                                        except Exception as e:
+                                            log("error", f"Failed to create scheme from AiForm: {e}")
+                                
+                                    # Update the result in session with completed status
+                                    sessions[session_id]["results"][f"tool_{call_key}"] = {
+                                        "tool": result.tool_name,
+                                        "result": str(result.result),
+                                        "status": "Finished",
+                                        "cached": result.cached
+                                    }
+                                
+                                    # Process result for scheme creation
+                                    try:
+                                        # Extract scheme data from tool results
+                                        scheme_data = {}
+                                    
+                                        # Case 1: ai_form_schemer tool (already handled above)
+                                        if result.tool_name == "ai_form_schemer":
+                                            # Already handled above, no need to duplicate
+                                            pass
+                                    
+                                        # Case 2: Extract from any tool result that might contain building parameters
+                                        elif isinstance(result.result, str):
+                                            # Look for common building parameters in the result string
+                                            param_patterns = {
+                                                "extents_x": r'(?:extents?[_\s-]*x|width|building[_\s]*width)[=:\s]+(\d+(?:\.\d+)?)',
+                                                "extents_y": r'(?:extents?[_\s-]*y|depth|building[_\s]*depth)[=:\s]+(\d+(?:\.\d+)?)',
+                                                "grid_spacing_x": r'(?:grid[_\s-]*spacing[_\s-]*x)[=:\s]+(\d+(?:\.\d+)?)',
+                                                "grid_spacing_y": r'(?:grid[_\s-]*spacing[_\s-]*y)[=:\s]+(\d+(?:\.\d+)?)',
+                                                "no_of_floors": r'(?:floors|no[_\s]*of[_\s]*floors|number[_\s]*of[_\s]*floors|stories|storeys)[=:\s]+(\d+(?:\.\d+)?)'
+                                            }
+                                        
+                                            # Search for each parameter in the result string
+                                            for param, pattern in param_patterns.items():
+                                                match = re.search(pattern, result.result, re.IGNORECASE)
+                                                if match:
+                                                    scheme_data[param] = match.group(1)
+                                        
+                                            # Also try to extract JSON from the result
+                                            json_match = re.search(r'\{.*\}', result.result)
+                                            if json_match:
+                                                try:
+                                                    json_data = json.loads(json_match.group(0))
+                                                    # Extract building parameters if they exist
+                                                    for key in ["extents_x", "extents_y", "grid_spacing_x", "grid_spacing_y", "no_of_floors"]:
+                                                        if key in json_data:
+                                                            scheme_data[key] = json_data[key]
+                                                
+                                                    # Also check for nested parameters
+                                                    if "parameters" in json_data and isinstance(json_data["parameters"], dict):
+                                                        for key, value in json_data["parameters"].items():
+                                                            scheme_data[key] = value
+                                                
+                                                    # Check for evaluations too
+                                                    if "evaluations" in json_data and isinstance(json_data["evaluations"], dict):
+                                                        for key, value in json_data["evaluations"].items():
+                                                            scheme_data[key] = value
+                                                        
+                                                    # Check for building_scheme
+                                                    if "building_scheme" in json_data and isinstance(json_data["building_scheme"], dict):
+                                                        for key, value in json_data["building_scheme"].items():
+                                                            scheme_data[key] = value
+                                                except:
+                                                    pass
+                                    
+                                        # Case 3: Check for scheme data in the final answer text
+                                        elif result.tool_name == "final_answer" and isinstance(result.result, str):
+                                            # Look for scheme patterns in the final answer
+                                            scheme_patterns = [
+                                                r'Scheme\s+\d+:\s+extents_x=(\d+(?:\.\d+)?),\s+extents_y=(\d+(?:\.\d+)?),\s+.*?no_of_floors=(\d+)',
+                                                r'extents_x=(\d+(?:\.\d+)?),\s+extents_y=(\d+(?:\.\d+)?),\s+.*?no_of_floors=(\d+)'
+                                            ]
+                                        
+                                            for pattern in scheme_patterns:
+                                                matches = re.findall(pattern, result.result, re.IGNORECASE)
+                                                for i, match in enumerate(matches):
+                                                    if len(match) >= 3:
+                                                        scheme_data = {
+                                                            "extents_x": match[0],
+                                                            "extents_y": match[1],
+                                                            "no_of_floors": match[2]
+                                                        }
+                                                    
+                                                        # Create scheme from parameters
+                                                        with stage_timer(session_id, "scheme_creation"):
+                                                            new_scheme = schemes.add_scheme(schemes.create_scheme_from_agent_data(scheme_data))
+                                                    
+                                                        # Add to session schemes
+                                                        if "schemes" not in sessions[session_id]:
+                                                            sessions[session_id]["schemes"] = []
+                                                    
+                                                        scheme_dict = new_scheme.dict()
+                                                        sessions[session_id]["schemes"].append(scheme_dict)
+                                                        log("schemes", f"Created new scheme from final answer: {new_scheme.id}")
+                                    
+                                        # Create a new scheme if we have enough parameters
+                                        required_params = ["extents_x", "extents_y"]
+                                        if any(param in scheme_data for param in required_params) and len(scheme_data) >= 2:
+                                            # Set defaults for missing parameters
+                                            if "grid_spacing_x" not in scheme_data:
+                                                scheme_data["grid_spacing_x"] = 6
+                                            if "grid_spacing_y" not in scheme_data:
+                                                scheme_data["grid_spacing_y"] = 6
+                                            if "no_of_floors" not in scheme_data:
+                                                scheme_data["no_of_floors"] = 3
+                                            
+                                            # Create scheme from parameters
+                                            with stage_timer(session_id, "scheme_creation"):
+                                                new_scheme = schemes.add_scheme(schemes.create_scheme_from_agent_data(scheme_data))
+                                        
+                                            # Add to session schemes
+                                            if "schemes" not in sessions[session_id]:
+                                                sessions[session_id]["schemes"] = []
+                                        
+                                            scheme_dict = new_scheme.dict()
+                                            sessions[session_id]["schemes"].append(scheme_dict)
+                                            log("schemes", f"Created new scheme from tool result: {new_scheme.id}")
+                                    except Exception as e:
+                                        log("error", f"Failed to create scheme from tool result: {e}")
+                                
+                                    # Store important results based on tool type
+                                    if result.tool_name in ['add', 'subtract', 'multiply', 'divide']:
+                                        results_so_far[f"math_{call_key}"] = result.result
+                                    elif result.tool_name == 'search_documents':
+                                        if isinstance(result.result, list) and result.result:
+                                            query_key = str(result.arguments).replace(" ", "_")[:30]
+                                            results_so_far[f"search_{query_key}"] = f"Retrieved information about: {result.arguments}"
+                                        
+                                            search_summary = f"Found information about {result.arguments}"
+                                            new_memories.append(MemoryItem(
+                                                text=f"SEARCH SUMMARY: {search_summary}",
+                                                type="fact",
+                                                tool_name="search_summary",
+                                                user_query=user_input,
+                                                tags=["search_summary"],
+                                                session_id=memory_session_id
+                                            ))
+                                    elif result.tool_name.startswith('search_') or result.tool_name.startswith('get_'):
+                                        param_key = str(result.arguments).replace(" ", "_")[:30]
+                                        results_so_far[f"{result.tool_name}_{param_key}"] = f"Retrieved data about {result.arguments}"
+                                    
+                                        new_memories.append(MemoryItem(
+                                            text=f"RETRIEVAL SUMMARY: Used {result.tool_name} to get information about {result.arguments}",
+                                            type="fact",
+                                            tool_name=result.tool_name,
+                                            user_query=user_input,
+                                            tags=["retrieval_summary"],
+                                            session_id=memory_session_id
+                                        ))
+                                
+                                    # Add tool result to memory, compacted so whole search chunks don't crowd later prompts
+                                    new_memories.append(MemoryItem(
+                                        text=f"Tool call: {result.tool_name} with {result.arguments}, got: {compact(result.result)}",
+                                        type="tool_output",
+                                        tool_name=result.tool_name,
+                                        user_query=user_input,
+                                        tags=[result.tool_name],
+                                        session_id=memory_session_id
+                                    ))
+                            
+                                # Queued as one batch; embedding overlaps the next step's perception call
+                                memory.bulk_add(new_memories)
+                            
+                                # Set up for the next iteration; previous results are appended once per step, within the budget
+                                user_input = f"Original task: {original_query}\nWhat should I do next?"
+                                if repeated:
+                                    user_input += ("\nNote: the last step repeated calls already made "
+                                                   f"({', '.join(r.tool_name for r in step_results)}); use their results instead.")
+                            
+                            except Exception as e:
+                                error_msg = f"Tool execution failed: {e}"
+                                log("error", error_msg)
+                            
+                                # Mark every call of this step that did not finish as failed
+                                for key, entry in sessions[session_id]["results"].items():
+                                    in_step = key == f"tool_{step}" or key.startswith(f"tool_{step}_")
+                                    if in_step and entry.get("status") == "Running":
+                                        entry["result"] = error_msg
+                                        entry["status"] = "Error"
+                            
+                                sessions[session_id]["status"] = "error"
+                                sessions[session_id]["error"] = error_msg
+                                break
+                        
+                            step += 1
+                    
+                        # If we reached the maximum number of steps without a final answer
+                        if step >= max_steps and sessions[session_id]["status"] == "running":
+                            sessions[session_id]["status"] = "completed"
+                            sessions[session_id]["final_answer"] = "Reached maximum number of steps without finding a final answer."
+                    finally:
+                        # Runs when the loop fails too, so the write-behind thread stops and queued memories are written
+                        if prefetcher:
+                            await prefetcher.close()
+                        await asyncio.to_thread(memory.close)
+        
+        except Exception as e:
+            error_msg = f"Session processing error: {e}"
+            print(error_msg)
+            import traceback
+            traceback.print_exc()
+            sessions[session_id]["status"] = "error"
+            sessions[session_id]["error"] = error_msg
+    
+    except Exception as e:
+        error_msg = f"Overall agent processing error: {e}"
+        print(error_msg)
+        import traceback
+        traceback.print_exc()
+        sessions[session_id]["status"] = "error"
+        sessions[session_id]["error"] = error_msg
+
+# Helper function to run agent in background
+async def run_agent_task(session_id: str, query: str, user_id: str = "default"):
+    """Run the agent processing in a background task"""
+    try:
+        queued_at = sessions.get(session_id, {}).get("queued_at")
+        # Initialize session
+        sessions[session_id] = {
+            "status": "initializing",
+            "results": {},
+            "final_answer": None,
+            "schemes": [],
+            "timings": []
+        }
+        if queued_at is not None:
+            sessions[session_id]["timings"].append(
+                {"stage": "queue_wait", "ms": round((time.time() - queued_at) * 1000, 3)}
+            )
+        
+        # Process the agent directly; spans in this task are tied to the session
+        set_session(session_id)
+        with span("agent.session", query_chars=len(query)):
+            await process_agent_directly(session_id, query, user_id)
+        
+    except Exception as e:
+        error_msg = f"Error running agent task: {e}"
+        print(error_msg)
+        sessions[session_id]["status"] = "error"
+        sessions[session_id]["error"] = error_msg
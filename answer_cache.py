@@ -0,0 +1,147 @@
+# answer_cache.py
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from doc_index import log
+
+# Answer repeated queries from the final answer of an earlier session
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") != "0"
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "86400"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+# Cosine similarity at which a differently worded query counts as the same question; 0 turns matching off
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+
+# Answers that say the agent did not get anywhere are not worth repeating
+UNCACHEABLE_ANSWERS = {"", "unknown", "[unknown]"}
+
+Key = Tuple[str, str, int, Tuple[str, ...]]
+
+
+def normalize_query(query: str) -> str:
+    """Lowercased words of a query, so case, punctuation and spacing do not change its key"""
+    return " ".join(re.findall(r"\w+", query.lower()))
+
+
+class AnswerCache:
+    """Final answers keyed on the normalized query, the user, the document index version and the tool set.
+
+    A query from the same user against the same corpus version and tools
+    gets the stored answer until ttl_s has passed. A new index version or
+    tool set drops every entry built on the old one. With a similarity
+    threshold and an embed function, a query with no exact entry is matched
+    to the nearest stored query of the same user, version and tools.
+    """
+
+    def __init__(self, ttl_s: float = ANSWER_CACHE_TTL_S, max_entries: int = ANSWER_CACHE_SIZE,
+                 similarity: float = ANSWER_CACHE_SIMILARITY,
+                 embed: Optional[Callable[[str], np.ndarray]] = None):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.embed = embed if similarity > 0 else None
+        self.tools: Tuple[str, ...] = ()
+        self.version: Optional[int] = None
+        self.stats: Dict[str, int] = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stored": 0,
+                                      "invalidated": 0, "expired": 0}
+        self._entries: "OrderedDict[Key, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_tools(self, names: Iterable[str]) -> None:
+        tools = tuple(sorted(names))
+        with self._lock:
+            if tools != self.tools:
+                self._drop(lambda key: key[3] != tools, "tool set changed")
+                self.tools = tools
+
+    def set_version(self, version: int) -> None:
+        with self._lock:
+            if version != self.version:
+                self._drop(lambda key: key[2] != version, f"index version {version}")
+                self.version = version
+
+    def _drop(self, stale: Callable[[Key], bool], reason: str) -> None:
+        keys = [key for key in self._entries if stale(key)]
+        for key in keys:
+            del self._entries[key]
+        if keys:
+            self.stats["invalidated"] += len(keys)
+            log("answer_cache", f"Dropped {len(keys)} answers: {reason}")
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embed(text), dtype=np.float32).ravel()
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, query: str, user_id: str, version: int) -> Optional[Dict[str, Any]]:
+        """The stored answer for this query, with how it matched and its age; None on a miss"""
+        self.set_version(version)
+        normalized = normalize_query(query)
+        key = (normalized, user_id, version, self.tools)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry["created"] > self.ttl_s:
+                del self._entries[key]
+                self.stats["expired"] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["exact_hits"] += 1
+                return {**entry, "match": "exact", "similarity": 1.0, "age_s": round(now - entry["created"], 3)}
+            candidates = [(k, e) for k, e in self._entries.items()
+                          if k[1:] == key[1:] and e["vector"] is not None and now - e["created"] <= self.ttl_s]
+        if self.embed is None or not candidates:
+            self.stats["misses"] += 1
+            return None
+        try:
+            vector = self._vector(normalized)
+        except Exception as e:
+            log("answer_cache", f"⚠️ Could not embed query for near-duplicate matching: {e}")
+            self.stats["misses"] += 1
+            return None
+        best_key, best = max(candidates, key=lambda c: float(c[1]["vector"] @ vector))
+        score = float(best["vector"] @ vector)
+        if score < self.similarity:
+            self.stats["misses"] += 1
+            return None
+        with self._lock:
+            if best_key in self._entries:
+                self._entries.move_to_end(best_key)
+        self.stats["semantic_hits"] += 1
+        log("answer_cache", f"Near-duplicate of {best['query']!r} ({score:.3f})")
+        return {**best, "match": "semantic", "similarity": round(score, 4), "age_s": round(now - best["created"], 3)}
+
+    def store(self, query: str, user_id: str, version: int, answer: str,
+              schemes: Optional[List[Dict[str, Any]]] = None) -> bool:
+        """Keeps a session's final answer; False if the answer or the corpus it was built on is not reusable"""
+        if answer.strip().lower() in UNCACHEABLE_ANSWERS or version != self.version:
+            return False
+        normalized = normalize_query(query)
+        vector = None
+        if self.embed is not None:
+            try:
+                vector = self._vector(normalized)
+            except Exception as e:
+                log("answer_cache", f"⚠️ Could not embed query, storing it for exact matches only: {e}")
+        with self._lock:
+            key = (normalized, user_id, version, self.tools)
+            self._entries[key] = {"query": query, "answer": answer, "schemes": list(schemes or []),
+                                  "created": time.time(), "vector": vector}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.stats["stored"] += 1
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._drop(lambda key: True, "cleared")
+
+    def __len__(self) -> int:
+        return len(self._entries)
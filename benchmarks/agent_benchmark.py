@@ -0,0 +1,290 @@
+"""End-to-end throughput benchmark for the /query API.
+
+Starts the upstream stubs (see benchmarks/stubs.py), launches api.py under
+uvicorn with every external URL pointed at them, then fires queries at
+/query with bounded concurrency and polls /session until each finishes.
+Per-stage timings recorded by the API are aggregated into latency
+percentiles and written out as JSON:
+
+    python -m benchmarks.agent_benchmark --queries 20 --concurrency 4 \\
+        --llm-latency-ms 300 --output bench_agent.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.stats import ROOT, git_commit, summarize
+from benchmarks.stubs import StubServers, load_plan
+
+STAGES = ["perception", "memory_retrieve", "plan", "tool_call", "scheme_creation"]
+TERMINAL_STATUSES = {"completed", "error"}
+# A batch counts as concurrent when it takes at most this multiple of its slowest call
+BATCH_CONCURRENT_RATIO = 1.5
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(port: int, env: Dict[str, str], web_workers: int = 1) -> subprocess.Popen:
+    """Run api.py under uvicorn with the stub environment"""
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(web_workers)],
+        cwd=ROOT,
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def start_workers(processes: int, env: Dict[str, str]) -> subprocess.Popen:
+    """Run worker.py processes that take the API's queued agent runs"""
+    return subprocess.Popen(
+        [sys.executable, "worker.py", "--processes", str(processes)],
+        cwd=ROOT,
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def wait_for_health(base_url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{base_url}/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"API did not become healthy within {timeout}s")
+
+
+async def run_query(client: httpx.AsyncClient, base_url: str, n: int, query: str,
+                    poll_interval: float, timeout: float) -> Dict[str, Any]:
+    """Submit one query and poll until it reaches a terminal status; a refused query is resubmitted after Retry-After"""
+    start = time.perf_counter()
+    retry_after: List[float] = []
+    while True:
+        response = await client.post(f"{base_url}/query", json={"query": f"[bench-{n}] {query}"})
+        if response.status_code != 429 or time.perf_counter() - start >= timeout:
+            break
+        retry_after.append(float(response.headers.get("Retry-After", "1")))
+        await asyncio.sleep(retry_after[-1])
+    response.raise_for_status()
+    if response.json()["message"] == "Answered from cache":
+        # Already complete; one poll fetches the answer
+        poll_interval = 0.0
+    session_id = response.json()["session_id"]
+
+    status: Dict[str, Any] = {}
+    max_position = 0
+    while time.perf_counter() - start < timeout:
+        await asyncio.sleep(poll_interval)
+        poll = await client.get(f"{base_url}/session/{session_id}")
+        if poll.status_code == 200:
+            status = poll.json()
+            max_position = max(max_position, status.get("queue_position") or 0)
+            if status.get("status") in TERMINAL_STATUSES:
+                break
+
+    return {
+        "session_id": session_id,
+        "status": status.get("status", "timeout"),
+        "wall_ms": (time.perf_counter() - start) * 1000,
+        "timings": status.get("timings") or [],
+        "prefetch": status.get("prefetch") or [],
+        "tool_cache": status.get("tool_cache") or {},
+        "answer_cache": status.get("answer_cache"),
+        "retry_after": retry_after,
+        "max_queue_position": max_position,
+    }
+
+
+async def drive(base_url: str, queries: int, concurrency: int, query: str,
+                poll_interval: float, timeout: float, distinct: int = 0) -> List[Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(n: int):
+        async with semaphore:
+            # With distinct set, query n repeats query n % distinct word for word
+            return await run_query(client, base_url, n % distinct if distinct else n, query, poll_interval, timeout)
+
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        return await asyncio.gather(*(bounded(n) for n in range(queries)))
+
+
+def tool_batches(trace_file: Path) -> List[Dict[str, float]]:
+    """Each batch of tool calls from the traces: its time on the agent side against the server time of its calls"""
+    if not trace_file.exists():
+        return []
+    spans = [json.loads(line) for line in trace_file.read_text().splitlines() if line.strip()]
+    tool_spans = defaultdict(list)
+    for s in spans:
+        if s["name"].startswith("tool."):
+            tool_spans[s["session_id"]].append(s)
+    batches = []
+    for batch in spans:
+        if batch["name"] != "execute_tools" or batch["attributes"].get("calls", 1) < 2:
+            continue
+        start = batch["start_unix_ns"]
+        end = start + batch["duration_ms"] * 1e6
+        # Calls started before the batch are prefetches, which the batch only waits on
+        calls = [s["duration_ms"] for s in tool_spans[batch["session_id"]] if start <= s["start_unix_ns"] <= end]
+        if len(calls) >= 2:
+            batches.append({"calls": len(calls), "ms": batch["duration_ms"], "slowest_ms": max(calls),
+                            "sum_ms": sum(calls)})
+    return batches
+
+
+def build_report(runs: List[Dict[str, Any]], wall_seconds: float, config: Dict[str, Any],
+                 upstream: Dict[str, int], batches: List[Dict[str, float]]) -> Dict[str, Any]:
+    by_stage: Dict[str, List[float]] = defaultdict(list)
+    for run in runs:
+        for timing in run["timings"]:
+            by_stage[timing["stage"]].append(timing["ms"])
+
+    completed = [r for r in runs if r["status"] == "completed"]
+    speculative = [call for r in runs for call in r["prefetch"]]
+    hits = [call for call in speculative if call["hit"]]
+    caches = [r["tool_cache"] for r in runs if r["tool_cache"]]
+    answered = [r for r in completed if r["answer_cache"]]
+    agent_runs = [r for r in completed if not r["answer_cache"]]
+    return {
+        "benchmark": "agent_end_to_end",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": config,
+        "queries": len(runs),
+        "completed": len(completed),
+        "errors": sum(1 for r in runs if r["status"] == "error"),
+        "timeouts": sum(1 for r in runs if r["status"] == "timeout"),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_qps": round(len(completed) / wall_seconds, 3) if wall_seconds else 0.0,
+        "end_to_end_ms": summarize(r["wall_ms"] for r in completed),
+        "stages_ms": {stage: summarize(by_stage.get(stage, [])) for stage in STAGES + sorted(set(by_stage) - set(STAGES))},
+        "prefetch": {
+            "calls": len(speculative),
+            "hit_rate": round(len(hits) / len(speculative), 3) if speculative else 0.0,
+            "saved_ms": summarize(call["saved_ms"] for call in hits),
+        },
+        "planner_steps": summarize(sum(t["stage"] == "plan" for t in r["timings"]) for r in completed),
+        "tool_cache": {
+            "hits": sum(c["hits"] for c in caches),
+            "repeated_steps": sum(c["repeated_steps"] for c in caches),
+            "loops_detected": sum(c["loop_detected"] for c in caches),
+            "steps_saved": summarize(c["steps_saved"] for c in caches),
+        },
+        "admission": {
+            "rejected": sum(len(r["retry_after"]) for r in runs),
+            "retry_after_s": summarize(s for r in runs for s in r["retry_after"]),
+            "max_queue_position": max((r["max_queue_position"] for r in runs), default=0),
+        },
+        "answer_cache": {
+            "hits": len(answered),
+            "semantic_hits": sum(r["answer_cache"]["match"] == "semantic" for r in answered),
+            "cached_ms": summarize(r["wall_ms"] for r in answered),
+            "agent_ms": summarize(r["wall_ms"] for r in agent_runs),
+        },
+        "tool_batches": {
+            "batches": len(batches),
+            "batch_ms": summarize(b["ms"] for b in batches),
+            "vs_slowest_call": summarize(b["ms"] / b["slowest_ms"] for b in batches),
+            "vs_sum_of_calls": summarize(b["ms"] / b["sum_ms"] for b in batches),
+            "concurrent": bool(batches) and all(b["ms"] <= BATCH_CONCURRENT_RATIO * b["slowest_ms"] for b in batches),
+        },
+        "upstream_requests": upstream,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /query end to end against local stubs")
+    parser.add_argument("--queries", type=int, default=10, help="Total queries to submit")
+    parser.add_argument("--concurrency", type=int, default=2, help="Queries in flight at once")
+    parser.add_argument("--plan", help="JSON list of scripted planner responses (default: benchmarks/plans/default.json)")
+    parser.add_argument("--query", default="Generate a scheme, evaluate it and find recycled steel emissions")
+    parser.add_argument("--distinct", type=int, default=0,
+                        help="Distinct queries to cycle through, so later ones repeat earlier ones (default: all distinct)")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-token-ms", type=float, default=0.0, help="Generation time per planner/perception output token")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--tool-latency-ms", type=float, default=0.0)
+    parser.add_argument("--web-workers", type=int, default=1, help="uvicorn worker processes serving the API")
+    parser.add_argument("--agent-workers", type=int, default=0,
+                        help="Run agents in this many worker.py processes instead of inside the API (default: inline)")
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-query timeout in seconds")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    config = {k: v for k, v in vars(args).items() if k != "output"}
+    stubs = StubServers(load_plan(args.plan), args.llm_latency_ms, args.embed_latency_ms, args.tool_latency_ms,
+                        args.llm_token_ms)
+    with stubs, tempfile.TemporaryDirectory() as tmp:
+        env = stubs.env()
+        (ROOT / "logs").mkdir(exist_ok=True)
+        env["MATERIALS_2050_TOKEN_CACHE"] = str(ROOT / "logs" / "bench_2050_token_cache.json")
+        # Stub embeddings go to a scratch memory store and a copy of the index, which the MCP server leaves as is
+        env["MEMORY_STORE_DIR"] = str(Path(tmp) / "memory_store")
+        env["DOC_INDEX_DIR"] = str(shutil.copytree(ROOT / "faiss_index", Path(tmp) / "faiss_index",
+                                                   ignore=shutil.ignore_patterns(".build.lock")))
+        env["MCP_INDEX_MODE"] = "off"
+        # Agent and MCP server spans, read back to check that batched tool calls overlapped
+        env["TRACE_FILE"] = str(Path(tmp) / "traces.jsonl")
+        port = free_port()
+        workers = None
+        if args.agent_workers:
+            env["AGENT_EXECUTION"] = "workers"
+            env["JOB_STORE_PATH"] = str(ROOT / "logs" / f"bench_jobs_{port}.sqlite")
+            workers = start_workers(args.agent_workers, env)
+        api = start_api(port, env, args.web_workers)
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            asyncio.run(wait_for_health(base_url))
+            start = time.perf_counter()
+            runs = asyncio.run(drive(base_url, args.queries, args.concurrency, args.query,
+                                     args.poll_interval, args.timeout, args.distinct))
+            wall_seconds = time.perf_counter() - start
+        finally:
+            stop(api)
+            if workers is not None:
+                stop(workers)
+        report = build_report(runs, wall_seconds, config, stubs.request_counts(),
+                              tool_batches(Path(env["TRACE_FILE"])))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Wrote {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Chunk size and overlap tuner for the document index.
+
+Rebuilds the index over documents/ for every (size, overlap) pair in the
+grid and runs the labelled queries in benchmarks/queries/doc_search.json
+against each build, reporting recall@k, MRR, hit@1, search latency, build
+time and the prompt tokens the returned chunks would cost.
+
+The winner is the cheapest setting in prompt tokens whose recall is within
+--recall-tolerance of the best one (ties go to MRR, then latency). With
+--embed-url it is written to chunking.json in the index directory, which
+process_documents reads and re-chunks every shard for; pass --dry-run to
+only report.
+
+    python -m benchmarks.chunking_tuner --output bench_chunking.json
+    python -m benchmarks.chunking_tuner --embed-url http://localhost:11434/api/embeddings --sizes 200 400 800
+
+Overlaps are fractions of the chunk size. Without --embed-url the Ollama
+stub serves hashed embeddings, which only approximate lexical overlap, so
+the run only reports unless --write is given.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.search_benchmark import DEFAULT_QUERIES, MODES, reciprocal_rank
+from benchmarks.stats import git_commit, summarize
+from benchmarks.stubs import StubServers
+
+# Rough characters per prompt token for English text
+CHARS_PER_TOKEN = 4
+
+
+def score(index, queries: List[Dict[str, Any]], mode: str, top_k: int) -> Dict[str, Any]:
+    from doc_index import format_hit
+
+    latencies: List[float] = []
+    tokens: List[float] = []
+    hit_1: List[float] = []
+    recall: List[float] = []
+    rr: List[float] = []
+    for labelled in queries:
+        start = time.perf_counter()
+        hits = index.search(labelled["query"], top_k=top_k, mode=mode)
+        latencies.append((time.perf_counter() - start) * 1000)
+        tokens.append(sum(len(format_hit(hit)) for hit in hits) / CHARS_PER_TOKEN)
+        docs = [hit["doc"] for hit in hits]
+        relevant = labelled["relevant"]
+        hit_1.append(float(bool(docs) and docs[0] in relevant))
+        recall.append(float(any(doc in relevant for doc in docs)))
+        rr.append(reciprocal_rank(docs, relevant))
+
+    return {
+        "recall": round(sum(recall) / len(recall), 3),
+        "mrr": round(sum(rr) / len(rr), 3),
+        "hit_at_1": round(sum(hit_1) / len(hit_1), 3),
+        "latency_ms": summarize(latencies),
+        "prompt_tokens": round(sum(tokens) / len(tokens), 1),
+    }
+
+
+def run_setting(doc_dir: Path, index_dir: Path, size: int, overlap: int, queries: List[Dict[str, Any]],
+                mode: str, top_k: int) -> Dict[str, Any]:
+    import doc_index
+
+    index_dir.mkdir(parents=True)
+    (index_dir / doc_index.CHUNKING_FILE_NAME).write_text(json.dumps({"size": size, "overlap": overlap}))
+    start = time.perf_counter()
+    doc_index.process_documents(doc_dir, index_dir)
+    build_s = time.perf_counter() - start
+    index = doc_index.DocumentIndex(index_dir)
+    shards = index.shards()
+    for shard in shards:
+        shard.refresh()
+    chunks = sum(len(shard.metadata) for shard in shards)
+    return {"size": size, "overlap": overlap, "chunks": chunks, "build_s": round(build_s, 3),
+            **score(index, queries, mode, top_k)}
+
+
+def pick(results: List[Dict[str, Any]], tolerance: float) -> Dict[str, Any]:
+    best_recall = max(r["recall"] for r in results)
+    eligible = [r for r in results if r["recall"] >= best_recall - tolerance]
+    return min(eligible, key=lambda r: (r["prompt_tokens"], -r["mrr"], r["latency_ms"]["p50"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune document chunk size and overlap on a labelled query set")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 200, 400, 1000], help="Chunk sizes in words")
+    parser.add_argument("--overlaps", type=float, nargs="+", default=[0.0, 0.1, 0.25],
+                        help="Overlaps as fractions of the chunk size")
+    parser.add_argument("--queries", default=str(DEFAULT_QUERIES), help="Labelled query set (JSON)")
+    parser.add_argument("--mode", default="auto", choices=MODES)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--recall-tolerance", type=float, default=0.02,
+                        help="Recall a cheaper setting may give up against the best one")
+    parser.add_argument("--embed-url", help="Real Ollama embeddings URL instead of the stub")
+    parser.add_argument("--doc-dir", help="Documents to index (default: documents/)")
+    parser.add_argument("--index-dir", help="Where chunking.json is written (default: faiss_index/)")
+    parser.add_argument("--dry-run", action="store_true", help="Report without writing chunking.json")
+    parser.add_argument("--write", action="store_true",
+                        help="Write chunking.json from a stub run too (stub runs only report by default)")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    # Each build must use the grid setting, not an override from the environment
+    for env in ("DOC_CHUNK_SIZE", "DOC_CHUNK_OVERLAP"):
+        os.environ.pop(env, None)
+    import doc_index
+
+    queries = json.loads(Path(args.queries).read_text())
+    doc_dir = Path(args.doc_dir) if args.doc_dir else doc_index.DOC_PATH
+    index_dir = Path(args.index_dir) if args.index_dir else doc_index.INDEX_DIR
+    grid = sorted({(size, int(size * fraction)) for size in args.sizes for fraction in args.overlaps})
+
+    results = []
+    with ExitStack() as stack:
+        if args.embed_url:
+            doc_index.EMBED_URL = args.embed_url
+        else:
+            stubs = stack.enter_context(StubServers([]))
+            doc_index.EMBED_URL = f"{stubs.ollama.url}/api/embeddings"
+        tmp = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        for size, overlap in grid:
+            result = run_setting(doc_dir, tmp / f"{size}_{overlap}", size, overlap, queries, args.mode, args.top_k)
+            results.append(result)
+            doc_index.log("tune", f"size {size} overlap {overlap}: recall {result['recall']} "
+                                  f"mrr {result['mrr']} tokens {result['prompt_tokens']}")
+
+    winner = pick(results, args.recall_tolerance)
+    report = {
+        "benchmark": "chunking",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "embeddings": "ollama" if args.embed_url else "stub",
+        "queries": len(queries),
+        "results": results,
+        "winner": {"size": winner["size"], "overlap": winner["overlap"]},
+    }
+    # Every shard is re-chunked and re-embedded for a new setting, so a stub-scored one is not kept by default
+    if not args.dry_run and not args.embed_url and not args.write:
+        doc_index.log("tune", f"Stub embeddings: not writing {doc_index.CHUNKING_FILE_NAME}; "
+                              "pass --embed-url to tune on real embeddings, or --write to keep this setting")
+    elif not args.dry_run:
+        index_dir.mkdir(parents=True, exist_ok=True)
+        tuned = {"size": winner["size"], "overlap": winner["overlap"], "tuned_at": report["timestamp"],
+                 "commit": report["commit"], "embeddings": report["embeddings"],
+                 "scores": {k: winner[k] for k in ("recall", "mrr", "hit_at_1", "prompt_tokens")}}
+        (index_dir / doc_index.CHUNKING_FILE_NAME).write_text(json.dumps(tuned, indent=2))
+        doc_index.log("tune", f"Wrote {index_dir / doc_index.CHUNKING_FILE_NAME}; the next index build re-chunks")
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Wrote {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Time-to-first-action benchmark for the planner, streamed versus whole responses.
+
+Runs generate_plan for every step of a scripted plan against the Gemini
+stub, which wraps each step in reasoning before and after the action line
+and generates output at --llm-token-ms per token. With streaming the
+planner returns, and cancels the stream, as soon as the action line is
+complete; without it the whole response is waited for. Both modes must
+return the same actions:
+
+    python -m benchmarks.plan_stream_benchmark --llm-token-ms 20 --output bench_plan_stream.json
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+from benchmarks.stats import git_commit, summarize
+from benchmarks.stubs import StubServers, load_plan
+
+
+def run_mode(decision, perception_cls, plan: List[str], streaming: bool, repeat: int, tag: int) -> Dict[str, Any]:
+    decision.PLAN_STREAMING = streaming
+    latencies: List[float] = []
+    actions: List[str] = []
+    for r in range(repeat):
+        # A fresh tag walks the scripted plan from its first step
+        perception = perception_cls(user_input=f"[bench-{tag + r}] benchmark query", intent="benchmark")
+        for _ in plan:
+            start = time.perf_counter()
+            actions.append(decision.generate_plan(perception, []))
+            latencies.append((time.perf_counter() - start) * 1000)
+    return {"time_to_action_ms": summarize(latencies), "actions": actions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streamed planning against whole responses")
+    parser.add_argument("--plan", help="JSON list of scripted planner responses (default: benchmarks/plans/default.json)")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs through the scripted plan per mode")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Latency before the first output")
+    parser.add_argument("--llm-token-ms", type=float, default=20.0, help="Generation time per output token")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    plan = load_plan(args.plan)
+    with StubServers(plan, llm_latency_ms=args.llm_latency_ms, llm_token_ms=args.llm_token_ms) as stubs:
+        # The Gemini clients are created on import, so the stub must be in the environment first
+        os.environ.update(GEMINI_API_KEY="stub-key", GEMINI_BASE_URL=stubs.gemini.url, TRACING_ENABLED="0")
+        import decision
+        from perception import PerceptionResult
+
+        whole = run_mode(decision, PerceptionResult, plan, False, args.repeat, tag=0)
+        streamed = run_mode(decision, PerceptionResult, plan, True, args.repeat, tag=args.repeat)
+        cancelled = stubs.gemini.cancelled
+
+    if whole["actions"] != streamed["actions"]:
+        raise SystemExit("Streamed and whole responses produced different actions")
+    report = {
+        "benchmark": "plan_stream",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "steps": len(whole["actions"]),
+        "modes": {
+            "whole": {"time_to_action_ms": whole["time_to_action_ms"]},
+            "streamed": {"time_to_action_ms": streamed["time_to_action_ms"], "streams_cancelled": cancelled},
+        },
+        "speedup_p50": round(whole["time_to_action_ms"]["p50"] / streamed["time_to_action_ms"]["p50"], 2),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Wrote {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Retrieval scaling benchmark over synthetic corpora.
+
+For each corpus size (1k to 1M chunks) and vector codec it measures, in a
+fresh process:
+
+- docs: process_documents build time, on-disk size, shard load time and
+  RSS, then DocumentIndex.search latency per search mode
+- memory: MemoryManager.bulk_add build time, on-disk size, then
+  MemoryManager.retrieve latency
+
+It also reports recall@k against exact flat search over the unquantized
+vectors, and hit@k for the chunk each query was drawn from.
+
+Embeddings come from benchmarks.synthetic.HashEmbedder in-process, the same
+vectors the Ollama stub serves, so large corpora build without HTTP:
+
+    python -m benchmarks.retrieval_benchmark --chunks 1000 10000 100000 --output bench_retrieval.json
+
+At 1M chunks pass a smaller --dim to keep the exact-search baseline in memory.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.stats import ROOT, git_commit, summarize
+from benchmarks.synthetic import HashEmbedder, sample_queries, synthetic_corpus, write_corpus
+from benchmarks.vector_storage_benchmark import memory_status
+
+TARGETS = {"docs": ["flat", "fp16", "sq8"], "memory": ["flat", "fp16"]}
+MODES = ["auto", "lexical", "vector", "hybrid"]
+BATCH = 1000
+
+
+def disk_mb(paths: List[Path]) -> float:
+    return round(sum(f.stat().st_size for p in paths for f in Path(p).rglob("*") if f.is_file()) / 2**20, 2)
+
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    import faiss
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    return exact.search(queries, k)[1]
+
+
+def quality(found: List[List[int]], truth: np.ndarray, sources: List[int], k: int) -> Dict[str, float]:
+    return {
+        f"recall_at_{k}": round(float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])), 4),
+        f"hit_at_{k}": round(float(np.mean([source in f for f, source in zip(found, sources)])), 4),
+    }
+
+
+def run_docs(args, codec: str, tmp: Path) -> Dict[str, Any]:
+    os.environ.update(DOC_CHUNK_SIZE=str(args.chunk_words), DOC_INDEX_CODEC=codec, TRACING_ENABLED="0")
+    import doc_index
+
+    corpus = synthetic_corpus(args.n, args.chunk_words, args.chunks_per_doc)
+    doc_dir, index_dir = tmp / "documents", tmp / "index"
+    write_corpus(corpus, doc_dir)
+    embedder = HashEmbedder(args.dim)
+    doc_index.get_embeddings = embedder.embed
+    doc_index.get_embedding = embedder.embed_one
+
+    start = time.perf_counter()
+    doc_index.process_documents(doc_dir, index_dir, codec=codec)
+    build_s = time.perf_counter() - start
+
+    before = memory_status()
+    start = time.perf_counter()
+    index = doc_index.DocumentIndex(index_dir)
+    for shard in index.shards():
+        shard.refresh()
+    load_ms = (time.perf_counter() - start) * 1000
+    after_load = memory_status()
+
+    queries = sample_queries(corpus, args.queries)
+    ids = {key: i for i, key in enumerate(corpus.keys)}
+    truth = exact_neighbours(embedder.embed(corpus.chunks), embedder.embed([q for q, _ in queries]), args.k)
+    sources = [source for _, source in queries]
+    modes = {}
+    for mode in args.modes:
+        latencies, found = [], []
+        for query, _ in queries:
+            start = time.perf_counter()
+            hits = index.search(query, top_k=args.k, mode=mode)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append([ids[(hit["doc"], hit["chunk_index"])] for hit in hits])
+        modes[mode] = {"latency_ms": summarize(latencies), **quality(found, truth, sources, args.k)}
+
+    return {
+        "build_s": round(build_s, 3),
+        "disk_mb": disk_mb([index_dir / spec["path"] for spec in doc_index.load_manifest(index_dir)]),
+        "load_ms": round(load_ms, 3),
+        "rss_kib_after_load": {key: after_load[key] - before.get(key, 0) for key in after_load},
+        "modes": modes,
+    }
+
+
+def run_memory(args, codec: str, tmp: Path) -> Dict[str, Any]:
+    os.environ.update(MEMORY_INDEX_CODEC=codec, TRACING_ENABLED="0")
+    from memory import MemoryItem, MemoryManager
+
+    corpus = synthetic_corpus(args.n, args.chunk_words, args.chunks_per_doc)
+    embedder = HashEmbedder(args.dim)
+    store_dir = tmp / "memory_store"
+    manager = MemoryManager(store_dir=str(store_dir), user_id="bench")
+    manager._get_embeddings = embedder.embed
+    manager._get_embedding = embedder.embed_one
+
+    before = memory_status()
+    start = time.perf_counter()
+    for offset in range(0, len(corpus.chunks), BATCH):
+        manager.bulk_add([MemoryItem(text=text, type="fact", session_id=f"s{(offset + i) % 100}")
+                          for i, text in enumerate(corpus.chunks[offset:offset + BATCH])])
+    manager.store.checkpoint()
+    build_s = time.perf_counter() - start
+    after_build = memory_status()
+
+    queries = sample_queries(corpus, args.queries)
+    ids = {text: i for i, text in enumerate(corpus.chunks)}
+    truth = exact_neighbours(embedder.embed(corpus.chunks), embedder.embed([q for q, _ in queries]), args.k)
+    latencies, found = [], []
+    for query, _ in queries:
+        start = time.perf_counter()
+        items = manager.retrieve(query, top_k=args.k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append([ids[item.text] for item in items])
+
+    return {
+        "build_s": round(build_s, 3),
+        "disk_mb": disk_mb([store_dir]),
+        "rss_kib_after_build": {key: after_build[key] - before.get(key, 0) for key in after_build},
+        "retrieve": {"latency_ms": summarize(latencies),
+                     **quality(found, truth, [source for _, source in queries], args.k)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark document search and memory retrieval at scale")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1000, 10000], help="Corpus sizes in chunks")
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument("--codecs", nargs="+", default=["flat", "fp16", "sq8"])
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES, help="Document search modes")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--chunk-words", type=int, default=60)
+    parser.add_argument("--chunks-per-doc", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--run", nargs=3, metavar=("TARGET", "CHUNKS", "CODEC"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        target, args.n, codec = args.run[0], int(args.run[1]), args.run[2]
+        with tempfile.TemporaryDirectory() as tmp:
+            run = run_docs if target == "docs" else run_memory
+            print(json.dumps(run(args, codec, Path(tmp))))
+        return
+
+    passthrough = ["--dim", str(args.dim), "--chunk-words", str(args.chunk_words),
+                   "--chunks-per-doc", str(args.chunks_per_doc), "--queries", str(args.queries),
+                   "--k", str(args.k), "--modes", *args.modes]
+    results = []
+    for n in args.chunks:
+        for target in args.targets:
+            for codec in (c for c in TARGETS[target] if c in args.codecs):
+                # A fresh process per run, so RSS and module-level settings belong to this run only
+                out = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.retrieval_benchmark", *passthrough,
+                     "--run", target, str(n), codec],
+                    cwd=ROOT, capture_output=True, text=True, check=True,
+                )
+                results.append({"target": target, "chunks": n, "codec": codec,
+                                **json.loads(out.stdout.strip().splitlines()[-1])})
+                print(f"{target} {n} {codec} done", file=sys.stderr)
+
+    report = {
+        "benchmark": "retrieval",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "run")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Wrote {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Latency and hit-quality benchmark for document search.
+
+Runs the labelled queries in benchmarks/queries/doc_search.json through
+each search mode (lexical, vector, hybrid and the auto router) and reports
+latency percentiles, hit@1, recall@k, MRR and how many queries needed an
+embedding call.
+
+By default the bundled PDFs are indexed into a temporary directory against
+the Ollama stub, whose hashed embeddings only approximate lexical overlap.
+Pass --embed-url to search the committed faiss_index/ with a real Ollama:
+
+    python -m benchmarks.search_benchmark --output bench_search.json
+    python -m benchmarks.search_benchmark --embed-url http://localhost:11434/api/embeddings
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.stats import ROOT, git_commit, summarize
+from benchmarks.stubs import StubServers
+
+DEFAULT_QUERIES = ROOT / "benchmarks" / "queries" / "doc_search.json"
+MODES = ["lexical", "vector", "hybrid", "auto"]
+
+
+def reciprocal_rank(docs: List[str], relevant: List[str]) -> float:
+    for rank, doc in enumerate(docs, start=1):
+        if doc in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def run_mode(index, queries: List[Dict[str, Any]], mode: str, top_k: int, repeat: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    routes: Counter = Counter()
+    hits_at_1: Dict[str, List[float]] = defaultdict(list)
+    recall: List[float] = []
+    rr: List[float] = []
+
+    for labelled in queries:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            hits = index.search(labelled["query"], top_k=top_k, mode=mode)
+            latencies.append((time.perf_counter() - start) * 1000)
+        routes[hits[0]["route"] if hits else mode] += 1
+        docs = [hit["doc"] for hit in hits]
+        relevant = labelled["relevant"]
+        hit_1 = float(bool(docs) and docs[0] in relevant)
+        hits_at_1["all"].append(hit_1)
+        hits_at_1[labelled.get("kind", "unlabelled")].append(hit_1)
+        recall.append(float(any(doc in relevant for doc in docs)))
+        rr.append(reciprocal_rank(docs, relevant))
+
+    return {
+        "latency_ms": summarize(latencies),
+        "hit_at_1": {kind: round(sum(v) / len(v), 3) for kind, v in sorted(hits_at_1.items())},
+        f"recall_at_{top_k}": round(sum(recall) / len(recall), 3),
+        "mrr": round(sum(rr) / len(rr), 3),
+        "routes": dict(routes),
+        "embedding_calls": sum(n for route, n in routes.items() if route != "lexical"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark search_documents retrieval modes")
+    parser.add_argument("--queries", default=str(DEFAULT_QUERIES), help="Labelled query set (JSON)")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per query")
+    parser.add_argument("--embed-url", help="Real Ollama embeddings URL; searches faiss_index/ instead of a stub-built index")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Latency added by the Ollama stub")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    import doc_index
+
+    queries = json.loads(Path(args.queries).read_text())
+    config = {k: v for k, v in vars(args).items() if k != "output"}
+    results: Dict[str, Any] = {}
+
+    if args.embed_url:
+        doc_index.EMBED_URL = args.embed_url
+        index = doc_index.DocumentIndex(doc_index.INDEX_DIR)
+        results = {mode: run_mode(index, queries, mode, args.top_k, args.repeat) for mode in args.modes}
+    else:
+        with StubServers([], embed_latency_ms=args.embed_latency_ms) as stubs, \
+                tempfile.TemporaryDirectory() as tmp:
+            doc_index.EMBED_URL = f"{stubs.ollama.url}/api/embeddings"
+            doc_index.process_documents(index_dir=Path(tmp))
+            index = doc_index.DocumentIndex(Path(tmp))
+            results = {mode: run_mode(index, queries, mode, args.top_k, args.repeat) for mode in args.modes}
+
+    report = {
+        "benchmark": "document_search",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": config,
+        "embeddings": "ollama" if args.embed_url else "stub",
+        "queries": len(queries),
+        "modes": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Wrote {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""MCP server startup benchmark.
+
+Spawns mcp-server.py over stdio the way agent.py and api.py do, and times,
+from process spawn:
+
+- session initialize
+- the first list_tools
+- the first search_documents result
+
+Each indexing mode (MCP_INDEX_MODE) is measured over several cold starts,
+with embeddings served by the Ollama stub. Each mode indexes a scratch copy
+of faiss_index/ and memory store, so the committed index is left as is:
+
+    python -m benchmarks.startup_benchmark --runs 5 --output bench_startup.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+from benchmarks.stats import ROOT, git_commit, summarize
+from benchmarks.stubs import StubServers
+
+MODES = ["background", "off", "sync"]
+
+
+async def cold_start(server: str, env: Dict[str, str], query: str) -> Dict[str, float]:
+    params = StdioServerParameters(command=sys.executable, args=[server], cwd=str(ROOT), env=env)
+    start = time.perf_counter()
+    timings = {}
+    async with stdio_client(params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            timings["initialize_ms"] = (time.perf_counter() - start) * 1000
+            await session.list_tools()
+            timings["first_list_tools_ms"] = (time.perf_counter() - start) * 1000
+            result = await session.call_tool("search_documents", arguments={"query": query})
+            timings["first_search_ms"] = (time.perf_counter() - start) * 1000
+            if result.isError:
+                raise RuntimeError(f"search_documents failed: {result.content}")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time MCP server startup to first list_tools and first search")
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts per indexing mode")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--server", default="mcp-server.py", help="Server script, relative to the repo root")
+    parser.add_argument("--query", default="which campus installed a 3.5 MW solar plant")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    results = {}
+    with StubServers([], embed_latency_ms=args.embed_latency_ms) as stubs, tempfile.TemporaryDirectory() as tmp:
+        for mode in args.modes:
+            env = {**os.environ, **stubs.env(), "MCP_INDEX_MODE": mode, "TRACING_ENABLED": "0", "MCP_WATCH_DOCS": "0"}
+            # Stub embeddings go to a scratch memory store and a copy of the index, fresh for each mode
+            env["MEMORY_STORE_DIR"] = str(Path(tmp) / mode / "memory_store")
+            env["DOC_INDEX_DIR"] = str(shutil.copytree(ROOT / "faiss_index", Path(tmp) / mode / "faiss_index",
+                                                       ignore=shutil.ignore_patterns(".build.lock")))
+            samples: Dict[str, List[float]] = defaultdict(list)
+            for _ in range(args.runs):
+                for name, ms in asyncio.run(cold_start(args.server, env, args.query)).items():
+                    samples[name].append(ms)
+            results[mode] = {name: summarize(values) for name, values in samples.items()}
+
+    report = {
+        "benchmark": "mcp_server_startup",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "modes": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Wrote {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Small statistics helpers shared by the benchmark scripts"""
+
+import math
+import subprocess
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+ROOT = Path(__file__).parent.parent.resolve()
+
+
+def percentile(values: Iterable[float], pct: float) -> float:
+    """Nearest-rank percentile; returns 0.0 for an empty sample"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values: Iterable[float]) -> Dict[str, float]:
+    """Count, mean and the latency percentiles we track across commits"""
+    values = list(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p90": round(percentile(values, 90), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    """Commit the benchmark ran against, so results can be compared over time"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
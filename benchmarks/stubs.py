@@ -0,0 +1,328 @@
+"""Local stand-ins for the external services the agent depends on.
+
+The agent needs Gemini (perception + planning), Ollama (embeddings), the
+2050 Materials API and the Azure structural surrogate. These stubs speak
+just enough of each protocol for the real client code to run unchanged,
+with a configurable artificial latency so benchmarks can model upstream
+cost without paying it.
+
+Run standalone to get a set of servers plus the env vars to point at them:
+
+    python -m benchmarks.stubs --plan benchmarks/plans/default.json
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+EMBED_DIM = 768  # matches nomic-embed-text, so the committed index stays searchable
+DEFAULT_PLAN = Path(__file__).parent / "plans" / "default.json"
+BENCH_TAG = re.compile(r"\[bench-(\d+)\]")
+WORD = re.compile(r"[a-z0-9]+")
+# Text the planner stub wraps around each scripted step, as the model reasons before and after its action
+PLAN_PREAMBLE = "Okay, continuing with the scripted plan."
+PLAN_RATIONALE = ("Once these results are back I will check them against the task requirements, "
+                  "then either evaluate the next option or give the final answer.")
+# Part of decision.FORCE_FINAL_NOTE; the planner stub answers when the agent has detected a loop
+FORCE_FINAL_MARK = "Respond now with exactly one FINAL_ANSWER"
+# Characters per streamed chunk and per generated token
+STREAM_CHUNK_CHARS = 32
+CHARS_PER_TOKEN = 4
+
+
+def hash_embedding(text: str, dim: int = EMBED_DIM) -> List[float]:
+    """Deterministic bag-of-words embedding using signed feature hashing.
+
+    Texts sharing words land close together, which is enough for retrieval
+    benchmarks to return stable, meaningful neighbours without a model.
+    """
+    vec = [0.0] * dim
+    for token in WORD.findall(text.lower()):
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vec[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def load_plan(path: Optional[str] = None) -> List[str]:
+    """Load a scripted plan: a JSON list with one planner response per step"""
+    return json.loads(Path(path or DEFAULT_PLAN).read_text())
+
+
+class Streamed(list):
+    """Payloads sent one by one as server-sent events instead of a single JSON reply"""
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Shared JSON plumbing; subclasses implement handle_json"""
+
+    def log_message(self, format, *args):  # keep benchmark output clean
+        pass
+
+    def _reply(self, status: int, payload: Any, content_type: str = "application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method: str):
+        parsed = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw and "json" in (self.headers.get("Content-Type") or "") else raw
+        except json.JSONDecodeError:
+            body = raw
+        time.sleep(self.server.latency_s)
+        with self.server._lock:
+            self.server.requests += 1
+        status, payload = self.handle_json(method, parsed.path, parse_qs(parsed.query), body)
+        if isinstance(payload, Streamed):
+            self._stream(status, payload)
+        else:
+            self._reply(status, payload)
+
+    def _stream(self, status: int, events: Streamed):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for event, delay_s in events:
+                time.sleep(delay_s)
+                self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, as a planner does once it has its action
+            with self.server._lock:
+                self.server.cancelled += 1
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def handle_json(self, method, path, query, body):
+        return 404, {"error": f"{method} {path} not stubbed"}
+
+
+def _candidate(text: str, finished: bool = True) -> Dict[str, Any]:
+    candidate: Dict[str, Any] = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    if finished:
+        candidate["finishReason"] = "STOP"
+    return candidate
+
+
+class GeminiStubHandler(_StubHandler):
+    """Answers generateContent and streamGenerateContent calls for the perception and planning prompts.
+
+    Planner calls follow the scripted plan; the step is tracked per
+    ``[bench-N]`` tag found in the prompt so concurrent queries each walk
+    the script from the start. With a token latency, output takes that long
+    per token to generate: a streamed reply sends each chunk as it is
+    generated, a plain one arrives once all of it is.
+    """
+
+    def handle_json(self, method, path, query, body):
+        if ":generateContent" not in path and ":streamGenerateContent" not in path:
+            return super().handle_json(method, path, query, body)
+        prompt = "".join(
+            part.get("text", "")
+            for content in body.get("contents", [])
+            for part in content.get("parts", [])
+        )
+        if "FUNCTION_CALL" in prompt:
+            text = self.server.next_plan_step(prompt)
+        else:
+            text = self.server.perception_reply(prompt)
+        usage = {"promptTokenCount": len(prompt) // CHARS_PER_TOKEN, "candidatesTokenCount": len(text) // CHARS_PER_TOKEN}
+        token_s = self.server.token_latency_s
+        if ":streamGenerateContent" in path:
+            pieces = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+            return 200, Streamed(
+                ({"candidates": [_candidate(piece, i == len(pieces) - 1)], "usageMetadata": usage},
+                 token_s * len(piece) / CHARS_PER_TOKEN)
+                for i, piece in enumerate(pieces)
+            )
+        time.sleep(token_s * len(text) / CHARS_PER_TOKEN)
+        return 200, {"candidates": [_candidate(text)], "usageMetadata": usage}
+
+
+class OllamaStubHandler(_StubHandler):
+    """Serves /api/embeddings (single prompt) and /api/embed (batched input)"""
+
+    def handle_json(self, method, path, query, body):
+        if path == "/api/embeddings":
+            return 200, {"embedding": hash_embedding(body.get("prompt", ""))}
+        if path == "/api/embed":
+            inputs = body.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            return 200, {"model": body.get("model"), "embeddings": [hash_embedding(t) for t in inputs]}
+        return super().handle_json(method, path, query, body)
+
+
+class Materials2050StubHandler(_StubHandler):
+    """Token exchange plus a product search returning one canned steel product"""
+
+    def handle_json(self, method, path, query, body):
+        if path.endswith("/developer/api/token/getapitoken/"):
+            return 200, {"api_token": "stub-2050-token"}
+        if path.endswith("/developer/api/get_products_open_api"):
+            name = (query.get("name") or ["Structural Steel"])[0]
+            return 200, {"products": [{
+                "name": name,
+                "material_type": "Steel",
+                "manufacturing_country": "India",
+                "city": "Gurugram",
+                "material_facts": {"declared_unit": "kg", "manufacturing": 0.513},
+            }]}
+        return super().handle_json(method, path, query, body)
+
+
+class SurrogateStubHandler(_StubHandler):
+    """OAuth client-credentials token plus a prediction endpoint in the Azure ML shape"""
+
+    def handle_json(self, method, path, query, body):
+        if path.endswith("/auth/token"):
+            return 200, {"token_type": "Bearer", "expires_in": 3600, "access_token": "stub-azure-token"}
+        if method == "POST":
+            inputs = (body or {}).get("inputs", {}).get("data", [6, 6, 30, 40, 4])
+            floors = float(inputs[-1]) if inputs else 4.0
+            predictions = [0.045 + 0.002 * floors, 400.0, 600.0, 0.25 + 0.01 * floors]
+            lower = [p * 0.9 for p in predictions]
+            upper = [p * 1.1 for p in predictions]
+            return 200, {"data": {
+                "predictions": json.dumps({"data": [{"data": predictions}]}),
+                "hdis": json.dumps({"data": [{"data": {
+                    "0.9": {"data": {"lower": {"data": lower}, "upper": {"data": upper}}}
+                }}]}),
+            }}
+        return super().handle_json(method, path, query, body)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, latency_ms: float = 0.0, plan: Optional[List[str]] = None,
+                 token_latency_ms: float = 0.0):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency_s = latency_ms / 1000.0
+        self.token_latency_s = token_latency_ms / 1000.0
+        self.requests = 0
+        self.cancelled = 0
+        self.plan = plan or []
+        self._plan_steps: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def next_plan_step(self, prompt: str) -> str:
+        match = BENCH_TAG.search(prompt)
+        key = match.group(1) if match else "default"
+        with self._lock:
+            step = self._plan_steps.get(key, 0)
+            self._plan_steps[key] = step + 1
+        if not self.plan:
+            return "FINAL_ANSWER: [no scripted plan]"
+        line = self.plan[min(step, len(self.plan) - 1)]
+        if FORCE_FINAL_MARK in prompt:
+            line = next((l for l in self.plan if l.startswith("FINAL_ANSWER:")), "FINAL_ANSWER: [stub answer]")
+        if line.startswith("FINAL_ANSWER:"):
+            # A repeated query walks the plan again from its first step
+            with self._lock:
+                self._plan_steps[key] = 0
+        return f"{PLAN_PREAMBLE}\n{line}\n{PLAN_RATIONALE}"
+
+    def perception_reply(self, prompt: str) -> str:
+        match = re.search(r'Input: "(.*?)"', prompt, re.S)
+        words = WORD.findall(BENCH_TAG.sub("", match.group(1) if match else prompt).lower())[:5]
+        return json.dumps({"intent": "benchmark query", "entities": words, "tool_hint": "search_documents"})
+
+
+class StubServers:
+    """Starts every stub on an ephemeral port; use as a context manager"""
+
+    def __init__(self, plan: Optional[List[str]] = None, llm_latency_ms: float = 0.0,
+                 embed_latency_ms: float = 0.0, tool_latency_ms: float = 0.0, llm_token_ms: float = 0.0):
+        self.gemini = StubServer(GeminiStubHandler, llm_latency_ms, plan or load_plan(), llm_token_ms)
+        self.ollama = StubServer(OllamaStubHandler, embed_latency_ms)
+        self.materials = StubServer(Materials2050StubHandler, tool_latency_ms)
+        self.surrogate = StubServer(SurrogateStubHandler, tool_latency_ms)
+        self._servers = [self.gemini, self.ollama, self.materials, self.surrogate]
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> "StubServers":
+        for server in self._servers:
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self) -> None:
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def env(self) -> Dict[str, str]:
+        """Environment overrides that route every upstream call to the stubs"""
+        return {
+            "GEMINI_API_KEY": "stub-key",
+            "GEMINI_BASE_URL": self.gemini.url,
+            "EMBED_URL": f"{self.ollama.url}/api/embeddings",
+            "MATERIALS_2050_API_URL": f"{self.materials.url}/",
+            "DEVELOPER_TOKEN": "stub-developer-token",
+            "API_URL": self.surrogate.url,
+            "API_ENDPOINT_NAME": "score",
+            "AZURE_CLIENT_ID": "stub-client",
+            "AZURE_CLIENT_SECRET": "stub-secret",
+            "AZURE_SCOPE": "stub-scope",
+        }
+
+    def request_counts(self) -> Dict[str, int]:
+        return {
+            "gemini": self.gemini.requests,
+            "ollama": self.ollama.requests,
+            "materials_2050": self.materials.requests,
+            "surrogate": self.surrogate.requests,
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for the agent's upstream services")
+    parser.add_argument("--plan", help="JSON list of planner responses, one per step")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-token-ms", type=float, default=0.0, help="Generation time per output token")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--tool-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stubs = StubServers(load_plan(args.plan), args.llm_latency_ms, args.embed_latency_ms, args.tool_latency_ms,
+                        args.llm_token_ms)
+    with stubs:
+        for key, value in stubs.env().items():
+            print(f"export {key}={value}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
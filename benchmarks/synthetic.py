@@ -0,0 +1,98 @@
+"""Deterministic synthetic corpora and a local embedder for retrieval benchmarks.
+
+Documents are drawn from a Zipf-distributed vocabulary, each mixing a few
+topic words into common background words, so nearest neighbours cluster by
+document the way real case studies do. The embedder gives the same vectors
+as the Ollama stub's hash_embedding, batched with numpy and without HTTP.
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from benchmarks.stubs import EMBED_DIM, WORD
+
+# File name patterns of the default shards, so a synthetic corpus spreads over all of them
+SHARD_SUFFIXES = ("Rating_Report", "case_study_card", "project")
+
+
+class HashEmbedder:
+    """Signed feature-hashing bag of words; identical to stubs.hash_embedding"""
+
+    def __init__(self, dim: int = EMBED_DIM):
+        self.dim = dim
+        self._features: Dict[str, Tuple[int, float]] = {}
+
+    def _feature(self, token: str) -> Tuple[int, float]:
+        feature = self._features.get(token)
+        if feature is None:
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            feature = (int.from_bytes(digest[:4], "little") % self.dim, 1.0 if digest[4] & 1 else -1.0)
+            self._features[token] = feature
+        return feature
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            features = [self._feature(token) for token in WORD.findall(text.lower())]
+            if features:
+                buckets, signs = zip(*features)
+                np.add.at(vectors[row], list(buckets), signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+
+class Corpus(NamedTuple):
+    docs: Dict[str, List[str]]  # file name -> chunk texts, in order
+    chunks: List[str]           # every chunk, in (doc, chunk_index) order
+    keys: List[Tuple[str, int]]  # (doc, chunk_index) of each chunk
+
+
+def synthetic_corpus(n_chunks: int, chunk_words: int = 60, chunks_per_doc: int = 20, vocab: int = 20000,
+                     topic_words: int = 30, seed: int = 0) -> Corpus:
+    """n_chunks chunks of exactly chunk_words words, grouped into documents"""
+    rng = np.random.default_rng(seed)
+    words = np.array([f"w{i}" for i in range(vocab)])
+    # Zipf-like background frequencies
+    weights = 1.0 / np.arange(1, vocab + 1)
+    weights /= weights.sum()
+    docs: Dict[str, List[str]] = {}
+    chunks: List[str] = []
+    keys: List[Tuple[str, int]] = []
+    n_docs = -(-n_chunks // chunks_per_doc)
+    for d in range(n_docs):
+        name = f"synthetic_{d:06d}_{SHARD_SUFFIXES[d % len(SHARD_SUFFIXES)]}.txt"
+        topic = rng.choice(words[vocab // 10:], size=topic_words, replace=False)
+        count = min(chunks_per_doc, n_chunks - len(chunks))
+        background = rng.choice(words, size=(count, chunk_words), p=weights)
+        on_topic = rng.random((count, chunk_words)) < 0.3
+        drawn = np.where(on_topic, rng.choice(topic, size=(count, chunk_words)), background)
+        docs[name] = [" ".join(row) for row in drawn]
+        for i, text in enumerate(docs[name]):
+            chunks.append(text)
+            keys.append((name, i))
+    return Corpus(docs, chunks, keys)
+
+
+def write_corpus(corpus: Corpus, doc_dir: Path) -> None:
+    """One .txt file per document; with DOC_CHUNK_SIZE set to chunk_words the indexer cuts the same chunks"""
+    doc_dir.mkdir(parents=True, exist_ok=True)
+    for name, doc_chunks in corpus.docs.items():
+        (doc_dir / name).write_text("\n".join(doc_chunks))
+
+
+def sample_queries(corpus: Corpus, n: int, words: int = 8, seed: int = 1) -> List[Tuple[str, int]]:
+    """(query, source chunk) pairs; each query is a random subset of its source chunk's words"""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for source in rng.choice(len(corpus.chunks), size=min(n, len(corpus.chunks)), replace=False):
+        chunk_words = corpus.chunks[source].split()
+        picked = rng.choice(len(chunk_words), size=min(words, len(chunk_words)), replace=False)
+        queries.append((" ".join(chunk_words[i] for i in sorted(picked)), int(source)))
+    return queries
@@ -0,0 +1,157 @@
+"""Memory, load time and recall of the vector storage layouts.
+
+Builds one index per codec (float32 "flat", "fp16", "sq8") over synthetic
+clustered embeddings, then loads each file in a fresh subprocess, both
+read into RAM and memory-mapped, and reports:
+
+- file size
+- load time
+- anonymous vs file-backed RSS after loading and after searching
+- search latency
+- recall@k against exact float32 search
+
+File-backed pages of a mapped index sit in the page cache and are shared by
+every process that maps the same file:
+
+    python -m benchmarks.vector_storage_benchmark --vectors 50000 --output bench_vectors.json
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+import numpy as np
+
+from benchmarks.stats import ROOT, git_commit, summarize
+
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0, clusters: int = 64) -> np.ndarray:
+    """Embedding-like data: points scattered around random cluster centres"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim)).astype(np.float32)
+    assignment = rng.integers(0, clusters, size=n)
+    return (centres[assignment] + 0.35 * rng.normal(size=(n, dim))).astype(np.float32)
+
+
+def memory_status() -> Dict[str, int]:
+    """Anonymous and file-backed resident memory in KiB (Linux /proc)"""
+    fields = {}
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                fields[key] = int(value.split()[0])
+    except OSError:
+        import resource
+        fields["VmRSS"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return fields
+
+
+def measure(index_path: str, mmap: bool, queries_path: str, truth_path: str, k: int) -> Dict[str, Any]:
+    """Runs in a fresh process so RSS reflects only this index"""
+    sys.path.insert(0, str(ROOT))
+    import faiss  # noqa: F401  (imported before the baseline so library pages are not counted)
+    from vector_codecs import read_index
+
+    queries = np.load(queries_path)
+    truth = np.load(truth_path)
+    before = memory_status()
+    start = time.perf_counter()
+    index = read_index(Path(index_path), mmap=mmap)
+    load_ms = (time.perf_counter() - start) * 1000
+    after_load = memory_status()
+
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(ids[0])
+    after_search = memory_status()
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+
+    def delta(status):
+        return {key: status.get(key, 0) - before.get(key, 0) for key in status}
+
+    return {
+        "load_ms": round(load_ms, 3),
+        "rss_kib_after_load": delta(after_load),
+        "rss_kib_after_search": delta(after_search),
+        "search_ms": summarize(latencies),
+        f"recall_at_{k}": round(float(recall), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark float32 / fp16 / sq8 and mmap vector storage")
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=768, help="nomic-embed-text produces 768-d vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--codecs", nargs="+", default=["flat", "fp16", "sq8"])
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--measure", nargs=4, metavar=("INDEX", "MMAP", "QUERIES", "TRUTH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        index_path, mmap, queries_path, truth_path = args.measure
+        print(json.dumps(measure(index_path, mmap == "1", queries_path, truth_path, args.k)))
+        return
+
+    import faiss
+    from vector_codecs import build_index
+
+    data = synthetic_vectors(args.vectors, args.dim)
+    rng = np.random.default_rng(1)
+    picks = rng.integers(0, args.vectors, size=args.queries)
+    queries = data[picks] + 0.1 * rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(data)
+    _, truth = exact.search(queries, args.k)
+
+    layouts: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        np.save(tmp / "queries.npy", queries)
+        np.save(tmp / "truth.npy", truth)
+        for codec in args.codecs:
+            path = tmp / f"{codec}.index"
+            start = time.perf_counter()
+            faiss.write_index(build_index(data, codec), str(path))
+            build_s = time.perf_counter() - start
+            for mmap in (False, True):
+                out = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.vector_storage_benchmark", "--k", str(args.k),
+                     "--measure", str(path), "1" if mmap else "0", str(tmp / "queries.npy"), str(tmp / "truth.npy")],
+                    cwd=ROOT, capture_output=True, text=True, check=True,
+                )
+                layouts[f"{codec}{'+mmap' if mmap else ''}"] = {
+                    "file_mb": round(path.stat().st_size / 2**20, 2),
+                    "build_s": round(build_s, 3),
+                    **json.loads(out.stdout),
+                }
+
+    report = {
+        "benchmark": "vector_storage",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "measure")},
+        "layouts": layouts,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Wrote {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# bm25.py
+
+import json
+import math
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is",
+    "it", "of", "on", "or", "that", "the", "this", "to", "was", "were", "what", "which", "with",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word/number tokens; decimals like 10.80 stay one token"""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index scored with Okapi BM25; document IDs line up with FAISS row IDs"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_lengths: List[int] = []
+        self._total_length = 0
+
+    @classmethod
+    def build(cls, texts: Iterable[str], **params) -> "BM25Index":
+        index = cls(**params)
+        for text in texts:
+            index.add(text)
+        return index
+
+    def add(self, text: str) -> int:
+        doc_id = len(self.doc_lengths)
+        tokens = tokenize(text)
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.doc_lengths.append(len(tokens))
+        self._total_length += len(tokens)
+        return doc_id
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def idf(self, term: str) -> float:
+        n = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self) - n + 0.5) / (n + 0.5))
+
+    def scores(self, query: str, allowed: Optional[Collection[int]] = None) -> Dict[int, float]:
+        """BM25 score for every document sharing at least one term with the query"""
+        if not self.doc_lengths:
+            return {}
+        avg_length = self._total_length / len(self.doc_lengths) or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_id, tf in postings.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, top_k: int = 5, allowed: Optional[Collection[int]] = None) -> List[Tuple[int, float]]:
+        """Top documents by score, optionally restricted to the allowed doc IDs"""
+        ranked = sorted(self.scores(query, allowed).items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k]
+
+    def coverage(self, query: str, doc_id: int) -> float:
+        """Share of the query's IDF weight that appears in the document"""
+        terms = set(tokenize(query))
+        total = sum(self.idf(t) for t in terms)
+        if not total:
+            return 0.0
+        matched = sum(self.idf(t) for t in terms if doc_id in self.postings.get(t, {}))
+        return matched / total
+
+    def to_dict(self) -> dict:
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "doc_lengths": self.doc_lengths,
+            "postings": {term: list(docs.items()) for term, docs in self.postings.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        index = cls(k1=data["k1"], b=data["b"])
+        index.doc_lengths = data["doc_lengths"]
+        index._total_length = sum(index.doc_lengths)
+        index.postings = {term: {int(d): tf for d, tf in docs} for term, docs in data["postings"].items()}
+        return index
+
+    def save(self, path: Path) -> None:
+        Path(path).write_text(json.dumps(self.to_dict()))
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        return cls.from_dict(json.loads(Path(path).read_text()))
@@ -0,0 +1,155 @@
+# context_budget.py
+
+import ast
+import json
+import os
+import re
+from typing import Any, Dict, List
+
+from memory import MemoryItem
+
+# Prompt tokens the planner may spend on memories and previous results together
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Longest a single tool output or memory may be once compacted
+CONTEXT_ITEM_TOKENS = int(os.getenv("CONTEXT_ITEM_TOKENS", "200"))
+# Memories that would have to be cut shorter than this are left out
+MIN_ITEM_TOKENS = 40
+# Rough characters per prompt token for English text
+CHARS_PER_TOKEN = 4
+
+SOURCE_TAG = re.compile(r"\[Source: [^\]]*\]")
+NUMBER = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?$")
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _parse(value: Any) -> Any:
+    if not isinstance(value, str):
+        return value
+    text = value.strip()
+    if NUMBER.match(text):
+        return float(text)
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            return parse(text)
+        except Exception:
+            pass
+    return value
+
+
+def is_numeric(value: Any) -> bool:
+    """True for numbers and for lists/dicts (or their JSON text) made only of numbers, booleans and short labels"""
+    value = _parse(value)
+    if isinstance(value, (list, tuple)) and len(value) == 1:
+        value = _parse(value[0])
+    if isinstance(value, (bool, int, float)):
+        return True
+    if isinstance(value, dict):
+        values = list(value.values())
+    elif isinstance(value, (list, tuple)):
+        values = list(value)
+    else:
+        return False
+    return bool(values) and all(
+        isinstance(v, (bool, int, float)) or (isinstance(v, str) and len(v) <= 40) or is_numeric(v)
+        for v in values
+    ) and any(not isinstance(v, str) for v in values)
+
+
+def compact(value: Any, max_tokens: int = CONTEXT_ITEM_TOKENS) -> str:
+    """Text of a tool output cut to max_tokens; structured numeric results and [Source: ...] tags are kept whole"""
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return "[]"
+        # Each search hit or content item gets an equal share
+        share = max(max_tokens // len(value), 20)
+        return "\n".join(compact(item, share) for item in value)
+    text = value if isinstance(value, str) else str(value)
+    if estimate_tokens(text) <= max_tokens or is_numeric(value):
+        return text
+    sources = SOURCE_TAG.findall(text)
+    body = SOURCE_TAG.sub("", text)
+    words = body.split()
+    keep = max_tokens * CHARS_PER_TOKEN - sum(len(s) + 1 for s in sources) - len(f" ... [{len(words)} more words]")
+    head: List[str] = []
+    for word in words:
+        keep -= len(word) + 1
+        if keep < 0:
+            break
+        head.append(word)
+    cut = len(words) - len(head)
+    return "\n".join([" ".join(head) + (f" ... [{cut} more words]" if cut else ""), *sources])
+
+
+class ContextBudget:
+    """Keeps the planner's memories and previous results within a token budget.
+
+    Previous results that are structured numbers are always kept verbatim;
+    the others are kept newest first while they fit in half the budget,
+    older ones are counted but left out. Memories then fill what is left, in
+    retrieval order, each compacted to CONTEXT_ITEM_TOKENS or to the room left. Every step's
+    prompt size is recorded in steps.
+    """
+
+    def __init__(self, max_tokens: int = CONTEXT_TOKEN_BUDGET, item_tokens: int = CONTEXT_ITEM_TOKENS):
+        self.max_tokens = max_tokens
+        self.item_tokens = item_tokens
+        self.steps: List[Dict[str, Any]] = []
+        self._results_tokens = 0
+
+    def start_step(self, step: int) -> None:
+        self.steps.append({"step": step})
+        self._results_tokens = 0
+
+    def _current(self) -> Dict[str, Any]:
+        if not self.steps:
+            self.start_step(1)
+        return self.steps[-1]
+
+    def results_text(self, results: Dict[str, Any]) -> str:
+        numeric = {k: v for k, v in results.items() if is_numeric(v)}
+        used = estimate_tokens(str(numeric))
+        kept: Dict[str, str] = {}
+        for key in reversed([k for k in results if k not in numeric]):
+            entry = compact(results[key], self.item_tokens)
+            cost = estimate_tokens(f"{key}: {entry}, ")
+            if used + cost > self.max_tokens // 2:
+                break
+            kept[key] = entry
+            used += cost
+        dropped = len(results) - len(numeric) - len(kept)
+        # Shown in the order the results were produced
+        parts = [f"{k}: {numeric[k] if k in numeric else kept[k]}" for k in results if k in numeric or k in kept]
+        if dropped:
+            parts.insert(0, f"({dropped} earlier results omitted)")
+        text = ", ".join(parts)
+        self._results_tokens = estimate_tokens(text)
+        self._current().update(results_tokens=self._results_tokens, results_dropped=dropped)
+        return text
+
+    def fit_memories(self, items: List[MemoryItem]) -> List[MemoryItem]:
+        available = max(self.max_tokens - self._results_tokens, 0)
+        fitted: List[MemoryItem] = []
+        used = 0
+        seen = set()
+        for item in items:
+            # The last memories that fit are cut shorter rather than left out
+            room = min(self.item_tokens, available - used)
+            if room < MIN_ITEM_TOKENS:
+                break
+            text = compact(item.text, room)
+            cost = estimate_tokens(text)
+            if text in seen or used + cost > available:
+                continue
+            seen.add(text)
+            fitted.append(item if text == item.text else item.model_copy(update={"text": text}))
+            used += cost
+        self._current().update(memory_tokens=used, memories=len(fitted), memories_dropped=len(items) - len(fitted))
+        return fitted
+
+    def record_prompt(self, prompt: str) -> int:
+        tokens = estimate_tokens(prompt)
+        self._current()["prompt_tokens"] = tokens
+        return tokens
@@ -1,9 +1,13 @@
 from perception import PerceptionResult
 from memory import MemoryItem
-from typing import List, Optional
+from context_budget import ContextBudget
+from contextlib import closing
+from typing import Iterable, List, Optional, Tuple
 from dotenv import load_dotenv
 from google import genai
+from google.genai import types
 import os
+from tracing import traced, annotate
 
 # Optional: import log from agent if shared, else define locally
 try:
@@ -11,19 +15,75 @@ try:
 except ImportError:
     import datetime
     def log(stage: str, msg: str):
-        now = datetime.datetime.now().strftime("%H:%M:%S")
+        now = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
         print(f"[{now}] [{stage}] {msg}")
 
 load_dotenv()
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-
+# GEMINI_BASE_URL lets benchmarks point the client at a local stand-in
+_gemini_base_url = os.getenv("GEMINI_BASE_URL")
+client = genai.Client(
+    api_key=os.getenv("GEMINI_API_KEY"),
+    http_options=types.HttpOptions(base_url=_gemini_base_url) if _gemini_base_url else None
+)
+
+# Stream the planner's output and stop reading once its action is complete
+PLAN_STREAMING = os.getenv("PLAN_STREAMING", "1") != "0"
+CALL_PREFIX = "FUNCTION_CALL:"
+# Appended to the prompt once the agent has detected a loop of repeated calls
+FORCE_FINAL_NOTE = ("Your last steps only repeated tool calls you had already made. Do NOT call any tool again. "
+                    "Respond now with exactly one FINAL_ANSWER built from the results and memories above.")
+
+
+def read_action(pieces: Iterable[str]) -> Tuple[Optional[str], str]:
+    """Reads model output until its action is complete; returns (action or None, text read).
+
+    A step is either a run of FUNCTION_CALL lines or a single FINAL_ANSWER,
+    whichever the model emitted first. Reading stops at the end of the
+    FINAL_ANSWER line, or as soon as the line after the calls can no longer
+    be another call, so reasoning that follows the action is never waited for.
+    """
+    read = ""
+    buffer = ""
+    calls: List[str] = []
+    for piece in pieces:
+        read += piece
+        buffer += piece
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line = line.strip()
+            if line.startswith(CALL_PREFIX):
+                calls.append(line)
+            elif calls and line:
+                return "\n".join(calls), read
+            elif line.startswith("FINAL_ANSWER:"):
+                return line, read
+        pending = buffer.lstrip()
+        if calls and pending and not (pending.startswith(CALL_PREFIX) or CALL_PREFIX.startswith(pending)):
+            return "\n".join(calls), read
+    line = buffer.strip()
+    if line.startswith(CALL_PREFIX):
+        calls.append(line)
+    elif line.startswith("FINAL_ANSWER:") and not calls:
+        return line, read
+    return ("\n".join(calls) if calls else None), read
+
+
+@traced("plan")
 def generate_plan(
     perception: PerceptionResult,
     memory_items: List[MemoryItem],
-    tool_descriptions: Optional[str] = None
+    tool_descriptions: Optional[str] = None,
+    budget: Optional[ContextBudget] = None,
+    force_final: bool = False
 ) -> str:
-    """Generates a plan (tool call or final answer) using LLM based on structured perception and memory."""
+    """Generates a plan (tool call or final answer) using LLM based on structured perception and memory.
+
+    With a budget, memories are compacted and trimmed to it and the prompt size is recorded for the step.
+    With force_final the model is told to answer now, and a tool call it still makes is not returned.
+    """
 
+    if budget is not None:
+        memory_items = budget.fit_memories(memory_items)
     memory_texts = "\n".join(f"- {m.text}" for m in memory_items) or "None"
     
     # Extract previous math results if available
@@ -71,11 +131,15 @@ Always follow this loop:
    FUNCTION_CALL: tool_name|param1=value1|param2=value2
    For tools that take a complex input object (e.g., named 'input'), use dot notation for nested parameters:
    FUNCTION_CALL: tool_name|input.nested_param1=valueA|input.nested_param2=valueB
+   If several calls are independent of each other (e.g. looking up several products, or evaluating several schemes), put each on its own line and they will run in parallel:
+   FUNCTION_CALL: search_2050_products|input.product_name=Recycled Steel S235
+   FUNCTION_CALL: search_2050_products|input.product_name=Low Carbon Concrete C30
 3. When the final answer is known, respond using:
    FINAL_ANSWER: [your final result]
 
 Important context:
-- Respond using EXACTLY ONE of the formats above per step.
+- Respond per step with EITHER one or more FUNCTION_CALL lines OR exactly one FINAL_ANSWER.
+- Only batch FUNCTION_CALL lines whose inputs do not depend on each other's results.
 - Do NOT include extra text, explanation, or formatting.
 - Use nested keys (e.g., input.string) and square brackets for lists.
 - You're currently on step {len(math_results) + 1} of solving this problem
@@ -122,25 +186,49 @@ IMPORTANT:
 - 🧮 If the question is mathematical or needs calculation, use the appropriate math tool.
 - 🤖 If the previous tool output already contains factual information, DO NOT search again. Instead, summarize the relevant facts and respond with: FINAL_ANSWER: [your answer]
 - Only repeat `search_documents` if the last result was irrelevant or empty.
+- 🏢 If the user asks about one specific building, restrict the search to it: FUNCTION_CALL: search_documents|query="water efficiency"|doc="New Maharashtra Sadan"
+- 🔎 If a question needs several lookups, send them together in one call: FUNCTION_CALL: search_documents_batch|queries=["rainwater storage capacity", "solar photovoltaic capacity"]
 - ❌ Do NOT repeat function calls with the same parameters.
 - ❌ Do NOT output unstructured responses.
 - 🧠 Think before each step. Verify intermediate results mentally before proceeding.
 - 💥 If unsure or no tool fits, skip to FINAL_ANSWER: [unknown]
 """
+    if force_final:
+        prompt += f"\n{FORCE_FINAL_NOTE}\n"
+
+    if budget is not None:
+        tokens = budget.record_prompt(prompt)
+        step = budget.steps[-1]
+        log("context", f"Step {step['step']} prompt ~{tokens} tokens "
+                       f"(memories {step.get('memory_tokens', 0)}, results {step.get('results_tokens', 0)})")
+        annotate(prompt_tokens=tokens)
 
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        raw = response.text.strip()
+        if PLAN_STREAMING:
+            # Closing the stream once the action is read cancels the rest of the generation
+            stream = client.models.generate_content_stream(
+                model="gemini-2.0-flash",
+                contents=prompt
+            )
+            with closing(stream):
+                action, raw = read_action(chunk.text or "" for chunk in stream)
+        else:
+            response = client.models.generate_content(
+                model="gemini-2.0-flash",
+                contents=prompt
+            )
+            action, raw = read_action([response.text or ""])
+        raw = raw.strip()
         log("plan", f"LLM output: {raw}")
 
-        for line in raw.splitlines():
-            if line.strip().startswith("FUNCTION_CALL:") or line.strip().startswith("FINAL_ANSWER:"):
-                return line.strip()
+        annotate(prompt_chars=len(prompt), response_chars=len(raw), streamed=PLAN_STREAMING)
 
-        return raw.strip()
+        if action and action.startswith(CALL_PREFIX):
+            if force_final:
+                log("plan", "⚠️ Tool call made where a final answer was required")
+                return "FINAL_ANSWER: [unknown]"
+            annotate(calls=len(action.splitlines()))
+        return action or raw
 
     except Exception as e:
         log("plan", f"⚠️ Decision generation failed: {e}")
@@ -0,0 +1,1130 @@
+# doc_index.py
+
+import contextvars
+import fnmatch
+import hashlib
+import heapq
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from difflib import SequenceMatcher
+from itertools import groupby, islice
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import faiss
+import numpy as np
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are only serialized within a process
+    fcntl = None
+
+from bm25 import BM25Index, tokenize
+from tracing import annotate, span, traced
+from vector_codecs import CODECS, codec_of, new_index, read_index, write_index
+
+ROOT = Path(__file__).parent.resolve()
+DOC_PATH = Path(os.getenv("DOC_PATH", ROOT / "documents"))
+# Optional {"file name": ["tag", ...]} sidecar in the documents folder, merged with inferred tags
+TAGS_FILE_NAME = "tags.json"
+INDEX_DIR = Path(os.getenv("DOC_INDEX_DIR", ROOT / "faiss_index"))
+# Vector storage for rebuilt shards (see vector_codecs.CODECS), and whether shards are
+# memory-mapped so concurrent MCP server processes share one copy of the vectors
+DOC_INDEX_CODEC = os.getenv("DOC_INDEX_CODEC", "flat")
+DOC_INDEX_MMAP = os.getenv("DOC_INDEX_MMAP", "1") != "0"
+
+EMBED_URL = os.getenv("EMBED_URL", "http://localhost:11434/api/embeddings")
+EMBED_MODEL = "nomic-embed-text"
+# Chunk size in words and words shared by consecutive chunks of a document. chunking.json in the
+# index directory (written by benchmarks.chunking_tuner) overrides these, DOC_CHUNK_SIZE and
+# DOC_CHUNK_OVERLAP override both
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 0
+CHUNKING_FILE_NAME = "chunking.json"
+# Chunks per /api/embed request when indexing
+EMBED_BATCH = int(os.getenv("DOC_EMBED_BATCH", "32"))
+# PDFs with at least this many pages are read page by page instead of through MarkItDown
+STREAM_MIN_PAGES = int(os.getenv("DOC_STREAM_MIN_PAGES", "20"))
+# Rows copied per reconstruct call when carrying a shard's unchanged documents over
+COPY_BATCH = 4096
+# Vectors an sq8 index is trained on before the rest are added as they arrive
+SQ8_TRAIN_ROWS = 65536
+
+# Query router: a lexical hit is answered without embedding when the top chunk
+# contains every informative query term and clearly beats the runner-up
+LEXICAL_MIN_COVERAGE = float(os.getenv("DOC_LEXICAL_MIN_COVERAGE", "0.999"))
+LEXICAL_MIN_MARGIN = float(os.getenv("DOC_LEXICAL_MIN_MARGIN", "1.5"))
+# Words in the passage extracted from each hit, 0 for whole chunks; sentences without
+# end punctuation (tables, lists) are cut into pieces of at most SENTENCE_MAX_WORDS
+SNIPPET_WORDS = int(os.getenv("DOC_SNIPPET_WORDS", "80"))
+SENTENCE_MAX_WORDS = 40
+SENTENCE_END = re.compile(r"[.!?][\"')\]]*$")
+
+# Reciprocal rank fusion constant and how deep each ranker is read before fusing
+RRF_K = 60
+FUSION_DEPTH = 20
+
+SEARCH_MODES = ("auto", "lexical", "vector", "hybrid")
+
+# Threads used to search shards concurrently
+SEARCH_WORKERS = int(os.getenv("DOC_SEARCH_WORKERS", "4"))
+
+# Fuzzy document filter: per-word similarity, and share of query words that must match
+DOC_WORD_MATCH = 0.8
+DOC_NAME_MATCH = 0.75
+
+
+def log(stage: str, msg: str):
+    """Logs go to stderr; stdout is the MCP JSON channel"""
+    now = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    sys.stderr.write(f"[{now}] [{stage}] {msg}\n")
+    sys.stderr.flush()
+
+
+def get_embedding(text: str) -> np.ndarray:
+    response = requests.post(EMBED_URL, json={"model": EMBED_MODEL, "prompt": text})
+    response.raise_for_status()
+    return np.array(response.json()["embedding"], dtype=np.float32)
+
+
+def get_embeddings(texts: List[str]) -> np.ndarray:
+    """Embeds texts in one /api/embed request, falling back to one request per text"""
+    if len(texts) == 1:
+        return get_embedding(texts[0]).reshape(1, -1)
+    try:
+        response = requests.post(EMBED_URL.replace("/api/embeddings", "/api/embed"),
+                                 json={"model": EMBED_MODEL, "input": texts})
+        response.raise_for_status()
+        return np.array(response.json()["embeddings"], dtype=np.float32)
+    except (requests.RequestException, KeyError):
+        return np.stack([get_embedding(text) for text in texts])
+
+
+def chunk_stream(pieces: Iterable[str], size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """Chunks of `size` words from text arriving in pieces, consecutive chunks sharing `overlap` words.
+
+    Words are read as they come, so only one chunk's worth is held at a time.
+    """
+    if not 0 <= overlap < size:
+        raise ValueError(f"Chunk overlap must be in [0, {size}), got {overlap}")
+    window: List[str] = []
+    fresh = 0
+    for piece in pieces:
+        for word in re.finditer(r"\S+", piece):
+            window.append(word.group())
+            fresh += 1
+            if len(window) == size:
+                yield " ".join(window)
+                window = window[size - overlap:]
+                fresh = 0
+    if fresh:
+        yield " ".join(window)
+
+
+def chunk_text(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    return chunk_stream([text], size, overlap)
+
+
+def sentence_spans(text: str, max_words: int = SENTENCE_MAX_WORDS) -> List[List[int]]:
+    """[start, end) character offsets of the sentences in a chunk"""
+    spans: List[List[int]] = []
+    start, words = None, 0
+    for word in re.finditer(r"\S+", text):
+        if start is None:
+            start, words = word.start(), 0
+        words += 1
+        if words == max_words or SENTENCE_END.search(word.group()):
+            spans.append([start, word.end()])
+            start = None
+    if start is not None:
+        spans.append([start, len(text.rstrip())])
+    return spans
+
+
+def chunking_params(index_dir: Path = INDEX_DIR) -> Dict[str, int]:
+    """{"size", "overlap"} used to chunk documents for an index directory"""
+    params = {"size": CHUNK_SIZE, "overlap": CHUNK_OVERLAP}
+    tuned = Path(index_dir) / CHUNKING_FILE_NAME
+    if tuned.exists():
+        params.update({key: int(value) for key, value in json.loads(tuned.read_text()).items() if key in params})
+    for key, env in (("size", "DOC_CHUNK_SIZE"), ("overlap", "DOC_CHUNK_OVERLAP")):
+        if os.getenv(env):
+            params[key] = int(os.environ[env])
+    return params
+
+
+def shard_chunking(shard: Dict) -> Dict[str, int]:
+    """Chunking a shard was built with; shards built before it was recorded used the defaults"""
+    return shard.get("chunking", {"size": CHUNK_SIZE, "overlap": CHUNK_OVERLAP})
+
+
+def infer_tags(file_name: str, text: str) -> List[str]:
+    """Rating system, star rating and document kind read off the case-study text and file name"""
+    tags = set()
+    text = " ".join(text.split())
+    lowered = file_name.lower()
+    if "case_study" in lowered:
+        tags.add("case-study-card")
+    if "rating_report" in lowered:
+        tags.add("rating-report")
+    if "SVA GRIHA" in text:
+        tags.add("sva-griha")
+    if "GRIHA EB" in text or "Existing Buildings" in text:
+        tags.add("griha-eb")
+    if "GRIHA" in text:
+        tags.add("griha")
+    # The rating badge, e.g. "GRIHA 3 STAR"; appliance ratings are written "5-star"
+    stars = re.search(r"\b([1-5]) STAR\b", text)
+    if stars:
+        tags.add(f"{stars.group(1)}-star")
+    return sorted(tags)
+
+
+def chunk_index(meta: Dict) -> int:
+    """Position of a chunk within its document, from the '<stem>_<n>' chunk ID"""
+    return meta.get("chunk_index", int(meta["chunk_id"].rsplit("_", 1)[1]))
+
+
+class Restriction(NamedTuple):
+    ids: np.ndarray
+    selector: faiss.IDSelector
+    allowed: set
+
+
+_converter = None
+
+
+def to_markdown(path: Path) -> str:
+    # MarkItDown takes most of a second to import and is only needed when a file changed
+    global _converter
+    if _converter is None:
+        from markitdown import MarkItDown
+        _converter = MarkItDown()
+    return _converter.convert(str(path)).text_content
+
+
+def iter_text(path: Path) -> Tuple[int, Iterator[str]]:
+    """A document's text as (number of pieces, pieces).
+
+    Long PDFs are read page by page with pdfminer, so neither the whole text
+    nor the whole layout is ever in memory; anything else is converted by
+    MarkItDown in one piece, which keeps its table extraction for short PDFs.
+    """
+    if path.suffix.lower() == ".pdf":
+        from pdfminer.pdfpage import PDFPage
+        with open(path, "rb") as f:
+            pages = sum(1 for _ in PDFPage.get_pages(f))
+        if pages >= STREAM_MIN_PAGES:
+            return pages, _pdf_pages(path)
+    return 1, iter([to_markdown(path)])
+
+
+def _pdf_pages(path: Path) -> Iterator[str]:
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LAParams, LTTextContainer
+
+    def texts(element):
+        # Text boxes can sit inside figures and other containers, not only at the top of the page
+        if isinstance(element, LTTextContainer):
+            yield element.get_text()
+        elif hasattr(element, "__iter__"):
+            for child in element:
+                yield from texts(child)
+
+    # all_texts lays out the text inside figures too, as MarkItDown's extract_text does for whole pages
+    for page in extract_pages(path, laparams=LAParams(all_texts=True)):
+        yield "".join(texts(page))
+
+
+def format_hit(hit: Dict) -> str:
+    """A hit's passage, or its whole chunk, with its source; passages list their character offsets in the chunk"""
+    snippet = hit.get("snippet")
+    if snippet is None:
+        return f"{hit['chunk']}\n[Source: {hit['doc']}, ID: {hit['chunk_id']}]"
+    offsets = ", ".join(f"{start}-{end}" for start, end in snippet["offsets"])
+    return f"{snippet['text']}\n[Source: {hit['doc']}, ID: {hit['chunk_id']}, chars {offsets}]"
+
+
+# --- manifest ---
+
+# Used when an index directory has neither a manifest nor a single-directory index.
+# A document goes to the first shard with a matching file name pattern.
+DEFAULT_SHARDS = [
+    {"name": "rating-reports", "path": "shards/rating-reports", "patterns": ["*Rating_Report*"]},
+    {"name": "case-study-cards", "path": "shards/case-study-cards", "patterns": ["*case_study*"]},
+    {"name": "projects", "path": "shards/projects", "patterns": ["*"]},
+]
+
+
+def read_manifest(index_dir: Path = INDEX_DIR) -> Dict:
+    """The manifest of an index directory: {"version": n, "shards": [...]}.
+
+    Each build that changes a shard writes it to a new version directory and
+    then replaces the manifest, so a manifest only ever names complete shards.
+    A directory built before sharding (index.bin at the top level) is read as
+    one shard named "default".
+    """
+    index_dir = Path(index_dir)
+    manifest_file = index_dir / "manifest.json"
+    if manifest_file.exists():
+        manifest = json.loads(manifest_file.read_text())
+        return {"version": manifest.get("version", 0), "shards": manifest["shards"]}
+    if (index_dir / "index.bin").exists():
+        return {"version": 0, "shards": [{"name": "default", "path": ".", "patterns": ["*"]}]}
+    return {"version": 0, "shards": [dict(shard) for shard in DEFAULT_SHARDS]}
+
+
+def load_manifest(index_dir: Path = INDEX_DIR) -> List[Dict]:
+    """Shard definitions for an index directory"""
+    return read_manifest(index_dir)["shards"]
+
+
+def assign_shard(file_name: str, shards: List[Dict]) -> Optional[str]:
+    for shard in shards:
+        if any(fnmatch.fnmatch(file_name, pattern) for pattern in shard["patterns"]):
+            return shard["name"]
+    return None
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    # Readers in other threads or processes never see a half-written file
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+SHARD_FILES = ("index.bin", "metadata.json", "bm25.json", "doc_index_cache.json")
+
+
+def _retire(index_dir: Path, path: str) -> None:
+    """Delete a shard version no manifest names any more"""
+    shard_dir = index_dir / path
+    if re.fullmatch(r"v\d+", shard_dir.name):
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        return
+    # Written in place before versioning; only the index files belong to the shard
+    for name in SHARD_FILES:
+        (shard_dir / name).unlink(missing_ok=True)
+
+
+# --- indexing ---
+
+# Background indexing, uploads and a search that finds a shard missing may all build; one at a time.
+# The lock file extends this to the API and MCP server processes sharing an index directory
+_build_lock = threading.Lock()
+
+
+@contextmanager
+def _building(index_dir: Path):
+    with _build_lock, open(index_dir / ".build.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def file_hash(path: Path) -> str:
+    return hashlib.md5(Path(path).read_bytes()).hexdigest()
+
+
+def embed_document(writer: "ShardWriter", path: Path, file_name: Optional[str] = None,
+                   extra_tags: Iterable[str] = (), chunking: Optional[Dict[str, int]] = None,
+                   progress: Optional[Callable[[float], None]] = None) -> int:
+    """Stream one document's chunks through batched embedding into writer; returns the chunk count.
+
+    Only the current page, one chunk of words and one EMBED_BATCH batch are
+    held besides the rows already added. Tags are known once the whole
+    document has been read, so they are filled in on its rows at the end.
+    progress is called with the fraction of the document read.
+    """
+    file_name = file_name or Path(path).name
+    stem = Path(file_name).stem
+    total, pieces = iter_text(Path(path))
+    first_row = writer.rows
+    tags: set = set()
+    read = 0
+    batch: List[str] = []
+
+    def observed():
+        nonlocal read
+        for piece in pieces:
+            piece_tags = infer_tags(file_name, piece)
+            if any(tag.endswith("-star") for tag in tags):
+                # The first rating badge in the document wins, as when tagging the whole text
+                piece_tags = [tag for tag in piece_tags if not tag.endswith("-star")]
+            tags.update(piece_tags)
+            read += 1
+            yield piece
+
+    def flush():
+        start = writer.rows - first_row
+        writer.add(get_embeddings(batch), [
+            {"doc": file_name, "chunk": chunk, "chunk_id": f"{stem}_{start + i}", "chunk_index": start + i,
+             "sentences": sentence_spans(chunk)}
+            for i, chunk in enumerate(batch)
+        ])
+        batch.clear()
+        if progress:
+            progress(read / total)
+
+    chunking = chunking or {"size": CHUNK_SIZE, "overlap": CHUNK_OVERLAP}
+    for chunk in chunk_stream(observed(), chunking["size"], chunking["overlap"]):
+        batch.append(chunk)
+        if len(batch) == EMBED_BATCH:
+            flush()
+    if batch:
+        flush()
+    writer.set_tags(first_row, sorted(tags | set(extra_tags)))
+    return writer.rows - first_row
+
+
+class ShardWriter:
+    """Collects one shard version's rows, adding vectors to its FAISS index batch by batch.
+
+    Row metadata, chunk text included, is spooled to a temporary file as it
+    arrives and streamed from there into metadata.json and the BM25 index, so
+    only row offsets stay in memory. sq8 indexes need training data, so their
+    first SQ8_TRAIN_ROWS vectors are buffered until the quantizer is trained.
+    """
+
+    def __init__(self, codec: str):
+        self.codec = codec
+        self.index: Optional[faiss.Index] = None
+        self._spool = tempfile.TemporaryFile()
+        self._offsets: List[int] = []
+        # (first row, end row, tags) of each document whose tags were only known once it was read
+        self._tags: List[Tuple[int, int, List[str]]] = []
+        self._untrained: List[np.ndarray] = []
+
+    @property
+    def rows(self) -> int:
+        return len(self._offsets)
+
+    def add(self, vectors: np.ndarray, metadata: List[Dict]) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.index is None:
+            self.index = new_index(vectors.shape[1], self.codec)
+        self._spool.seek(0, os.SEEK_END)
+        for meta in metadata:
+            self._offsets.append(self._spool.tell())
+            self._spool.write(json.dumps(meta).encode() + b"\n")
+        if self.index.is_trained:
+            self.index.add(vectors)
+            return
+        self._untrained.append(vectors)
+        if sum(len(v) for v in self._untrained) >= SQ8_TRAIN_ROWS:
+            self._train()
+
+    def set_tags(self, first_row: int, tags: List[str]) -> None:
+        """Tag the rows added since first_row, i.e. those of the document just read"""
+        self._tags.append((first_row, self.rows, tags))
+
+    def _train(self) -> None:
+        buffered = np.concatenate(self._untrained)
+        self._untrained = []
+        self.index.train(buffered)
+        self.index.add(buffered)
+
+    def copy_rows(self, index: faiss.Index, metadata: List[Dict], docs: set) -> None:
+        """Add the rows of docs from an existing shard, reading vectors back run by run"""
+        keep = [i for i, meta in enumerate(metadata) if meta["doc"] in docs]
+        # Consecutive kept rows form runs that are reconstructed without touching the dropped rows
+        for _, run in groupby(enumerate(keep), key=lambda item: item[1] - item[0]):
+            rows = [row for _, row in run]
+            for start in range(0, len(rows), COPY_BATCH):
+                block = rows[start:start + COPY_BATCH]
+                self.add(index.reconstruct_n(block[0], len(block)), [metadata[row] for row in block])
+
+    def rollback(self, rows: int) -> None:
+        """Drop every row added after the first `rows`, e.g. those of a document that failed halfway"""
+        if rows < len(self._offsets):
+            self._spool.truncate(self._offsets[rows])
+            del self._offsets[rows:]
+        self._tags = [(first, min(end, rows), tags) for first, end, tags in self._tags if first < rows]
+        if self.index is None:
+            return
+        if self.index.ntotal > rows:
+            self.index.remove_ids(faiss.IDSelectorRange(rows, self.index.ntotal))
+            self._untrained = []
+        elif self._untrained:
+            kept = np.concatenate(self._untrained)[:rows - self.index.ntotal]
+            self._untrained = [kept] if len(kept) else []
+
+    def metadata(self) -> Iterator[Dict]:
+        """The spooled rows in order, with their documents' tags"""
+        tags = sorted(self._tags, key=lambda t: t[0])
+        self._spool.seek(0)
+        for row, line in enumerate(self._spool):
+            meta = json.loads(line)
+            while tags and tags[0][1] <= row:
+                tags.pop(0)
+            if tags and tags[0][0] <= row:
+                meta["tags"] = tags[0][2]
+            yield meta
+
+    def write(self, target_dir: Path, cache_meta: Dict[str, str]) -> None:
+        if self._untrained:
+            self._train()
+        target_dir.mkdir(parents=True, exist_ok=True)
+        (target_dir / "doc_index_cache.json").write_text(json.dumps(cache_meta, indent=2))
+        # Same layout as json.dumps(rows, indent=2), written a row at a time
+        with open(target_dir / "metadata.json", "w") as f:
+            f.write("[")
+            for row, meta in enumerate(self.metadata()):
+                f.write(("," if row else "") + "\n  " + json.dumps(meta, indent=2).replace("\n", "\n  "))
+            f.write("\n]" if self.rows else "]")
+        # Rebuilt from the full metadata so BM25 doc IDs always match FAISS row IDs
+        (target_dir / "bm25.json").write_text(json.dumps(BM25Index.build(m["chunk"] for m in self.metadata()).to_dict()))
+        if self.index is not None and self.index.ntotal:
+            write_index(self.index, target_dir / "index.bin")
+        self._spool.close()
+
+
+def _read_shard(shard_dir: Path) -> Tuple[Optional[faiss.Index], List[Dict], Dict[str, str]]:
+    index_file = shard_dir / "index.bin"
+    metadata_file = shard_dir / "metadata.json"
+    cache_file = shard_dir / "doc_index_cache.json"
+    index = read_index(index_file) if index_file.exists() else None
+    metadata = json.loads(metadata_file.read_text()) if metadata_file.exists() else []
+    cache_meta = json.loads(cache_file.read_text()) if cache_file.exists() else {}
+    return index, metadata, cache_meta
+
+
+def _build_shard(shard_dir: Path, target_dir: Path, files: List[Path], extra_tags: Dict[str, List[str]],
+                 codec: str, chunking: Dict[str, int], built_with: Dict[str, int]) -> bool:
+    """Write an up-to-date copy of a shard to target_dir; returns False when nothing changed.
+
+    Rows of unchanged files are kept (vectors are reconstructed from the
+    index, and re-encoded if the codec changed), rows of changed or deleted
+    files are dropped and re-embedded. Every file is re-chunked when the
+    chunking differs from built_with. shard_dir itself is never modified.
+    """
+    index, metadata, cache_meta = _read_shard(shard_dir)
+    if chunking != built_with:
+        log("index", f"Chunking changed from {built_with} to {chunking}; re-chunking every document")
+        cache_meta = {}
+    hashes = {file.name: file_hash(file) for file in files}
+    unchanged = {name for name, fhash in hashes.items() if cache_meta.get(name) == fhash}
+    for name in sorted(unchanged):
+        log("index", f"Skipping unchanged file: {name}")
+    same_codec = index is None or codec_of(index) == codec
+    if (unchanged == set(cache_meta) and unchanged == set(hashes) and (shard_dir / "metadata.json").exists()
+            and same_codec):
+        return False
+
+    writer = ShardWriter(codec)
+    if index is not None:
+        writer.copy_rows(index, metadata, unchanged)
+    cache_meta = {name: cache_meta[name] for name in unchanged}
+
+    for file in files:
+        if file.name in unchanged:
+            continue
+        log("index", f"Processing: {file.name}")
+        rows = writer.rows
+        try:
+            chunks = embed_document(writer, file, extra_tags=extra_tags.get(file.name, []), chunking=chunking)
+            log("index", f"Embedded {file.name}: {chunks} chunks")
+            cache_meta[file.name] = hashes[file.name]
+        except Exception as e:
+            writer.rollback(rows)
+            log("error", f"Failed to process {file.name}: {e}")
+
+    writer.write(target_dir, cache_meta)
+    return True
+
+
+def _stage(index_dir: Path, shard: Dict, version: int) -> Tuple[Path, Path]:
+    """Manifest path of a shard's next version and the empty directory to build it in"""
+    target = Path("shards") / shard["name"] / f"v{version}"
+    staging = index_dir / target.with_name(f".{target.name}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    return target, staging
+
+
+def _promote(index_dir: Path, shard: Dict, staging: Path, target: Path) -> Optional[str]:
+    """Move a built version into place and point the manifest entry at it; returns the version to retire"""
+    shutil.rmtree(index_dir / target, ignore_errors=True)
+    os.replace(staging, index_dir / target)
+    retired = shard.get("previous")
+    shard["previous"], shard["path"] = shard["path"], target.as_posix()
+    return retired
+
+
+def _write_manifest(index_dir: Path, version: int, shards: List[Dict], retired: List[str]) -> None:
+    _write_atomic(index_dir / "manifest.json", json.dumps({"version": version, "shards": shards}, indent=2))
+    for path in retired:
+        _retire(index_dir, path)
+
+
+@traced("index.process_documents")
+def process_documents(doc_dir: Path = DOC_PATH, index_dir: Path = INDEX_DIR,
+                      collections: Optional[List[str]] = None, codec: str = DOC_INDEX_CODEC):
+    """Process documents and create the FAISS and BM25 indexes, one set per shard.
+
+    Changed shards are built into new version directories
+    (shards/<name>/v<version>) and published together by replacing
+    manifest.json, so searches keep using the previous version until the
+    whole build is done and never see a partly written shard. The version
+    before that is kept for readers that have not switched yet; older ones
+    are deleted.
+
+    collections limits the rebuild to the named shards; the others are left
+    untouched. codec picks the vector storage. Returns the manifest version.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown vector codec {codec!r}, expected one of {CODECS}")
+    log("index", "Indexing documents with MarkItDown...")
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    with _building(index_dir):
+        return _publish(index_dir, Path(doc_dir), collections, codec)
+
+
+def _publish(index_dir: Path, doc_dir: Path, collections: Optional[List[str]], codec: str) -> int:
+    manifest = read_manifest(index_dir)
+    shards = manifest["shards"]
+    version = manifest["version"] + 1
+    chunking = chunking_params(index_dir)
+
+    tags_file = Path(doc_dir) / TAGS_FILE_NAME
+    extra_tags = json.loads(tags_file.read_text()) if tags_file.exists() else {}
+    files_by_shard: Dict[str, List[Path]] = defaultdict(list)
+    for file in sorted(Path(doc_dir).glob("*.*")):
+        if file.name == TAGS_FILE_NAME:
+            continue
+        shard_name = assign_shard(file.name, shards)
+        if shard_name is None:
+            log("index", f"No shard matches {file.name}; skipping")
+            continue
+        files_by_shard[shard_name].append(file)
+
+    published, retired = False, []
+    for shard in shards:
+        if collections and shard["name"] not in collections:
+            continue
+        target, staging = _stage(index_dir, shard, version)
+        with span("index.build_shard", shard=shard["name"]):
+            changed = _build_shard(index_dir / shard["path"], staging, files_by_shard[shard["name"]], extra_tags,
+                                   codec, chunking, shard_chunking(shard))
+        if not changed:
+            log("index", f"Shard {shard['name']}: up to date")
+            continue
+        retired.append(_promote(index_dir, shard, staging, target))
+        shard["chunking"] = chunking
+        published = True
+        log("index", f"Shard {shard['name']}: saved FAISS index, BM25 index and metadata as {target.as_posix()}")
+
+    if not published:
+        if not (index_dir / "manifest.json").exists():
+            _write_atomic(index_dir / "manifest.json", json.dumps(manifest, indent=2))
+        return manifest["version"]
+    _write_manifest(index_dir, version, shards, [path for path in retired if path])
+    return version
+
+
+@traced("index.ingest_document")
+def ingest_document(path: Path, file_name: Optional[str] = None, index_dir: Path = INDEX_DIR,
+                    codec: str = DOC_INDEX_CODEC, progress: Optional[Callable[[str, float], None]] = None) -> int:
+    """Add or replace one document in the live index; returns the published manifest version.
+
+    Only the document's own shard gets a new version, built from that shard's
+    current rows plus the new chunks; no other file is converted or hashed.
+    The shard's cache records the document's hash, so a later
+    process_documents run treats it as unchanged. file_name defaults to the
+    name of path, e.g. when the upload is staged under a temporary name.
+    progress is called with (stage, fraction done).
+    """
+    file_name = file_name or Path(path).name
+    report = progress or (lambda stage, done: None)
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    shards = load_manifest(index_dir)
+    shard_name = assign_shard(file_name, shards)
+    if shard_name is None:
+        raise ValueError(f"No collection accepts {file_name}")
+    # Chunked like the rest of its shard; a chunking change is applied by the next process_documents
+    chunking = shard_chunking(next(s for s in shards if s["name"] == shard_name))
+
+    report("embedding", 0.0)
+    # The new rows come first so the document is embedded before the shard is locked
+    writer = ShardWriter(codec)
+    chunks = embed_document(writer, Path(path), file_name, chunking=chunking,
+                            progress=lambda done: report("embedding", done))
+    if not chunks:
+        raise ValueError(f"No text could be extracted from {file_name}")
+    fhash = file_hash(path)
+
+    report("indexing", 0.0)
+    with _building(index_dir):
+        manifest = read_manifest(index_dir)
+        shard = next(s for s in manifest["shards"] if s["name"] == assign_shard(file_name, manifest["shards"]))
+        index, metadata, cache_meta = _read_shard(index_dir / shard["path"])
+        if index is not None:
+            writer.copy_rows(index, metadata, {meta["doc"] for meta in metadata} - {file_name})
+        cache_meta[file_name] = fhash
+        version = manifest["version"] + 1
+        target, staging = _stage(index_dir, shard, version)
+        writer.write(staging, cache_meta)
+        retired = _promote(index_dir, shard, staging, target)
+        _write_manifest(index_dir, version, manifest["shards"], [retired] if retired else [])
+    log("index", f"Ingested {file_name}: {chunks} chunks into {shard['name']} (version {version})")
+    report("done", 1.0)
+    return version
+
+
+def ensure_index_ready(index_dir: Path = INDEX_DIR):
+    index_dir = Path(index_dir)
+    missing = [s["name"] for s in load_manifest(index_dir) if not (index_dir / s["path"] / "metadata.json").exists()]
+    if missing:
+        log("index", f"Index not found for {missing} — running process_documents()...")
+        process_documents(index_dir=index_dir, collections=missing)
+
+
+# --- search ---
+
+class IndexShard:
+    """One collection's FAISS + BM25 indexes, loaded on first use and reloaded when its files change"""
+
+    def __init__(self, name: str, shard_dir: Path):
+        self.name = name
+        self.shard_dir = Path(shard_dir)
+        self.index: Optional[faiss.Index] = None
+        self.metadata: List[Dict] = []
+        self.bm25 = BM25Index()
+        self._phrases: Dict[int, str] = {}
+        self._sentences: Dict[int, List[List[int]]] = {}
+        self._ids_by_doc: Dict[str, List[int]] = defaultdict(list)
+        self._ids_by_tag: Dict[str, List[int]] = defaultdict(list)
+        self._restriction_cache: Dict[Tuple, Restriction] = {}
+        self._version: Optional[Tuple] = None
+        self._lock = threading.Lock()
+
+    def _files_version(self) -> Tuple:
+        return tuple(
+            (self.shard_dir / name).stat().st_mtime_ns if (self.shard_dir / name).exists() else None
+            for name in ("index.bin", "metadata.json")
+        )
+
+    def refresh(self) -> None:
+        with self._lock:
+            version = self._files_version()
+            if version == self._version or version[1] is None:
+                return
+            index_file = self.shard_dir / "index.bin"
+            index = read_index(index_file, mmap=DOC_INDEX_MMAP) if version[0] is not None else None
+            metadata = json.loads((self.shard_dir / "metadata.json").read_text())
+            if (index.ntotal if index is not None else 0) != len(metadata):
+                # Caught between a rebuild's file swaps; keep serving the previous version
+                return
+            bm25_file = self.shard_dir / "bm25.json"
+            bm25 = BM25Index.load(bm25_file) if bm25_file.exists() else None
+            if bm25 is None or len(bm25) != len(metadata):
+                log("index", f"BM25 index for shard {self.name} missing or stale — rebuilding from metadata")
+                bm25 = BM25Index.build(m["chunk"] for m in metadata)
+                _write_atomic(bm25_file, json.dumps(bm25.to_dict()))
+            self.index, self.metadata, self.bm25 = index, metadata, bm25
+            self._phrases = {}
+            self._sentences = {}
+            self._index_filters()
+            self._version = version
+
+    @property
+    def loaded(self) -> bool:
+        return self._version is not None
+
+    def _index_filters(self):
+        self._ids_by_doc.clear()
+        self._ids_by_tag.clear()
+        self._restriction_cache.clear()
+        for i, meta in enumerate(self.metadata):
+            self._ids_by_doc[meta["doc"]].append(i)
+            for tag in meta.get("tags", []):
+                self._ids_by_tag[tag].append(i)
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    def _candidate_ids(self, docs: Optional[List[str]], chunk_range: Optional[Tuple[int, int]],
+                       tags: Optional[List[str]]) -> Optional[np.ndarray]:
+        """Intersects the per-filter ID lists; None means no filtering."""
+        id_sets = []
+        if docs is not None:
+            id_sets.append({i for name in docs for i in self._ids_by_doc.get(name, [])})
+        if tags:
+            id_sets.append({i for tag in tags for i in self._ids_by_tag.get(tag, [])})
+        if chunk_range is not None:
+            start, end = chunk_range
+            base = set.intersection(*id_sets) if id_sets else range(len(self.metadata))
+            id_sets = [{i for i in base if start <= chunk_index(self.metadata[i]) <= end}]
+        if not id_sets:
+            return None
+        return np.array(sorted(set.intersection(*id_sets)), dtype=np.int64)
+
+    def restrict(self, docs: Optional[List[str]] = None, chunk_range: Optional[Tuple[int, int]] = None,
+                 tags: Optional[List[str]] = None) -> Optional[Restriction]:
+        key = (tuple(docs) if docs is not None else None, chunk_range, tuple(sorted(tags or [])))
+        if key not in self._restriction_cache:
+            ids = self._candidate_ids(docs, chunk_range, tags)
+            if ids is None:
+                return None
+            if len(ids) and ids[-1] - ids[0] + 1 == len(ids):
+                # A document's chunks are contiguous rows, and flat search only scans a range selector's rows
+                selector = faiss.IDSelectorRange(int(ids[0]), int(ids[-1]) + 1)
+            else:
+                selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+            # The batch selector points into ids, so both are cached together
+            self._restriction_cache[key] = Restriction(ids, selector, set(ids.tolist()))
+        return self._restriction_cache[key]
+
+    def phrase(self, row: int) -> str:
+        if row not in self._phrases:
+            self._phrases[row] = f" {' '.join(tokenize(self.metadata[row]['chunk']))} "
+        return self._phrases[row]
+
+    def sentences(self, row: int) -> List[List[int]]:
+        """Sentence offsets stored at index time; chunks indexed before they were stored are split here"""
+        spans = self.metadata[row].get("sentences")
+        if spans is None:
+            if row not in self._sentences:
+                self._sentences[row] = sentence_spans(self.metadata[row]["chunk"])
+            spans = self._sentences[row]
+        return spans
+
+    def snippet(self, row: int, query: str, max_words: int = SNIPPET_WORDS) -> Dict:
+        """The chunk's sentences that best cover the query's terms, up to max_words, in document order.
+
+        Sentences are weighted by the shard's BM25 IDF of the query terms they
+        contain; a term already covered by a chosen sentence counts for half.
+        With no term in any sentence (a purely semantic hit) the chunk's
+        opening sentences are used.
+        """
+        chunk = self.metadata[row]["chunk"]
+        sentences = [(start, end, set(tokenize(chunk[start:end])), len(chunk[start:end].split()))
+                     for start, end in self.sentences(row)]
+        weights = {term: self.bm25.idf(term) for term in set(tokenize(query))}
+        chosen: List[Tuple[int, int]] = []
+        words = 0
+        remaining = list(range(len(sentences)))
+        while remaining and words < max_words:
+            gains = [sum(weights.get(t, 0.0) for t in sentences[i][2]) for i in remaining]
+            best = max(range(len(remaining)), key=lambda j: (gains[j], -remaining[j]))
+            if gains[best] <= 0:
+                if chosen:
+                    break
+                best = 0
+            start, end, terms, count = sentences[remaining.pop(best)]
+            if words + count > max_words:
+                # Cut to the words that still fit
+                end = start + len(" ".join(chunk[start:end].split()[:max_words - words]))
+                count = max_words - words
+            chosen.append((start, end))
+            words += count
+            for term in terms & weights.keys():
+                weights[term] /= 2
+        chosen.sort()
+        return {"text": " … ".join(chunk[start:end] for start, end in chosen),
+                "offsets": [[start, end] for start, end in chosen]}
+
+    def lexical(self, queries: List[str], depth: int, restriction: Optional[Restriction]) -> List[List[tuple]]:
+        allowed = restriction.allowed if restriction else None
+        return [self.bm25.search(query, top_k=depth, allowed=allowed) for query in queries]
+
+    def vector(self, query_vecs: np.ndarray, depth: int, restriction: Optional[Restriction]) -> List[List[tuple]]:
+        """(row, distance) per query from one matrix search"""
+        if restriction is None:
+            D, I = self.index.search(query_vecs, k=min(depth, self.index.ntotal))
+        else:
+            D, I = self.index.search(query_vecs, k=min(depth, len(restriction.ids)),
+                                     params=faiss.SearchParameters(sel=restriction.selector))
+        return [[(int(i), float(d)) for d, i in zip(D[row], I[row]) if i != -1] for row in range(len(query_vecs))]
+
+
+def fuse(route: str, lexical: List[tuple], vector: List[tuple], top_k: int) -> List[tuple]:
+    """Final (key, score) ranking for a route from the lexical (score) and vector (distance) rankings"""
+    if route == "lexical":
+        return lexical[:top_k]
+    if route == "vector":
+        return [(key, -d) for key, d in vector[:top_k]]
+    fused: Dict = {}
+    for ranking in (lexical, vector):
+        for rank, (key, _) in enumerate(ranking):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+_search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="doc-shard")
+
+
+class IndexState(NamedTuple):
+    """One published manifest and its shards; replaced as a whole when a new version is loaded"""
+    file_version: Optional[int]
+    version: int
+    manifest: List[Dict]
+    shards: Dict[str, IndexShard]
+
+
+class DocumentIndex:
+    """Searches the shards listed in an index directory's manifest as one corpus.
+
+    Each shard is searched concurrently and the per-shard rankings are merged
+    k-way: vector distances are directly comparable, BM25 scores are compared
+    as-is even though each shard has its own IDF statistics.
+
+    When the manifest changes, one caller loads the new shard versions while
+    the others keep searching the current ones, then the state is swapped in a
+    single assignment.
+    """
+
+    def __init__(self, index_dir: Path = INDEX_DIR):
+        self.index_dir = Path(index_dir)
+        self._state: Optional[IndexState] = None
+        self._swap_lock = threading.Lock()
+
+    def _manifest_file_version(self) -> Optional[int]:
+        manifest_file = self.index_dir / "manifest.json"
+        return manifest_file.stat().st_mtime_ns if manifest_file.exists() else None
+
+    def _current(self) -> IndexState:
+        state = self._state
+        file_version = self._manifest_file_version()
+        if state is not None and file_version == state.file_version:
+            return state
+        if state is not None and not self._swap_lock.acquire(blocking=False):
+            # Another thread is loading the new version
+            return state
+        if state is None:
+            self._swap_lock.acquire()
+        try:
+            state = self._state
+            if state is None or self._manifest_file_version() != state.file_version:
+                state = self._load(state)
+                self._state = state
+            return state
+        finally:
+            self._swap_lock.release()
+
+    def _load(self, previous: Optional[IndexState]) -> IndexState:
+        ensure_index_ready(self.index_dir)
+        file_version = self._manifest_file_version()
+        manifest = read_manifest(self.index_dir)
+        shards = {}
+        for spec in manifest["shards"]:
+            shard_dir = self.index_dir / spec["path"]
+            current = previous.shards.get(spec["name"]) if previous else None
+            if current is not None and current.shard_dir == shard_dir:
+                shards[spec["name"]] = current
+                continue
+            shard = IndexShard(spec["name"], shard_dir)
+            if current is not None and current.loaded:
+                # Loaded before the swap so searches never wait on the new version's files
+                shard.refresh()
+                log("index", f"Shard {spec['name']}: switched to {spec['path']}")
+            shards[spec["name"]] = shard
+        return IndexState(file_version, manifest["version"], manifest["shards"], shards)
+
+    @property
+    def version(self) -> int:
+        """Manifest version of the shards being searched; bumped by every build that changes a shard"""
+        return self._current().version
+
+    @property
+    def collections(self) -> List[str]:
+        return [spec["name"] for spec in self._current().manifest]
+
+    def shards(self, collections: Optional[List[str]] = None) -> List[IndexShard]:
+        """The requested shards, created lazily; files are only read when a shard is first searched"""
+        state = self._current()
+        return [state.shards[spec["name"]] for spec in state.manifest
+                if not collections or spec["name"] in collections]
+
+    def refresh(self) -> None:
+        for shard in self.shards():
+            shard.refresh()
+
+    @property
+    def docs(self) -> List[str]:
+        self.refresh()
+        return [doc for shard in self.shards() for doc in shard._ids_by_doc]
+
+    @property
+    def tags(self) -> List[str]:
+        self.refresh()
+        return sorted({tag for shard in self.shards() for tag in shard._ids_by_tag})
+
+    def resolve_docs(self, doc: str, names: Optional[List[str]] = None) -> List[str]:
+        """Documents matching a file name or a loose building name, e.g. "New Maharashtra Sadan".
+
+        Each query word may match a file name word approximately, which absorbs
+        misspellings in file names; only the best-scoring documents are returned.
+        """
+        names = self.docs if names is None else names
+        if doc in names:
+            return [doc]
+        wanted = tokenize(doc.replace("_", " "))
+        if not wanted:
+            return []
+        scores: Dict[str, float] = {}
+        for name in names:
+            have = tokenize(Path(name).stem.replace("_", " "))
+            matched = sum(
+                1 for w in wanted
+                if any(w == h or SequenceMatcher(None, w, h).ratio() >= DOC_WORD_MATCH for h in have)
+            )
+            scores[name] = matched / len(wanted)
+        best = max(scores.values(), default=0.0)
+        if best < DOC_NAME_MATCH:
+            return []
+        return sorted(name for name, score in scores.items() if score == best)
+
+    def _fan_out(self, fn, shards: List[IndexShard]) -> List:
+        if len(shards) == 1:
+            return [fn(shards[0])]
+        # Each task runs in a copy of the caller's context so its spans nest under the caller's
+        futures = [_search_pool.submit(contextvars.copy_context().run, fn, shard) for shard in shards]
+        return [future.result() for future in futures]
+
+    def _route(self, query: str, lexical: List[tuple], by_name: Dict[str, IndexShard]) -> str:
+        """Pick 'lexical' for strong keyword hits, 'vector' when nothing matches lexically, else 'hybrid'"""
+        if not lexical:
+            return "vector"
+        (shard_name, row), top_score = lexical[0]
+        shard = by_name[shard_name]
+        if shard.bm25.coverage(query, row) < LEXICAL_MIN_COVERAGE:
+            return "hybrid"
+        runner_up = lexical[1][1] if len(lexical) > 1 else 0.0
+        terms = tokenize(query)
+        exact_phrase = len(terms) > 1 and f" {' '.join(terms)} " in shard.phrase(row)
+        if exact_phrase or top_score >= LEXICAL_MIN_MARGIN * runner_up:
+            return "lexical"
+        return "hybrid"
+
+    def _rank_all(self, queries: List[str], top_k: int, mode: str, doc: Optional[str],
+                  chunk_range: Optional[Tuple[int, int]], tags: Optional[List[str]],
+                  collections: Optional[List[str]]) -> Tuple[List[str], List[List[tuple]], Dict[str, IndexShard]]:
+        """Routes and final ((shard, row), score) rankings for every query"""
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}")
+        shards = self.shards(collections)
+        for shard in shards:
+            shard.refresh()
+        docs = self.resolve_docs(doc, [name for shard in shards for name in shard._ids_by_doc]) if doc else None
+        chunk_range = tuple(chunk_range) if chunk_range is not None else None
+        depth = max(top_k, FUSION_DEPTH)
+
+        # BM25 scoring holds the GIL, so only the FAISS stage below is fanned out to threads
+        searchable = []
+        for shard in shards:
+            restriction = shard.restrict(docs, chunk_range, tags)
+            if shard.index is None or (restriction is not None and not len(restriction.ids)):
+                continue
+            searchable.append((shard, restriction, shard.lexical(queries, depth, restriction)))
+        by_name = {shard.name: shard for shard, _, _ in searchable}
+        annotate(shards=len(searchable), candidates=sum(
+            len(restriction.ids) if restriction is not None else len(shard) for shard, restriction, _ in searchable
+        ))
+        if not searchable:
+            return ["lexical" if mode == "auto" else mode] * len(queries), [[] for _ in queries], by_name
+
+        def merged(per_shard: List[Tuple[str, List[tuple]]], key) -> List[tuple]:
+            streams = [[((name, row), value) for row, value in ranking] for name, ranking in per_shard]
+            return list(islice(heapq.merge(*streams, key=key), depth))
+
+        lexical = [
+            merged([(shard.name, rankings[qi]) for shard, _, rankings in searchable], key=lambda item: -item[1])
+            for qi in range(len(queries))
+        ]
+        routes = [self._route(q, lexical[qi], by_name) if mode == "auto" else mode for qi, q in enumerate(queries)]
+
+        vector: Dict[int, List[tuple]] = {}
+        embedded = [qi for qi, route in enumerate(routes) if route != "lexical"]
+        if embedded:
+            # One embedding request for every query, then one matrix search per shard
+            query_vecs = get_embeddings([queries[qi] for qi in embedded])
+
+            def vector_stage(item):
+                shard, restriction, _ = item
+                with span("doc_index.shard_vector", shard=shard.name):
+                    return shard.name, shard.vector(query_vecs, depth, restriction)
+
+            results = self._fan_out(vector_stage, searchable)
+            for row, qi in enumerate(embedded):
+                vector[qi] = merged([(name, rankings[row]) for name, rankings in results], key=lambda item: item[1])
+
+        ranked = [fuse(routes[qi], lexical[qi], vector.get(qi, []), top_k) for qi in range(len(queries))]
+        annotate(embedded=len(embedded))
+        return routes, ranked, by_name
+
+    def search(self, query: str, top_k: int = 5, mode: str = "auto", doc: Optional[str] = None,
+               chunk_range: Optional[Tuple[int, int]] = None, tags: Optional[List[str]] = None,
+               collections: Optional[List[str]] = None, snippet_words: int = 0) -> List[Dict]:
+        """Return the top chunks as metadata dicts with 'score', 'route' and 'shard' added.
+
+        doc, chunk_range (inclusive chunk numbers within each document) and tags
+        restrict the search; FAISS and BM25 then only score the matching chunks.
+        collections limits the search to the named shards. With snippet_words,
+        each hit also carries a 'snippet' of its most query-relevant sentences
+        (see IndexShard.snippet).
+        """
+        routes, ranked, by_name = self._rank_all([query], top_k, mode, doc, chunk_range, tags, collections)
+        annotate(route=routes[0])
+        hits = []
+        for (name, row), score in ranked[0]:
+            hit = {**by_name[name].metadata[row], "score": round(score, 6), "route": routes[0], "shard": name}
+            if snippet_words:
+                hit["snippet"] = by_name[name].snippet(row, query, snippet_words)
+            hits.append(hit)
+        return hits
+
+    def search_batch(self, queries: List[str], top_k: int = 5, mode: str = "auto", doc: Optional[str] = None,
+                     chunk_range: Optional[Tuple[int, int]] = None, tags: Optional[List[str]] = None,
+                     collections: Optional[List[str]] = None, snippet_words: int = 0) -> List[Dict]:
+        """Search several queries with a single embedding request and one FAISS search per shard.
+
+        Chunks hit by more than one query are returned once, listing every
+        matching query index under 'queries'; hits are ordered by their best rank.
+        Filters and snippet_words apply to every query, as in search(); a
+        snippet covers all of its hit's matching queries.
+        """
+        routes, ranked, by_name = self._rank_all(queries, top_k, mode, doc, chunk_range, tags, collections)
+        merged: Dict[tuple, Dict] = {}
+        for qi, ranking in enumerate(ranked):
+            for rank, ((name, row), score) in enumerate(ranking):
+                hit = merged.get((name, row))
+                if hit is None:
+                    merged[(name, row)] = {**by_name[name].metadata[row], "score": round(score, 6),
+                                           "route": routes[qi], "shard": name, "rank": rank, "queries": [qi]}
+                    continue
+                hit["queries"].append(qi)
+                if rank < hit["rank"]:
+                    hit.update(score=round(score, 6), route=routes[qi], rank=rank)
+
+        if snippet_words:
+            for (name, row), hit in merged.items():
+                hit["snippet"] = by_name[name].snippet(row, " ".join(queries[qi] for qi in hit["queries"]),
+                                                       snippet_words)
+        annotate(queries=len(queries), results=len(merged))
+        return sorted(merged.values(), key=lambda hit: (hit["rank"], hit["queries"][0]))
+
+
+_indexes: Dict[Path, DocumentIndex] = {}
+# Tools search from worker threads, so the first concurrent calls must not each load the index
+_indexes_lock = threading.Lock()
+
+
+def get_index(index_dir: Path = INDEX_DIR) -> DocumentIndex:
+    """One shared DocumentIndex per directory so the server loads the files once"""
+    index_dir = Path(index_dir).resolve()
+    with _indexes_lock:
+        if index_dir not in _indexes:
+            _indexes[index_dir] = DocumentIndex(index_dir)
+        return _indexes[index_dir]
@@ -0,0 +1,110 @@
+# doc_ingest.py
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from doc_index import DOC_PATH, INDEX_DIR, TAGS_FILE_NAME, ingest_document, log
+
+DOC_UPLOAD_MAX_BYTES = int(os.getenv("DOC_UPLOAD_MAX_MB", "50")) * 2**20
+# Finished jobs kept for status polling
+MAX_JOBS = 200
+
+# Share of the overall progress taken by each ingestion stage
+STAGE_SPANS = {"queued": (0.0, 0.0), "embedding": (0.0, 0.9), "indexing": (0.9, 1.0), "done": (1.0, 1.0)}
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+_jobs: "OrderedDict[str, Dict]" = OrderedDict()
+_jobs_lock = threading.Lock()
+# Uploads are indexed one at a time; each publishes its own index version
+_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="doc-ingest")
+
+
+def safe_name(file_name: str) -> str:
+    """The bare file name an upload is stored under; rejects paths, hidden files and tags.json"""
+    name = Path(file_name or "").name
+    if not name or name.startswith(".") or "." not in name or name == TAGS_FILE_NAME:
+        raise ValueError(f"Invalid document name {file_name!r}")
+    return name
+
+
+def stage_upload(file_name: str, chunks: Iterable[bytes], doc_dir: Path = DOC_PATH) -> Path:
+    """Write an upload next to the documents under a hidden name the watcher ignores.
+
+    The extension is kept so MarkItDown picks the right converter.
+    """
+    name = safe_name(file_name)
+    doc_dir = Path(doc_dir)
+    doc_dir.mkdir(parents=True, exist_ok=True)
+    staged = doc_dir / f".upload-{uuid.uuid4().hex[:8]}-{name}"
+    size = 0
+    try:
+        with open(staged, "wb") as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > DOC_UPLOAD_MAX_BYTES:
+                    raise UploadTooLarge(f"{name} is larger than {DOC_UPLOAD_MAX_BYTES // 2**20} MB")
+                f.write(chunk)
+    except BaseException:
+        staged.unlink(missing_ok=True)
+        raise
+    if size == 0:
+        staged.unlink()
+        raise ValueError(f"{name} is empty")
+    return staged
+
+
+def _new_job(file_name: str) -> Dict:
+    return {"job_id": str(uuid.uuid4()), "document": safe_name(file_name), "status": "queued", "stage": "queued",
+            "progress": 0.0, "version": None, "error": None, "submitted_at": time.time(), "seconds": None}
+
+
+def submit(staged: Path, file_name: str, doc_dir: Path = DOC_PATH, index_dir: Path = INDEX_DIR) -> str:
+    """Queue a staged upload for indexing; returns the job ID"""
+    job = _new_job(file_name)
+    with _jobs_lock:
+        _jobs[job["job_id"]] = job
+        while len(_jobs) > MAX_JOBS:
+            _jobs.popitem(last=False)
+    _pool.submit(_run, job, Path(staged), Path(doc_dir), Path(index_dir))
+    return job["job_id"]
+
+
+def ingest_now(staged: Path, file_name: str, doc_dir: Path = DOC_PATH, index_dir: Path = INDEX_DIR) -> Dict:
+    """Index a staged upload on the calling thread, for callers that may not outlive a queued job"""
+    job = _new_job(file_name)
+    _run(job, Path(staged), Path(doc_dir), Path(index_dir))
+    return job
+
+
+def job_status(job_id: str) -> Optional[Dict]:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def _run(job: Dict, staged: Path, doc_dir: Path, index_dir: Path) -> None:
+    def progress(stage: str, done: float):
+        low, high = STAGE_SPANS[stage]
+        job.update(stage=stage, progress=round(low + (high - low) * done, 3))
+
+    job["status"] = "running"
+    try:
+        version = ingest_document(staged, job["document"], index_dir=index_dir, progress=progress)
+        # Moved in after the index is published; its hash is already cached, so a rescan skips it
+        os.replace(staged, doc_dir / job["document"])
+        job.update(status="done", version=version)
+    except Exception as e:
+        log("error", f"Ingesting {job['document']} failed: {e}")
+        staged.unlink(missing_ok=True)
+        job.update(status="error", error=str(e))
+    job["seconds"] = round(time.time() - job["submitted_at"], 3)
@@ -0,0 +1,108 @@
+# doc_watcher.py
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Set
+
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+
+from doc_index import (DOC_PATH, INDEX_DIR, TAGS_FILE_NAME, assign_shard, file_hash, get_index, load_manifest, log,
+                       process_documents)
+
+# Changes are collected until the folder has been quiet this long, so a file being
+# copied in is indexed once, after its last write
+DOC_WATCH_DEBOUNCE_S = float(os.getenv("DOC_WATCH_DEBOUNCE_S", "2.0"))
+
+IGNORED_SUFFIXES = (".tmp", ".part", ".crdownload", ".swp")
+IGNORED_EVENTS = ("opened", "closed_no_write")
+
+
+class DocumentWatcher(FileSystemEventHandler):
+    """Re-indexes the collections whose documents were added, changed or removed.
+
+    Files whose content is already indexed, such as uploads moved in after
+    ingest_document published them, are skipped. Builds run on a timer thread
+    through process_documents, which publishes a new index version only once
+    every changed shard is written; the shared DocumentIndex then loads the
+    new version before searches switch to it.
+    """
+
+    def __init__(self, doc_dir: Path = DOC_PATH, index_dir: Path = INDEX_DIR,
+                 debounce_s: float = DOC_WATCH_DEBOUNCE_S):
+        self.doc_dir = Path(doc_dir).resolve()
+        self.index_dir = Path(index_dir)
+        self.debounce_s = debounce_s
+        self._pending: Set[Path] = set()
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self._observer: Optional[Observer] = None
+
+    def _watched(self, path: str) -> bool:
+        path = Path(path)
+        return (path.parent.resolve() == self.doc_dir and not path.name.startswith(".") and "." in path.name
+                and not path.name.endswith(IGNORED_SUFFIXES))
+
+    def _collections_for(self, path: Path, shards) -> Set[str]:
+        if path.name == TAGS_FILE_NAME:
+            return {shard["name"] for shard in shards}
+        shard = assign_shard(path.name, shards)
+        if shard is None:
+            return set()
+        if path.exists():
+            cache_file = self.index_dir / next(s["path"] for s in shards if s["name"] == shard) / "doc_index_cache.json"
+            cached = json.loads(cache_file.read_text()) if cache_file.exists() else {}
+            if cached.get(path.name) == file_hash(path):
+                return set()
+        return {shard}
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        if event.is_directory or event.event_type in IGNORED_EVENTS:
+            return
+        paths = {Path(p) for p in (event.src_path, getattr(event, "dest_path", "")) if p and self._watched(p)}
+        if not paths:
+            return
+        with self._lock:
+            self._pending |= paths
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce_s, self._ingest)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _ingest(self) -> None:
+        with self._lock:
+            paths, self._pending, self._timer = self._pending, set(), None
+        try:
+            shards = load_manifest(self.index_dir)
+            collections = sorted(set().union(*(self._collections_for(path, shards) for path in paths)))
+            if not collections:
+                return
+            log("watch", f"Documents changed in {collections}; indexing")
+            version = process_documents(self.doc_dir, self.index_dir, collections=collections)
+            # Loads the new shard versions here rather than in the next search
+            get_index(self.index_dir).shards()
+            log("watch", f"Index version {version} is live")
+        except Exception as e:
+            log("error", f"Indexing after document change failed: {e}")
+
+    def start(self) -> "DocumentWatcher":
+        self.doc_dir.mkdir(parents=True, exist_ok=True)
+        self._observer = Observer()
+        self._observer.schedule(self, str(self.doc_dir), recursive=False)
+        self._observer.daemon = True
+        self._observer.start()
+        log("watch", f"Watching {self.doc_dir}")
+        return self
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
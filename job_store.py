@@ -0,0 +1,182 @@
+# job_store.py
+
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from agent_queue import DEFAULT_RUN_SECONDS, QueueFull
+
+ROOT = Path(__file__).parent.resolve()
+
+# Agent jobs and session state shared by the API and worker processes
+JOB_STORE_PATH = Path(os.getenv("JOB_STORE_PATH", ROOT / "job_store" / "jobs.sqlite"))
+# A running job whose worker has not saved its session for this long is failed
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "120"))
+# Finished runs averaged for the Retry-After estimate
+RUN_TIME_WINDOW = 20
+
+
+class JobStore:
+    """Agent jobs and session state in SQLite, shared by every API and worker process.
+
+    enqueue() adds a queued job and its session, refusing with QueueFull once
+    max_queued jobs are waiting; claim() hands the oldest queued job to a
+    worker. Both take SQLite's write lock (BEGIN IMMEDIATE), so a job is
+    claimed exactly once however many processes poll. Workers save a
+    session's state as they run it, which doubles as a heartbeat: a running
+    job not saved for JOB_LEASE_S is failed on the next claim.
+    """
+
+    def __init__(self, path: Path = JOB_STORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL UNIQUE,
+                query TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                enqueued_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self._lock = threading.Lock()
+
+    def _write(self, statements):
+        """Runs statements(db) in one write transaction and returns its result"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self._db)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    def enqueue(self, session_id: str, query: str, user_id: str, state: Dict[str, Any], max_queued: int) -> int:
+        """Queues a job with its initial session state; returns its position"""
+        def statements(db):
+            queued = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= max_queued:
+                return None
+            now = time.time()
+            db.execute("INSERT INTO jobs (session_id, query, user_id, status, enqueued_at) VALUES (?, ?, ?, 'queued', ?)",
+                       (session_id, query, user_id, now))
+            db.execute("INSERT OR REPLACE INTO sessions (id, state, updated_at) VALUES (?, ?, ?)",
+                       (session_id, json.dumps(state, default=str), now))
+            return queued + 1
+
+        position = self._write(statements)
+        if position is None:
+            raise QueueFull(self.retry_after())
+        return position
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Marks the oldest queued job as running for this worker and returns it"""
+        def statements(db):
+            now = time.time()
+            stale = db.execute(
+                "SELECT jobs.session_id FROM jobs JOIN sessions ON sessions.id = jobs.session_id "
+                "WHERE jobs.status = 'running' AND sessions.updated_at < ?", (now - JOB_LEASE_S,)
+            ).fetchall()
+            for (session_id,) in stale:
+                self._fail(db, session_id, "Agent worker stopped responding", now)
+            row = db.execute("SELECT id, session_id, query, user_id, enqueued_at FROM jobs "
+                             "WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET status = 'running', worker = ?, started_at = ? WHERE id = ?",
+                       (worker, now, row[0]))
+            db.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (now, row[1]))
+            return {"id": row[0], "session_id": row[1], "query": row[2], "user_id": row[3], "enqueued_at": row[4]}
+
+        return self._write(statements)
+
+    def _fail(self, db, session_id: str, error: str, now: float) -> None:
+        row = db.execute("SELECT state FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        state = json.loads(row[0]) if row else {}
+        state.update(status="error", error=error)
+        db.execute("UPDATE sessions SET state = ?, updated_at = ? WHERE id = ?", (json.dumps(state), now, session_id))
+        db.execute("UPDATE jobs SET status = 'done', finished_at = ? WHERE session_id = ?", (now, session_id))
+
+    def finish(self, session_id: str) -> None:
+        self._write(lambda db: db.execute("UPDATE jobs SET status = 'done', finished_at = ? WHERE session_id = ?",
+                                          (time.time(), session_id)))
+
+    def save_session(self, session_id: str, state: Dict[str, Any]) -> None:
+        self._write(lambda db: db.execute("INSERT OR REPLACE INTO sessions (id, state, updated_at) VALUES (?, ?, ?)",
+                                          (session_id, json.dumps(state, default=str), time.time())))
+
+    def load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT state FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def schemes(self) -> List[Dict[str, Any]]:
+        """Schemes of every stored session, tagged with it; answer-cache sessions only repeat earlier ones"""
+        with self._lock:
+            rows = self._db.execute("SELECT id, state FROM sessions ORDER BY updated_at").fetchall()
+        sessions = [(session_id, json.loads(state)) for session_id, state in rows]
+        return [{**scheme, "session_id": session_id} for session_id, state in sessions
+                if not state.get("answer_cache") for scheme in state.get("schemes") or []]
+
+    def clear_schemes(self) -> None:
+        """Empties every stored session's schemes; a running session's worker saves its own again"""
+        def statements(db):
+            for session_id, state in db.execute("SELECT id, state FROM sessions").fetchall():
+                state = json.loads(state)
+                if state.get("schemes"):
+                    state["schemes"] = []
+                    db.execute("UPDATE sessions SET state = ? WHERE id = ?", (json.dumps(state), session_id))
+
+        self._write(statements)
+
+    def position(self, session_id: str) -> Optional[int]:
+        """1-based place in line of a queued job, 0 once running, None when finished or unknown"""
+        with self._lock:
+            row = self._db.execute("SELECT id, status FROM jobs WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None or row[1] == "done":
+                return None
+            if row[1] == "running":
+                return 0
+            return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND id <= ?",
+                                    (row[0],)).fetchone()[0]
+
+    def counts(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            workers = self._db.execute("SELECT COUNT(DISTINCT worker) FROM jobs WHERE status = 'running'").fetchone()[0]
+        return {"running": rows.get("running", 0), "queued": rows.get("queued", 0), "completed": rows.get("done", 0),
+                "busy_workers": workers, "mean_run_s": self.mean_run_s()}
+
+    def mean_run_s(self) -> float:
+        with self._lock:
+            rows = self._db.execute("SELECT finished_at - started_at FROM jobs WHERE status = 'done' "
+                                    "AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?",
+                                    (RUN_TIME_WINDOW,)).fetchall()
+        return round(sum(r[0] for r in rows) / len(rows), 3) if rows else DEFAULT_RUN_SECONDS
+
+    def retry_after(self) -> int:
+        """Seconds until a running job should finish, going by the recent average run time"""
+        mean = self.mean_run_s()
+        with self._lock:
+            oldest = self._db.execute("SELECT MIN(started_at) FROM jobs WHERE status = 'running'").fetchone()[0]
+        soonest = oldest + mean - time.time() if oldest is not None else mean
+        return max(1, math.ceil(soonest))
@@ -2,38 +2,31 @@ from mcp.server.fastmcp import FastMCP, Image
 from mcp.server.fastmcp.prompts import base
 from mcp.types import TextContent
 from mcp import types
-from PIL import Image as PILImage
+import asyncio
+import functools
 import math
 import sys
 import os
 import json
-import faiss
-import numpy as np
 from pathlib import Path
-import requests
-from markitdown import MarkItDown
 import time
 from models import AddInput, AddOutput, SqrtInput, SqrtOutput, StringsToIntsInput, StringsToIntsOutput, ExpSumInput, ExpSumOutput
 from models import ( Search2050ProductsInput, Search2050ProductsOutput, ProductInfo,
     Get2050ProductDetailsInput, Get2050ProductDetailsOutput, MaterialFacts,
     AiFormSchemerInput, AiFormSchemerOutput )
-from PIL import Image as PILImage
-from tqdm import tqdm
-import hashlib
 from dotenv import load_dotenv
 import logging
 import traceback
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from datetime import datetime
+from tracing import traced, annotate
+# requests and doc_index (faiss, numpy, markitdown) are imported on first tool use, so
+# spawning the server - which every agent and API session does - stays fast
 
 load_dotenv()  # This loads the variables from .env
 
 mcp = FastMCP("Calculator")
 
-EMBED_URL = "http://localhost:11434/api/embeddings"
-EMBED_MODEL = "nomic-embed-text"
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 0
 ROOT = Path(__file__).parent.resolve()
 
 # Configure logging
@@ -47,9 +40,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger("mcp-server")
 
+def in_thread(func):
+    """Runs a blocking tool on a worker thread, so FastMCP serves a batch of calls concurrently
+    instead of one after another on its event loop"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
 # --- BEGIN 2050 Materials API Integration ---
-TOKEN_CACHE_FILE = ROOT / '2050_token_cache.json' # Store cache in server's directory
-BASE_API_URL = "https://app.2050-materials.com/"
+TOKEN_CACHE_FILE = Path(os.getenv("MATERIALS_2050_TOKEN_CACHE", ROOT / '2050_token_cache.json')) # Store cache in server's directory
+BASE_API_URL = os.getenv("MATERIALS_2050_API_URL", "https://app.2050-materials.com/")
 TOKEN_URL = f"{BASE_API_URL}developer/api/token/getapitoken/"
 # IMPORTANT: Ensure DEVELOPER_TOKEN is set as an environment variable where mcp-server.py runs
 DEVELOPER_TOKEN = os.getenv("DEVELOPER_TOKEN")
@@ -95,6 +96,7 @@ def get_2050_api_token():
     if cached_token:
         return cached_token
 
+    import requests
     headers = {'Authorization': f'Bearer {DEVELOPER_TOKEN}'}
     try:
         mcp_log("info", f"Requesting new 2050 API token from {TOKEN_URL}")
@@ -112,8 +114,11 @@ def get_2050_api_token():
         raise Exception("Invalid response format from 2050 token API.")
 
 @mcp.tool()
+@traced("tool.search_2050_products")
+@in_thread
 def search_2050_products(input: Search2050ProductsInput) -> Search2050ProductsOutput:
     """Search for products on the 2050 Materials platform by product name."""
+    import requests
     try:
         api_token = get_2050_api_token()
         headers = {
@@ -175,40 +180,85 @@ def parse_product_data(product_json: Dict[str, Any]) -> ProductInfo:
 
 # --- END 2050 Materials API Integration ---
 
-def get_embedding(text: str) -> np.ndarray:
-    response = requests.post(EMBED_URL, json={"model": EMBED_MODEL, "prompt": text})
-    response.raise_for_status()
-    return np.array(response.json()["embedding"], dtype=np.float32)
-
-def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    words = text.split()
-    for i in range(0, len(words), size - overlap):
-        yield " ".join(words[i:i+size])
-
 def mcp_log(level: str, message: str) -> None:
     """Log a message to stderr to avoid interfering with JSON communication"""
     sys.stderr.write(f"{level.upper()}: {message}\n")
     sys.stderr.flush()
 
+def _chunk_range(start: Optional[int], end: Optional[int]) -> Optional[tuple[int, int]]:
+    if start is None and end is None:
+        return None
+    return (start or 0, end if end is not None else sys.maxsize)
+
 @mcp.tool()
-def search_documents(query: str) -> list[str]:
-    """Search for relevant content from uploaded documents."""
-    ensure_faiss_ready()
-    mcp_log("SEARCH", f"Query: {query}")
+@traced("tool.search_documents")
+@in_thread
+def search_documents(query: str, doc: Optional[str] = None, tags: Optional[list[str]] = None,
+                     chunk_start: Optional[int] = None, chunk_end: Optional[int] = None,
+                     collections: Optional[list[str]] = None, full_chunks: bool = False) -> list[str]:
+    """Search for relevant content from uploaded documents. Optionally restrict to one document
+    (file name or building name, e.g. "New Maharashtra Sadan"), to tags such as "sva-griha",
+    "griha-eb", "case-study-card" or "4-star", to a range of chunk numbers within each document,
+    or to collections: "rating-reports", "case-study-cards", "projects".
+    Returns the most relevant sentences of each matching chunk; set full_chunks=True for whole chunks."""
+    mcp_log("SEARCH", f"Query: {query} (doc={doc}, tags={tags}, chunks={chunk_start}-{chunk_end})")
     try:
-        index = faiss.read_index(str(ROOT / "faiss_index" / "index.bin"))
-        metadata = json.loads((ROOT / "faiss_index" / "metadata.json").read_text())
-        query_vec = get_embedding(query).reshape(1, -1)
-        D, I = index.search(query_vec, k=5)
-        results = []
-        for idx in I[0]:
-            data = metadata[idx]
-            results.append(f"{data['chunk']}\n[Source: {data['doc']}, ID: {data['chunk_id']}]")
+        # Strong keyword hits (building names, GRIHA terms) skip the embedding call
+        from doc_index import SNIPPET_WORDS, get_index, format_hit
+        hits = get_index().search(query, top_k=5, doc=doc, tags=tags, collections=collections,
+                                  chunk_range=_chunk_range(chunk_start, chunk_end),
+                                  snippet_words=0 if full_chunks else SNIPPET_WORDS)
+        results = [format_hit(hit) for hit in hits]
+        annotate(results=len(results))
+        return results
+    except Exception as e:
+        return [f"ERROR: Failed to search: {str(e)}"]
+
+@mcp.tool()
+@traced("tool.search_documents_batch")
+@in_thread
+def search_documents_batch(queries: list[str], doc: Optional[str] = None,
+                           tags: Optional[list[str]] = None, full_chunks: bool = False) -> list[str]:
+    """Search documents for several queries at once. Chunks matching more than one query are returned once.
+    doc, tags and full_chunks apply to every query, as in search_documents."""
+    mcp_log("SEARCH", f"Batch of {len(queries)} queries: {queries} (doc={doc}, tags={tags})")
+    try:
+        from doc_index import SNIPPET_WORDS, get_index, format_hit
+        hits = get_index().search_batch(queries, top_k=5, doc=doc, tags=tags,
+                                        snippet_words=0 if full_chunks else SNIPPET_WORDS)
+        results = [
+            f"{format_hit(hit)}\n[Matched queries: {', '.join(queries[i] for i in hit['queries'])}]"
+            for hit in hits
+        ]
+        annotate(results=len(results))
         return results
     except Exception as e:
         return [f"ERROR: Failed to search: {str(e)}"]
 
 @mcp.tool()
+@traced("tool.upload_document")
+@in_thread
+def upload_document(file_name: str, content_base64: str) -> str:
+    """Add a document (file name with extension, base64-encoded contents) to the document search index.
+    Returns once the document is indexed and searchable, which can take a while for long documents."""
+    mcp_log("UPLOAD", f"Document: {file_name}")
+    try:
+        import base64
+        import doc_ingest
+        name = doc_ingest.safe_name(file_name)
+        staged = doc_ingest.stage_upload(name, [base64.b64decode(content_base64, validate=True)])
+        # Indexed within the call: this server lives only as long as the agent session, so a queued job
+        # would be lost with it
+        job = doc_ingest.ingest_now(staged, name)
+        annotate(seconds=job["seconds"])
+        if job["status"] != "done":
+            return f"ERROR: Failed to index {name}: {job['error']}"
+        return f"Indexed {name} as index version {job['version']} in {job['seconds']}s"
+    except Exception as e:
+        return f"ERROR: Failed to upload document: {str(e)}"
+
+@mcp.tool()
+@traced("tool.add")
 def add(input: AddInput) -> AddOutput:
     """Add two numbers"""
     print("CALLED: add(AddInput) -> AddOutput")
@@ -216,6 +266,7 @@ def add(input: AddInput) -> AddOutput:
 
 # subtraction tool
 @mcp.tool()
+@traced("tool.subtract")
 def subtract(a: int, b: int) -> int:
     """Subtract two numbers"""
     print("CALLED: subtract(a: int, b: int) -> int:")
@@ -223,6 +274,7 @@ def subtract(a: int, b: int) -> int:
 
 # multiplication tool
 @mcp.tool()
+@traced("tool.multiply")
 def multiply(a: float, b: float) -> float:
     """Multiply two numbers"""
     print("CALLED: multiply(a: float, b: float) -> float:")
@@ -230,6 +282,7 @@ def multiply(a: float, b: float) -> float:
 
 #  division tool
 @mcp.tool() 
+@traced("tool.divide")
 def divide(a: float, b: float) -> float:
     """Divide two numbers"""
     print("CALLED: divide(a: int, b: int) -> float:")
@@ -261,72 +314,9 @@ def debug_error(error: str) -> list[base.Message]:
         base.AssistantMessage("I'll help debug that. What have you tried so far?"),
     ]
 
-def process_documents():
-    """Process documents and create FAISS index"""
-    mcp_log("INFO", "Indexing documents with MarkItDown...")
-    ROOT = Path(__file__).parent.resolve()
-    DOC_PATH = ROOT / "documents"
-    INDEX_CACHE = ROOT / "faiss_index"
-    INDEX_CACHE.mkdir(exist_ok=True)
-    INDEX_FILE = INDEX_CACHE / "index.bin"
-    METADATA_FILE = INDEX_CACHE / "metadata.json"
-    CACHE_FILE = INDEX_CACHE / "doc_index_cache.json"
-
-    def file_hash(path):
-        return hashlib.md5(Path(path).read_bytes()).hexdigest()
-
-    CACHE_META = json.loads(CACHE_FILE.read_text()) if CACHE_FILE.exists() else {}
-    metadata = json.loads(METADATA_FILE.read_text()) if METADATA_FILE.exists() else []
-    index = faiss.read_index(str(INDEX_FILE)) if INDEX_FILE.exists() else None
-    all_embeddings = []
-    converter = MarkItDown()
-
-    for file in DOC_PATH.glob("*.*"):
-        fhash = file_hash(file)
-        if file.name in CACHE_META and CACHE_META[file.name] == fhash:
-            mcp_log("SKIP", f"Skipping unchanged file: {file.name}")
-            continue
-
-        mcp_log("PROC", f"Processing: {file.name}")
-        try:
-            result = converter.convert(str(file))
-            markdown = result.text_content
-            chunks = list(chunk_text(markdown))
-            embeddings_for_file = []
-            new_metadata = []
-            for i, chunk in enumerate(tqdm(chunks, desc=f"Embedding {file.name}")):
-                embedding = get_embedding(chunk)
-                embeddings_for_file.append(embedding)
-                new_metadata.append({"doc": file.name, "chunk": chunk, "chunk_id": f"{file.stem}_{i}"})
-            if embeddings_for_file:
-                if index is None:
-                    dim = len(embeddings_for_file[0])
-                    index = faiss.IndexFlatL2(dim)
-                index.add(np.stack(embeddings_for_file))
-                metadata.extend(new_metadata)
-            CACHE_META[file.name] = fhash
-        except Exception as e:
-            mcp_log("ERROR", f"Failed to process {file.name}: {e}")
-
-    CACHE_FILE.write_text(json.dumps(CACHE_META, indent=2))
-    METADATA_FILE.write_text(json.dumps(metadata, indent=2))
-    if index and index.ntotal > 0:
-        faiss.write_index(index, str(INDEX_FILE))
-        mcp_log("SUCCESS", "Saved FAISS index and metadata")
-    else:
-        mcp_log("WARN", "No new documents or updates to process.")
-
-def ensure_faiss_ready():
-    from pathlib import Path
-    index_path = ROOT / "faiss_index" / "index.bin"
-    meta_path = ROOT / "faiss_index" / "metadata.json"
-    if not (index_path.exists() and meta_path.exists()):
-        mcp_log("INFO", "Index not found — running process_documents()...")
-        process_documents()
-    else:
-        mcp_log("INFO", "Index already exists. Skipping regeneration.")
-
 @mcp.tool()
+@traced("tool.ai_form_schemer")
+@in_thread
 def ai_form_schemer(input: AiFormSchemerInput) -> AiFormSchemerOutput:
     """Use the structural surrogate model to evaluate a building's form."""
     try:
@@ -402,6 +392,7 @@ class ClientCredentials:
                 'scope': self.client['scope']
             }
             url = f"{self.host}/{self.authorize}"
+            import requests
             response = requests.post(url, data=data)
             response.raise_for_status()
             self.token = Token(response.json())
@@ -439,6 +430,7 @@ class StructuralSurrogateModel:
             "Authorization": f"Bearer {token.access_token}"
         }
 
+        import requests
         response = requests.post(api_url, headers=headers, json=request_data)
         response.raise_for_status()
         return response.json()
@@ -543,39 +535,45 @@ if __name__ == "__main__":
         except Exception as e:
             logger.error(f"Error running MCP server: {e}")
             logger.error(traceback.format_exc())
+    elif len(sys.argv) > 1 and sys.argv[1] == "index":
+        # Out-of-band indexing: python mcp-server.py index [collection ...]
+        from doc_index import process_documents
+        process_documents(collections=sys.argv[2:] or None)
     else:
-        # Start the server in a separate thread
+        # Serve immediately; with MCP_INDEX_MODE=background (default) new or changed documents
+        # are indexed on a worker thread shortly after startup, "sync" indexes before serving, "off" leaves it to
+        # `python mcp-server.py index`. Searches meanwhile use the last built index. Unless MCP_WATCH_DOCS=0,
+        # the documents folder is then watched and changes are indexed and swapped in while serving.
         import threading
-        logger.info("Starting server thread with stdio transport")
-        
-        def run_server():
+        index_mode = os.getenv("MCP_INDEX_MODE", "background")
+
+        def run_indexing():
             try:
-                mcp.run(transport="stdio")
-                logger.info("MCP server thread completed normally")
+                logger.info("Starting document processing")
+                from doc_index import process_documents
+                process_documents()
+                logger.info("Document processing completed")
             except Exception as e:
-                logger.error(f"Error in MCP server thread: {e}")
+                logger.error(f"Error processing documents: {e}")
                 logger.error(traceback.format_exc())
-        
-        server_thread = threading.Thread(target=run_server)
-        server_thread.daemon = True
-        server_thread.start()
-        
-        # Wait a moment for the server to start
-        time.sleep(2)
-        
-        # Process documents after server is running
+            if os.getenv("MCP_WATCH_DOCS", "1") != "0":
+                from doc_watcher import DocumentWatcher
+                DocumentWatcher().start()
+
+        if index_mode == "sync":
+            run_indexing()
+        elif index_mode == "background":
+            # Started after a short delay so its imports don't compete with the session handshake
+            indexer = threading.Timer(float(os.getenv("MCP_INDEX_DELAY_S", "1.0")), run_indexing)
+            indexer.daemon = True
+            indexer.start()
+
+        logger.info(f"Starting server with stdio transport (indexing: {index_mode})")
         try:
-            logger.info("Starting document processing")
-            process_documents()
-            logger.info("Document processing completed")
-        except Exception as e:
-            logger.error(f"Error processing documents: {e}")
-            logger.error(traceback.format_exc())
-        
-        # Keep the main thread alive
-        try:
-            logger.info("Main thread waiting...")
-            while True:
-                time.sleep(1)
+            mcp.run(transport="stdio")
+            logger.info("MCP server run completed normally")
         except KeyboardInterrupt:
             logger.info("Received keyboard interrupt, shutting down...")
+        except Exception as e:
+            logger.error(f"Error running MCP server: {e}")
+            logger.error(traceback.format_exc())
@@ -1,30 +1,418 @@
 # memory.py
 
+import os
+import json
+import sqlite3
+import threading
 import numpy as np
 import faiss
 import requests
-from typing import List, Optional, Literal
-from pydantic import BaseModel
-from datetime import datetime
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Literal, Tuple
+from pydantic import BaseModel, Field
+from datetime import datetime, timedelta
+from tracing import traced, annotate, span, set_session, current_session
+from vector_codecs import new_index
+
+ROOT = Path(__file__).parent.resolve()
+
+# Durable memory lives here unless MEMORY_STORE_DIR points elsewhere
+DEFAULT_STORE_DIR = Path(os.getenv("MEMORY_STORE_DIR", ROOT / "memory_store"))
+# Vectors are logged in SQLite and folded into the on-disk index every N adds
+CHECKPOINT_EVERY = int(os.getenv("MEMORY_CHECKPOINT_EVERY", "256"))
+# Eviction policy for old tool outputs, applied once per process on first use
+MAX_TOOL_OUTPUT_AGE_DAYS = float(os.getenv("MEMORY_MAX_TOOL_OUTPUT_AGE_DAYS", "30"))
+MAX_TOOL_OUTPUTS_PER_USER = int(os.getenv("MEMORY_MAX_TOOL_OUTPUTS_PER_USER", "2000"))
+# Vector storage for new memory indexes: "flat" (float32) or "fp16". Memory is appended to
+# one item at a time, so codecs that need training (sq8) and read-only mmap don't apply here
+MEMORY_INDEX_CODEC = os.getenv("MEMORY_INDEX_CODEC", "flat")
+MEMORY_CODECS = ("flat", "fp16")
 
 
 class MemoryItem(BaseModel):
     text: str
     type: Literal["preference", "tool_output", "fact", "query", "system", "form_schema"] = "fact"
-    timestamp: Optional[str] = datetime.now().isoformat()
+    timestamp: Optional[str] = Field(default_factory=lambda: datetime.now().isoformat())
     tool_name: Optional[str] = None
     user_query: Optional[str] = None
     tags: List[str] = []
     session_id: Optional[str] = None
+    user_id: Optional[str] = None
+
+
+class MemoryStore:
+    """Vectors in a FAISS index, items in SQLite, partitioned by user and session.
+
+    A store is shared by every MemoryManager in the process that points at the
+    same directory. Writes take SQLite's write lock (BEGIN IMMEDIATE), so
+    several processes can share a store: new vectors are logged in the
+    pending_vectors table and periodically checkpointed into a new index file,
+    and readers pick up other processes' writes before each search. With no
+    directory the store is purely in-memory.
+    """
+
+    _open_stores: Dict[str, "MemoryStore"] = {}
+    _open_lock = threading.Lock()
+
+    def __init__(self, store_dir: Optional[Path] = None, codec: str = MEMORY_INDEX_CODEC):
+        if codec not in MEMORY_CODECS:
+            raise ValueError(f"Unsupported memory vector codec {codec!r}, expected one of {MEMORY_CODECS}")
+        self.codec = codec
+        self.store_dir = Path(store_dir) if store_dir else None
+        self.persistent = self.store_dir is not None
+        if self.persistent:
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            db_path = str(self.store_dir / "memory.sqlite")
+        else:
+            db_path = ":memory:"
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._create_schema()
+        self._lock = threading.RLock()
+
+        self.index = None
+        self._loaded = False
+        self._generation = None
+        self._synced_id = 0
+        self._maintained = False
+        self._items: Dict[int, MemoryItem] = {}
+
+        # Vector IDs per filter value, so filtered searches only score matching vectors
+        self._ids_by_user: Dict[str, List[int]] = defaultdict(list)
+        self._ids_by_session: Dict[str, List[int]] = defaultdict(list)
+        self._ids_by_type: Dict[str, List[int]] = defaultdict(list)
+        self._ids_by_tag: Dict[str, List[int]] = defaultdict(list)
+        self._selector_cache: Dict[Tuple, Tuple[np.ndarray, faiss.IDSelector]] = {}
+
+    @classmethod
+    def open(cls, store_dir) -> "MemoryStore":
+        """Returns the process-wide store for a directory, creating it on first use."""
+        key = str(Path(store_dir).resolve())
+        with cls._open_lock:
+            if key not in cls._open_stores:
+                cls._open_stores[key] = cls(Path(store_dir))
+            return cls._open_stores[key]
+
+    def _create_schema(self):
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT,
+                session_id TEXT,
+                type TEXT NOT NULL,
+                tool_name TEXT,
+                user_query TEXT,
+                tags TEXT NOT NULL,
+                text TEXT NOT NULL,
+                timestamp TEXT
+            );
+            CREATE INDEX IF NOT EXISTS items_partition ON items (user_id, session_id);
+            CREATE INDEX IF NOT EXISTS items_type_time ON items (type, timestamp);
+            CREATE TABLE IF NOT EXISTS pending_vectors (id INTEGER PRIMARY KEY, vector BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+
+    # --- loading and syncing ---
+
+    def _meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key: str, value) -> None:
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _load(self):
+        """(Re)loads the index file, replays logged vectors and rebuilds the filter ID lists."""
+        self.index = None
+        index_file = self._meta("index_file")
+        if self.persistent and index_file and (self.store_dir / index_file).exists():
+            self.index = faiss.read_index(str(self.store_dir / index_file))
+        self._generation = self._meta("generation", "0")
+        self._items.clear()
+        for ids in (self._ids_by_user, self._ids_by_session, self._ids_by_type, self._ids_by_tag):
+            ids.clear()
+        self._selector_cache.clear()
+        self._synced_id = 0
+        self._apply_new_rows()
+        self._loaded = True
+
+    def _apply_new_rows(self):
+        """Adds rows committed since the last sync (by any process) to the index and filters."""
+        vectors = self._db.execute(
+            "SELECT id, vector FROM pending_vectors WHERE id > ? ORDER BY id", (self._synced_id,)
+        ).fetchall()
+        if vectors:
+            dim = self._dim()
+            ids = np.array([row[0] for row in vectors], dtype=np.int64)
+            embeddings = np.stack([np.frombuffer(row[1], dtype=np.float32, count=dim) for row in vectors])
+            self._ensure_index(dim)
+            self.index.add_with_ids(embeddings, ids)
+
+        rows = self._db.execute(
+            "SELECT id, user_id, session_id, type, tags FROM items WHERE id > ? ORDER BY id", (self._synced_id,)
+        ).fetchall()
+        for item_id, user_id, session_id, item_type, tags in rows:
+            self._index_filters(item_id, user_id, session_id, item_type, json.loads(tags))
+        if rows:
+            self._synced_id = rows[-1][0]
+            self._selector_cache.clear()
+
+    def _ensure_fresh(self):
+        if not self._loaded:
+            self._load()
+        elif self.persistent:
+            if self._meta("generation", "0") != self._generation:
+                # Another process checkpointed or evicted; start from its index file
+                self._load()
+            else:
+                self._apply_new_rows()
+
+    def _dim(self) -> int:
+        return int(self._meta("dim"))
+
+    def _ensure_index(self, dim: int):
+        if self.index is None:
+            self.index = faiss.IndexIDMap2(new_index(dim, self.codec))
+
+    def _index_filters(self, item_id, user_id, session_id, item_type, tags):
+        if user_id:
+            self._ids_by_user[user_id].append(item_id)
+        if session_id:
+            self._ids_by_session[session_id].append(item_id)
+        self._ids_by_type[item_type].append(item_id)
+        for tag in tags:
+            self._ids_by_tag[tag].append(item_id)
+
+    # --- writes ---
+
+    def add(self, items: List[MemoryItem], embeddings: np.ndarray) -> List[int]:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Catch up on other writers while holding the write lock, so IDs stay ordered
+                if self._meta("dim") is None:
+                    self._set_meta("dim", embeddings.shape[1])
+                self._ensure_fresh()
+                ids = []
+                for item, embedding in zip(items, embeddings):
+                    cur = self._db.execute(
+                        "INSERT INTO items (user_id, session_id, type, tool_name, user_query, tags, text, timestamp) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (item.user_id, item.session_id, item.type, item.tool_name, item.user_query,
+                         json.dumps(item.tags), item.text, item.timestamp)
+                    )
+                    ids.append(cur.lastrowid)
+                    if self.persistent:
+                        self._db.execute(
+                            "INSERT INTO pending_vectors (id, vector) VALUES (?, ?)",
+                            (cur.lastrowid, np.ascontiguousarray(embedding, dtype=np.float32).tobytes())
+                        )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+            self._ensure_index(embeddings.shape[1])
+            self.index.add_with_ids(embeddings, np.array(ids, dtype=np.int64))
+            for item_id, item in zip(ids, items):
+                self._items[item_id] = item
+                self._index_filters(item_id, item.user_id, item.session_id, item.type, item.tags)
+            self._synced_id = max(self._synced_id, ids[-1])
+            self._selector_cache.clear()
+
+            if self.persistent and self._pending_count() >= CHECKPOINT_EVERY:
+                self.checkpoint()
+            return ids
+
+    def _pending_count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM pending_vectors").fetchone()[0]
+
+    def checkpoint(self):
+        """Folds logged vectors into a new index file and clears the log."""
+        if not self.persistent:
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._ensure_fresh()
+                old_file = self._meta("index_file")
+                generation = int(self._meta("generation", "0")) + 1
+                new_file = f"memory.{generation}.index"
+                if self.index is not None:
+                    faiss.write_index(self.index, str(self.store_dir / new_file))
+                    self._set_meta("index_file", new_file)
+                self._db.execute("DELETE FROM pending_vectors")
+                self._set_meta("generation", generation)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            # The commit above is what switches readers to the new file
+            self._generation = str(generation)
+            if old_file and old_file != self._meta("index_file"):
+                (self.store_dir / old_file).unlink(missing_ok=True)
+
+    def evict(
+        self,
+        max_tool_output_age_days: Optional[float] = MAX_TOOL_OUTPUT_AGE_DAYS,
+        max_tool_outputs_per_user: Optional[int] = MAX_TOOL_OUTPUTS_PER_USER
+    ) -> int:
+        """Drops tool outputs that are too old or beyond the per-user cap, then compacts."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._ensure_fresh()
+                doomed = set()
+                if max_tool_output_age_days is not None:
+                    cutoff = (datetime.now() - timedelta(days=max_tool_output_age_days)).isoformat()
+                    doomed.update(row[0] for row in self._db.execute(
+                        "SELECT id FROM items WHERE type = 'tool_output' AND timestamp < ?", (cutoff,)
+                    ))
+                if max_tool_outputs_per_user is not None:
+                    doomed.update(row[0] for row in self._db.execute(
+                        "SELECT id FROM (SELECT id, ROW_NUMBER() OVER ("
+                        "  PARTITION BY user_id ORDER BY timestamp DESC, id DESC) AS rank "
+                        "  FROM items WHERE type = 'tool_output') WHERE rank > ?",
+                        (max_tool_outputs_per_user,)
+                    ))
+                if doomed:
+                    ids = np.array(sorted(doomed), dtype=np.int64)
+                    self._db.executemany("DELETE FROM items WHERE id = ?", [(int(i),) for i in ids])
+                    self._db.executemany("DELETE FROM pending_vectors WHERE id = ?", [(int(i),) for i in ids])
+                    self._set_meta("generation", int(self._meta("generation", "0")) + 1)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+            if doomed:
+                # Reload (the generation moved), drop the evicted vectors, then persist the compacted index
+                self._ensure_fresh()
+                if self.index is not None:
+                    self.index.remove_ids(faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids)))
+                self.compact()
+            return len(doomed)
+
+    def compact(self):
+        """Checkpoints the index and reclaims SQLite space left by deleted rows."""
+        self.checkpoint()
+        if self.persistent:
+            with self._lock:
+                self._db.execute("VACUUM")
+
+    def maintain_once(self):
+        """Runs eviction the first time a persistent store is used in this process."""
+        if self.persistent and not self._maintained:
+            self._maintained = True
+            evicted = self.evict()
+            if evicted:
+                annotate(evicted=evicted)
+
+    # --- reads ---
+
+    def _candidate_ids(self, filters: Dict[str, Optional[object]]) -> Optional[np.ndarray]:
+        """Intersects the per-filter ID lists; None means no filtering."""
+        id_sets = []
+        if filters["user"]:
+            id_sets.append(set(self._ids_by_user.get(filters["user"], [])))
+        if filters["session"]:
+            id_sets.append(set(self._ids_by_session.get(filters["session"], [])))
+        if filters["type"]:
+            id_sets.append(set(self._ids_by_type.get(filters["type"], [])))
+        if filters["tags"]:
+            id_sets.append({i for tag in filters["tags"] for i in self._ids_by_tag.get(tag, [])})
+        if filters["exclude_session"]:
+            excluded = set(self._ids_by_session.get(filters["exclude_session"], []))
+            base = set.intersection(*id_sets) if id_sets else set(self._all_ids())
+            return np.array(sorted(base - excluded), dtype=np.int64)
+        if not id_sets:
+            return None
+        return np.array(sorted(set.intersection(*id_sets)), dtype=np.int64)
+
+    def _all_ids(self) -> List[int]:
+        return [i for ids in self._ids_by_type.values() for i in ids]
+
+    def _selector(self, filters: Dict[str, Optional[object]]) -> Optional[Tuple[np.ndarray, faiss.IDSelector]]:
+        key = tuple((name, tuple(sorted(value)) if isinstance(value, list) else value)
+                    for name, value in sorted(filters.items()))
+        if key not in self._selector_cache:
+            ids = self._candidate_ids(filters)
+            if ids is None:
+                return None
+            # The selector points into ids, so both are cached together
+            self._selector_cache[key] = (ids, faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids)))
+        return self._selector_cache[key]
+
+    def _fetch(self, ids: List[int]) -> List[MemoryItem]:
+        """Items by ID, loading from SQLite only those not already cached."""
+        missing = [i for i in ids if i not in self._items]
+        if missing:
+            placeholders = ",".join("?" * len(missing))
+            for row in self._db.execute(
+                "SELECT id, user_id, session_id, type, tool_name, user_query, tags, text, timestamp "
+                f"FROM items WHERE id IN ({placeholders})", missing
+            ):
+                self._items[row[0]] = MemoryItem(
+                    user_id=row[1], session_id=row[2], type=row[3], tool_name=row[4],
+                    user_query=row[5], tags=json.loads(row[6]), text=row[7], timestamp=row[8]
+                )
+        return [self._items[i] for i in ids if i in self._items]
+
+    def search(self, query_vec: np.ndarray, top_k: int, **filters) -> List[MemoryItem]:
+        with self._lock:
+            self._ensure_fresh()
+            if self.index is None or self.index.ntotal == 0:
+                return []
+            selector = self._selector(filters)
+            candidates = self.index.ntotal if selector is None else len(selector[0])
+            k = min(top_k, candidates)
+            if k == 0:
+                return []
+            if selector is None:
+                D, I = self.index.search(query_vec, k)
+            else:
+                D, I = self.index.search(query_vec, k, params=faiss.SearchParameters(sel=selector[1]))
+            annotate(candidates=candidates)
+            return self._fetch([int(idx) for idx in I[0] if idx >= 0])
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_fresh()
+            return 0 if self.index is None else self.index.ntotal
 
 
 class MemoryManager:
-    def __init__(self, embedding_model_url="http://localhost:11434/api/embeddings", model_name="nomic-embed-text"):
+    def __init__(
+        self,
+        embedding_model_url=os.getenv("EMBED_URL", "http://localhost:11434/api/embeddings"),
+        model_name="nomic-embed-text",
+        store_dir: Optional[str] = None,
+        user_id: Optional[str] = None,
+        write_behind: bool = False
+    ):
         self.embedding_model_url = embedding_model_url
+        # Ollama's batched endpoint lives next to the single-prompt one
+        self.batch_embedding_url = embedding_model_url.replace("/api/embeddings", "/api/embed")
         self.model_name = model_name
-        self.index = None
-        self.data: List[MemoryItem] = []
-        self.embeddings: List[np.ndarray] = []
+        # With a store_dir, memories outlive this manager and are shared across sessions
+        self.store = MemoryStore.open(store_dir) if store_dir else MemoryStore()
+        self.user_id = user_id
+        self._last_query: Optional[Tuple[str, np.ndarray]] = None
+
+        # Write-behind: adds are queued and embedded by a background thread in batches,
+        # so the caller's next LLM call overlaps the embedding round trip
+        self.write_behind = write_behind
+        self.write_errors = 0
+        self._queue: List[MemoryItem] = []
+        self._in_flight = 0
+        self._queue_cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+        self._trace_session: Optional[str] = None
+
+    @property
+    def index(self):
+        return self.store.index
 
     def _get_embedding(self, text: str) -> np.ndarray:
         response = requests.post(
@@ -34,54 +422,135 @@ class MemoryManager:
         response.raise_for_status()
         return np.array(response.json()["embedding"], dtype=np.float32)
 
+    def _get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Embeds texts in a single request, falling back to one request per text."""
+        if len(texts) == 1:
+            return self._get_embedding(texts[0]).reshape(1, -1)
+        try:
+            response = requests.post(
+                self.batch_embedding_url,
+                json={"model": self.model_name, "input": texts}
+            )
+            response.raise_for_status()
+            return np.array(response.json()["embeddings"], dtype=np.float32)
+        except (requests.RequestException, KeyError):
+            return np.stack([self._get_embedding(text) for text in texts])
+
+    def _query_embedding(self, query: str) -> np.ndarray:
+        # Agent steps often retrieve twice with the same query text
+        if self._last_query is None or self._last_query[0] != query:
+            self._last_query = (query, self._get_embedding(query).reshape(1, -1))
+        return self._last_query[1]
+
+    @traced("memory.add")
     def add(self, item: MemoryItem):
-        emb = self._get_embedding(item.text)
-        self.embeddings.append(emb)
-        self.data.append(item)
+        self.bulk_add([item])
 
-        # Initialize or add to index
-        if self.index is None:
-            self.index = faiss.IndexFlatL2(len(emb))
-        self.index.add(np.stack([emb]))
+    @traced("memory.bulk_add")
+    def bulk_add(self, items: List[MemoryItem]):
+        """Embeds all items in one batch and appends them with a single index.add.
+
+        With write_behind the items are only queued; they become visible to
+        retrieve() once written, and retrieve() waits for that.
+        """
+        if not items:
+            return
+        if self.write_behind:
+            self._enqueue(items)
+            annotate(queued=len(items))
+            return
+        self._write(items)
+
+    def _write(self, items: List[MemoryItem]):
+        self.store.maintain_once()
+        for item in items:
+            if item.user_id is None:
+                item.user_id = self.user_id
+        embeddings = self._get_embeddings([item.text for item in items])
+        self.store.add(items, embeddings)
+        annotate(items=len(items))
 
+    @traced("memory.retrieve")
     def retrieve(
         self,
         query: str,
         top_k: int = 3,
         type_filter: Optional[str] = None,
         tag_filter: Optional[List[str]] = None,
-        session_filter: Optional[str] = None
+        session_filter: Optional[str] = None,
+        exclude_session: Optional[str] = None
     ) -> List[MemoryItem]:
-        if not self.index or len(self.data) == 0:
+        """Nearest memories within this manager's user partition, optionally filtered further."""
+        # Queued writes must land first so results reflect everything added so far
+        self.flush()
+        self.store.maintain_once()
+        if len(self.store) == 0:
             return []
 
-        query_vec = self._get_embedding(query).reshape(1, -1)
-        D, I = self.index.search(query_vec, top_k * 2)  # Overfetch to allow filtering
+        results = self.store.search(
+            self._query_embedding(query),
+            top_k,
+            user=self.user_id,
+            session=session_filter,
+            type=type_filter,
+            tags=tag_filter,
+            exclude_session=exclude_session
+        )
+        annotate(returned=len(results))
+        return results
 
-        results = []
-        for idx in I[0]:
-            if idx >= len(self.data):
-                continue
-            item = self.data[idx]
+    # --- write-behind queue ---
 
-            # Filter by type
-            if type_filter and item.type != type_filter:
-                continue
+    def _enqueue(self, items: List[MemoryItem]):
+        with self._queue_cond:
+            if self._closed:
+                raise RuntimeError("MemoryManager is closed")
+            self._queue.extend(items)
+            self._trace_session = current_session()
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._drain, name="memory-write-behind", daemon=True)
+                self._worker.start()
+            self._queue_cond.notify_all()
 
-            # Filter by tags
-            if tag_filter and not any(tag in item.tags for tag in tag_filter):
-                continue
+    def _drain(self):
+        """Worker loop: takes everything queued so far and writes it as one batch."""
+        while True:
+            with self._queue_cond:
+                while not self._queue and not self._closed:
+                    self._queue_cond.wait()
+                if not self._queue and self._closed:
+                    return
+                batch, self._queue = self._queue, []
+                self._in_flight = len(batch)
+                set_session(self._trace_session)
+            try:
+                with span("memory.write_behind", items=len(batch)):
+                    self._write(batch)
+            except Exception as e:
+                self.write_errors += len(batch)
+                print(f"[memory] Write-behind failed for {len(batch)} item(s): {e}")
+            finally:
+                with self._queue_cond:
+                    self._in_flight = 0
+                    self._queue_cond.notify_all()
 
-            # Filter by session
-            if session_filter and item.session_id != session_filter:
-                continue
+    def pending(self) -> int:
+        """Items queued or being written."""
+        with self._queue_cond:
+            return len(self._queue) + self._in_flight
 
-            results.append(item)
-            if len(results) >= top_k:
-                break
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until every queued item has been written; False on timeout."""
+        if not self.write_behind:
+            return True
+        with self._queue_cond:
+            return self._queue_cond.wait_for(lambda: not self._queue and not self._in_flight, timeout)
 
-        return results
-
-    def bulk_add(self, items: List[MemoryItem]):
-        for item in items:
-            self.add(item)
+    def close(self):
+        """Flushes outstanding writes and stops the background worker."""
+        self.flush()
+        with self._queue_cond:
+            self._closed = True
+            self._queue_cond.notify_all()
+        if self._worker is not None:
+            self._worker.join()
@@ -3,7 +3,9 @@ from typing import Optional, List
 import os
 from dotenv import load_dotenv
 from google import genai
+from google.genai import types
 import re
+from tracing import traced, annotate
 
 # Optional: import log from agent if shared, else define locally
 try:
@@ -11,12 +13,17 @@ try:
 except ImportError:
     import datetime
     def log(stage: str, msg: str):
-        now = datetime.datetime.now().strftime("%H:%M:%S")
+        now = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
         print(f"[{now}] [{stage}] {msg}")
 
 load_dotenv()
 
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+# GEMINI_BASE_URL lets benchmarks point the client at a local stand-in
+_gemini_base_url = os.getenv("GEMINI_BASE_URL")
+client = genai.Client(
+    api_key=os.getenv("GEMINI_API_KEY"),
+    http_options=types.HttpOptions(base_url=_gemini_base_url) if _gemini_base_url else None
+)
 
 
 class PerceptionResult(BaseModel):
@@ -26,6 +33,7 @@ class PerceptionResult(BaseModel):
     tool_hint: Optional[str] = None
 
 
+@traced("perception")
 def extract_perception(user_input: str) -> PerceptionResult:
     """Extracts intent, entities, and tool hints using LLM"""
 
@@ -66,6 +74,7 @@ Output only the dictionary on a single line. Do NOT wrap it in ```json or other
         if isinstance(parsed.get("entities"), dict):
             parsed["entities"] = list(parsed["entities"].values())
 
+        annotate(tool_hint=parsed.get("tool_hint"))
         return PerceptionResult(user_input=user_input, **parsed)
 
     except Exception as e:
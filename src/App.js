@@ -119,7 +119,16 @@ function App() {
       setSchemes([]);
     } catch (error) {
       console.error("Error processing query:", error);
-      
+
+      // The agent queue is full; the API is up, so don't fall back to mock data
+      if (error.response && error.response.status === 429) {
+        const retryAfter = error.response.headers['retry-after'];
+        setSessionStatus('error');
+        setFinalAnswer(`The agent is busy with other queries. Please try again in ${retryAfter || 'a few'} seconds.`);
+        setIsProcessing(false);
+        return;
+      }
+
       // Fallback to mock data if API is not available
       console.log("Using mock data instead");
       
@@ -0,0 +1,177 @@
+# tracing.py
+
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).parent.resolve()
+TRACE_FILE = Path(os.getenv("TRACE_FILE", ROOT / "logs" / "traces.jsonl"))
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") != "0"
+
+# Histogram bucket upper bounds in seconds
+DURATION_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# The MCP server is a separate process, so the agent hands it the session ID via env
+_session_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "trace_session_id", default=os.getenv("AGENT_SESSION_ID")
+)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_current_span", default=None)
+_export_lock = threading.Lock()
+
+
+class Span:
+    """A timed unit of work; durations come from the monotonic perf counter"""
+
+    def __init__(self, name: str, parent: Optional["Span"], session_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.session_id = session_id
+        self.attributes = attributes
+        self.start_unix_ns = time.time_ns()
+        self._start_ns = time.perf_counter_ns()
+        self.duration_ms: Optional[float] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self) -> None:
+        self.duration_ms = (time.perf_counter_ns() - self._start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "session_id": self.session_id,
+            "start_unix_ns": self.start_unix_ns,
+            "duration_ms": round(self.duration_ms or 0.0, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+            "pid": os.getpid(),
+        }
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition shape"""
+
+    def __init__(self, buckets: List[float] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, span_name: str, seconds: float) -> None:
+        with self._lock:
+            self._histograms.setdefault(span_name, Histogram()).observe(seconds)
+
+    def render(self) -> str:
+        """Render all span histograms in Prometheus text format"""
+        metric = "agent_span_duration_seconds"
+        lines = [
+            f"# HELP {metric} Duration of traced agent pipeline spans.",
+            f"# TYPE {metric} histogram",
+        ]
+        with self._lock:
+            for name, hist in sorted(self._histograms.items()):
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f'{metric}_bucket{{span="{name}",le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{span="{name}",le="+Inf"}} {hist.count}')
+                lines.append(f'{metric}_sum{{span="{name}"}} {hist.total:.6f}')
+                lines.append(f'{metric}_count{{span="{name}"}} {hist.count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def set_session(session_id: Optional[str]) -> contextvars.Token:
+    """Tie all spans started in the current context to this session"""
+    return _session_id.set(session_id)
+
+
+def current_session() -> Optional[str]:
+    return _session_id.get()
+
+
+def annotate(**attributes: Any) -> None:
+    """Attach attributes to the active span, if any"""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def _export(record: Dict[str, Any]) -> None:
+    try:
+        TRACE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(record, default=str) + "\n"
+        with _export_lock:
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError:
+        # Tracing must never break the pipeline
+        pass
+
+
+@contextmanager
+def span(name: str, **attributes: Any):
+    """Time a block as a span, nested under whichever span is active"""
+    current = Span(name, _current_span.get(), _session_id.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end()
+        _current_span.reset(token)
+        metrics.observe(name, current.duration_ms / 1000.0)
+        if TRACING_ENABLED:
+            _export(current.to_dict())
+
+
+def traced(name: Optional[str] = None):
+    """Decorator form of span(); keeps the wrapped signature for tool registries"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
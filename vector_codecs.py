@@ -0,0 +1,56 @@
+# vector_codecs.py
+
+import os
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+# How vectors are stored: float32 ("flat"), float16, or 8-bit scalar-quantized codes.
+# fp16 halves the index and needs no training; sq8 quarters it but is trained on the data it indexes
+CODECS = ("flat", "fp16", "sq8")
+_QUANTIZERS = {"fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+
+# FAISS >= 1.9 maps IndexFlat / IndexScalarQuantizer codes straight from the file
+MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def new_index(dim: int, codec: str = "flat") -> faiss.Index:
+    """An empty L2 index for the codec; sq8 indexes must be trained before adding"""
+    if codec not in CODECS:
+        raise ValueError(f"Unknown vector codec {codec!r}, expected one of {CODECS}")
+    if codec == "flat":
+        return faiss.IndexFlatL2(dim)
+    return faiss.IndexScalarQuantizer(dim, _QUANTIZERS[codec], faiss.METRIC_L2)
+
+
+def build_index(vectors: np.ndarray, codec: str = "flat") -> faiss.Index:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = new_index(vectors.shape[1], codec)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def codec_of(index: faiss.Index) -> str:
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        qtype = index.sq.qtype
+        return next(name for name, q in _QUANTIZERS.items() if q == qtype)
+    return "flat"
+
+
+def read_index(path: Path, mmap: bool = False) -> faiss.Index:
+    """Load an index; with mmap the vectors stay in the page cache, shared by every process.
+
+    A memory-mapped index is read-only: adding to it aborts inside FAISS.
+    """
+    return faiss.read_index(str(path), MMAP_FLAG if mmap else 0)
+
+
+def write_index(index: faiss.Index, path: Path) -> None:
+    # Readers, including processes that mapped the old file, never see a half-written index
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp")
+    faiss.write_index(index, str(tmp))
+    os.replace(tmp, path)
@@ -0,0 +1,109 @@
+# worker.py
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+import agent_runner
+from agent_runner import log, run_agent_task
+from job_store import JOB_LEASE_S, JobStore
+
+# Agent runs each worker process keeps in progress at once
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "1"))
+# How often an idle worker looks for a queued job
+WORKER_POLL_S = float(os.getenv("WORKER_POLL_S", "0.2"))
+# How often a running session's changes are saved for the API to serve
+SESSION_FLUSH_S = float(os.getenv("SESSION_FLUSH_S", "0.25"))
+
+
+async def flush_session(store: JobStore, session_id: str) -> None:
+    """Saves the session whenever it changes, and at least a few times per lease so the job stays claimed"""
+    saved, saved_at = None, 0.0
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_S)
+        state = json.dumps(agent_runner.sessions.get(session_id), default=str)
+        if state != saved or time.time() - saved_at > JOB_LEASE_S / 4:
+            await asyncio.to_thread(store.save_session, session_id, json.loads(state))
+            saved, saved_at = state, time.time()
+
+
+async def run_job(store: JobStore, job) -> None:
+    session_id = job["session_id"]
+    agent_runner.sessions[session_id] = await asyncio.to_thread(store.load_session, session_id) or {}
+    flusher = asyncio.create_task(flush_session(store, session_id))
+    try:
+        await run_agent_task(session_id, job["query"], job["user_id"])
+    finally:
+        flusher.cancel()
+        await asyncio.gather(flusher, return_exceptions=True)
+        await asyncio.to_thread(store.save_session, session_id, agent_runner.sessions.pop(session_id, {}))
+        await asyncio.to_thread(store.finish, session_id)
+
+
+async def serve_slot(store: JobStore, worker_id: str) -> None:
+    while True:
+        job = await asyncio.to_thread(store.claim, worker_id)
+        if job is None:
+            await asyncio.sleep(WORKER_POLL_S)
+            continue
+        log("worker", f"{worker_id} running session {job['session_id']}, "
+                      f"queued {time.time() - job['enqueued_at']:.1f}s")
+        await run_job(store, job)
+
+
+async def serve(concurrency: int) -> None:
+    store = JobStore()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    log("worker", f"{worker_id} serving {concurrency} agent slots from {store.path}")
+    await asyncio.gather(*(serve_slot(store, worker_id) for _ in range(concurrency)))
+
+
+def exit_on_sigterm() -> None:
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+
+def run_worker(concurrency: int) -> None:
+    # A job cut short here is failed by the next claim once its lease runs out
+    exit_on_sigterm()
+    try:
+        asyncio.run(serve(concurrency))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent_runner.stop_mcp_server()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run queued agent sessions for the API in worker processes")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes to start")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="agent runs per process")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_worker(args.concurrency)
+        return
+    exit_on_sigterm()
+    processes = [multiprocessing.Process(target=run_worker, args=(args.concurrency,))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()